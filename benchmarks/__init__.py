@@ -0,0 +1,4 @@
+"""Benchmarks for GWCelery, for use with `airspeed velocity`_ (asv).
+
+.. _`airspeed velocity`: https://asv.readthedocs.io/
+"""
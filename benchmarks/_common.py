@@ -0,0 +1,57 @@
+"""Shared helpers for the benchmarks."""
+from importlib import resources
+import os
+import threading
+from unittest import mock
+
+from gwcelery import app
+from gwcelery.tests import data
+
+
+def setup_app():
+    """Configure the application for benchmarks.
+
+    Memoization is disabled so that every call does the full computation, and
+    the GraceDB client is replaced so that no network connections are made.
+
+    Returns
+    -------
+    patcher
+        Call its ``stop`` method in the benchmark's ``teardown`` method.
+
+    """
+    app.conf.update(memoize_expires=0, bayestar_batch=False)
+    patcher = mock.patch('gwcelery.tasks.gracedb.client',
+                         url='https://gracedb.invalid/api/')
+    patcher.start()
+    return patcher
+
+
+def read_binary(filename):
+    return resources.read_binary(data, filename)
+
+
+def _thread_count():
+    return len(os.listdir('/proc/self/task'))
+
+
+def max_threads(func, *args, interval=1e-3):
+    """Call a function and return the maximum number of threads that were
+    running in the process at once, including OpenMP threads, but not
+    including the thread that does the counting.
+    """
+    done = threading.Event()
+    counts = [_thread_count()]
+
+    def sample():
+        while not done.wait(interval):
+            counts.append(_thread_count() - 1)
+
+    thread = threading.Thread(target=sample, daemon=True)
+    thread.start()
+    try:
+        func(*args)
+    finally:
+        done.set()
+        thread.join()
+    return max(counts)
@@ -0,0 +1,29 @@
+"""Benchmarks for :mod:`gwcelery.tasks.bayestar`."""
+from gwcelery.tasks import bayestar
+
+from ._common import max_threads, read_binary, setup_app
+
+
+class Localize:
+    """Localize the event in ``coinc.xml`` and ``psd.xml.gz``."""
+
+    timeout = 600
+
+    def setup(self):
+        self.patcher = setup_app()
+        self.coinc_psd = (read_binary('coinc.xml'), read_binary('psd.xml.gz'))
+        bayestar._load_psd.cache_clear()
+
+    def teardown(self):
+        self.patcher.stop()
+
+    def time_localize(self):
+        bayestar.localize(self.coinc_psd, 'G211117')
+
+    def peakmem_localize(self):
+        bayestar.localize(self.coinc_psd, 'G211117')
+
+    def track_threads_localize(self):
+        return max_threads(bayestar.localize, self.coinc_psd, 'G211117')
+
+    track_threads_localize.unit = 'threads'
@@ -0,0 +1,22 @@
+"""Benchmarks for the data quality checks in :mod:`gwcelery.tasks.detchar`."""
+import numpy as np
+
+from gwcelery import app
+from gwcelery.tasks import detchar
+
+# A typical check window of a few seconds of 16 Hz state vector samples
+SAMPLES = [64, 1024]
+
+
+class EvaluateVector:
+    """Evaluate all of the bits of each kind of state vector."""
+
+    params = (list(app.conf['detchar_bit_definitions']), SAMPLES)
+    param_names = ['channel_type', 'samples']
+
+    def setup(self, channel_type, samples):
+        self.bits = app.conf['detchar_bit_definitions'][channel_type]['bits']
+        self.data = np.full(samples, 0xffff, dtype=np.int64)
+
+    def time_evaluate_vector(self, channel_type, samples):
+        detchar.evaluate_vector(self.data, 'H1:STATE_VECTOR', self.bits)
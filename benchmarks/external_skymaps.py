@@ -0,0 +1,75 @@
+"""Benchmarks for :mod:`gwcelery.tasks.external_skymaps`."""
+import gcn
+
+from gwcelery.tasks import external_skymaps
+
+from ._common import max_threads, read_binary, setup_app
+
+# Typical positions and 1-sigma (Fermi) or 90% (Swift) error radii, in degrees
+NOTICES = {
+    'Swift': (45.0, 30.0, 0.05, gcn.NoticeType.SWIFT_BAT_GRB_POS_ACK),
+    'Fermi': (45.0, 30.0, 5.0, gcn.NoticeType.FERMI_GBM_GND_POS)
+}
+
+
+class CreateExternalSkymap:
+    """Create sky maps for Swift and Fermi notices."""
+
+    params = list(NOTICES)
+    param_names = ['pipeline']
+
+    def setup(self, pipeline):
+        self.patcher = setup_app()
+        self.ra, self.dec, self.error, self.notice_type = NOTICES[pipeline]
+
+    def teardown(self, pipeline):
+        self.patcher.stop()
+
+    def run(self, pipeline):
+        external_skymaps.create_external_skymap(
+            self.ra, self.dec, self.error, pipeline, self.notice_type)
+
+    def time_create_external_skymap(self, pipeline):
+        self.run(pipeline)
+
+    def peakmem_create_external_skymap(self, pipeline):
+        self.run(pipeline)
+
+    def track_threads_create_external_skymap(self, pipeline):
+        return max_threads(self.run, pipeline)
+
+    track_threads_create_external_skymap.unit = 'threads'
+
+
+class CombineSkymaps:
+    """Combine a BAYESTAR sky map with a Fermi sky map."""
+
+    timeout = 600
+
+    def setup(self):
+        self.patcher = setup_app()
+        ra, dec, error, notice_type = NOTICES['Fermi']
+        skymap = external_skymaps.create_external_skymap(
+            ra, dec, error, 'Fermi', notice_type)
+        event = {'pipeline': 'Fermi',
+                 'gpstime': 1342571974.0,
+                 'extra_attributes': {'GRB': {'trigger_id': 680000000}},
+                 'links': {'self': 'https://gracedb.invalid/api/events/E1'}}
+        self.skymaps = (
+            read_binary('MS220722v_bayestar.multiorder.fits'),
+            external_skymaps.write_to_fits(
+                skymap, event, notice_type, '2022-07-22T00:39:16'))
+
+    def teardown(self):
+        self.patcher.stop()
+
+    def time_combine_skymaps(self):
+        external_skymaps.combine_skymaps(*self.skymaps)
+
+    def peakmem_combine_skymaps(self):
+        external_skymaps.combine_skymaps(*self.skymaps)
+
+    def track_threads_combine_skymaps(self):
+        return max_threads(external_skymaps.combine_skymaps, *self.skymaps)
+
+    track_threads_combine_skymaps.unit = 'threads'
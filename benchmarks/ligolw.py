@@ -0,0 +1,59 @@
+"""Benchmarks for reading ``coinc.xml`` and ``psd.xml.gz`` files."""
+from importlib import resources
+import io
+
+from lal.series import read_psd_xmldoc
+from ligo.lw import ligolw, lsctables
+from ligo.lw.utils import load_fileobj
+from ligo.skymap.io.events.ligolw import ContentHandler
+
+from gwcelery import util
+from gwcelery.tests import data
+
+READERS = ['ligo.lw', 'lxml', 'etree']
+
+
+def load_ligolw(filecontents):
+    return load_fileobj(io.BytesIO(filecontents),
+                        contenthandler=ContentHandler)
+
+
+class ReadPSD:
+    """Read all PSDs from ``psd.xml.gz``."""
+
+    params = READERS
+    param_names = ['reader']
+
+    def setup(self, reader):
+        self.filecontents = resources.read_binary(data, 'psd.xml.gz')
+
+    def time_read_psd(self, reader):
+        if reader == 'ligo.lw':
+            read_psd_xmldoc(load_ligolw(self.filecontents))
+        else:
+            root = util.parse_ligolw(
+                self.filecontents, use_lxml=(reader == 'lxml'))
+            util.read_ligolw_psds(root)
+
+
+class ReadCoinc:
+    """Load ``coinc.xml`` into :mod:`ligo.lw` and read the ``coinc_inspiral``
+    and ``sngl_inspiral`` tables.
+    """
+
+    params = READERS
+    param_names = ['reader']
+
+    def setup(self, reader):
+        self.filecontents = resources.read_binary(data, 'coinc.xml')
+
+    def time_read_coinc(self, reader):
+        if reader == 'ligo.lw':
+            xmldoc = load_ligolw(self.filecontents)
+        else:
+            root = util.parse_ligolw(
+                self.filecontents, use_lxml=(reader == 'lxml'))
+            xmldoc = ligolw.Document()
+            util.saxify_ligolw(root, ContentHandler(xmldoc))
+        lsctables.CoincInspiralTable.get_table(xmldoc)
+        lsctables.SnglInspiralTable.get_table(xmldoc)
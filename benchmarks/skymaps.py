@@ -0,0 +1,69 @@
+"""Benchmarks for :mod:`gwcelery.tasks.skymaps`."""
+from gwcelery.tasks import skymaps
+
+from ._common import max_threads, read_binary, setup_app
+
+SKYMAP = 'MS220722v_bayestar.multiorder.fits'
+
+
+class Annotate:
+    """Annotations of a multi-order sky map by
+    :meth:`~gwcelery.tasks.skymaps.annotate_fits`.
+    """
+
+    timeout = 600
+    params = ['fits_header', 'summarize', 'credible_contours', 'plot_allsky',
+              'plot_volume', 'flatten']
+    param_names = ['task']
+
+    def setup(self, task):
+        self.patcher = setup_app()
+        self.filecontents = read_binary(SKYMAP)
+        self.args = {
+            'fits_header': (SKYMAP,),
+            'flatten': ('bayestar.fits.gz',)
+        }.get(task, ())
+        skymaps._projection_grid.cache_clear()
+
+    def teardown(self, task):
+        self.patcher.stop()
+
+    def run(self, task):
+        getattr(skymaps, task)(self.filecontents, *self.args)
+
+    def time_annotate(self, task):
+        self.run(task)
+
+    def peakmem_annotate(self, task):
+        self.run(task)
+
+    def track_threads_annotate(self, task):
+        return max_threads(self.run, task)
+
+    track_threads_annotate.unit = 'threads'
+
+
+class SkymapFromSamples:
+    """Generate a sky map from ``samples.hdf5``."""
+
+    timeout = 1800
+    number = 1
+    repeat = 1
+
+    def setup(self):
+        self.patcher = setup_app()
+        self.filecontents = read_binary('samples.hdf5')
+
+    def teardown(self):
+        self.patcher.stop()
+
+    def time_skymap_from_samples(self):
+        skymaps.skymap_from_samples(self.filecontents)
+
+    def peakmem_skymap_from_samples(self):
+        skymaps.skymap_from_samples(self.filecontents)
+
+    def track_threads_skymap_from_samples(self):
+        return max_threads(skymaps.skymap_from_samples, self.filecontents)
+
+    track_threads_skymap_from_samples.unit = 'threads'
@@ -0,0 +1,43 @@
+"""Benchmarks for decoding GCN notices for external triggers."""
+import lxml.etree
+
+from gwcelery import util
+
+from ._common import read_binary
+
+FILENAMES = ['fermi_grb_gcn.xml', 'fermi_subthresh_grb_gcn.xml',
+             'swift_grb_gcn.xml', 'snews_gcn.xml']
+
+PARAMS = ['TrigID', 'Trans_Num', 'Packet_Type', 'Reliability',
+          'Most_Likely_Index', 'Most_Likely_Prob', 'HealPix_URL',
+          'LightCurve_URL']
+
+
+def find_params(payload):
+    """Look up the parameters one at a time, as the external trigger handlers
+    used to.
+    """
+    root = lxml.etree.fromstring(payload)
+    for name in PARAMS:
+        root.find("./What/Param[@name='{}']".format(name))
+    root.find("./What/Group[@name='Solution_Status']"
+              "/Param[@name='StarTrack_Lost_Lock']")
+    root.find('./Who/Date')
+
+
+class ReadGCNNotice:
+    """Decode the parameters of a GCN notice that the handlers for external
+    triggers need.
+    """
+
+    params = (['find', 'xpath'], FILENAMES)
+    param_names = ['reader', 'filename']
+
+    def setup(self, reader, filename):
+        self.payload = read_binary(filename)
+
+    def time_read_gcn_notice(self, reader, filename):
+        if reader == 'find':
+            find_params(self.payload)
+        else:
+            util.read_gcn_notice(self.payload)
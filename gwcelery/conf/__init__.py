@@ -49,9 +49,40 @@ worker_log_format = "[%(asctime)s: %(levelname)s/%(processName)s/%(threadName)s]
 
 # GWCelery-specific settings.
 
+memoize_expires = 7200
+"""Lifetime in seconds of memoized task results, such as sky map annotations,
+in the result backend (see :func:`gwcelery.util.cache.memoize`). Set to zero to
+disable memoization."""
+
+memoize_max_size = 16 * 1024**2
+"""Maximum size in bytes of a memoized task result. Larger results, such as
+flattened high-resolution sky maps, are recomputed every time instead of being
+stored in the result backend (see :func:`gwcelery.util.cache.memoize`)."""
+
+fetch_cache_expires = 86400
+"""Lifetime in seconds of files fetched over HTTP, such as Fermi sky maps, in
+the result backend (see :func:`gwcelery.util.fetch.fetch`). Set to zero to
+disable caching."""
+
 condor_accounting_group = 'ligo.dev.o3.cbc.pe.bayestar'
 """HTCondor accounting group for Celery workers launched with condor_submit."""
 
+autoscale_openmp_min_workers = 0
+"""Minimum number of extra OpenMP workers kept running by
+``gwcelery condor autoscale``, in addition to those in the main submit file."""
+
+autoscale_openmp_max_workers = 16
+"""Maximum number of extra OpenMP workers started by
+``gwcelery condor autoscale``."""
+
+autoscale_openmp_latency = 10.0
+"""Start extra OpenMP workers once tasks have been waiting in the ``openmp``
+queue for this many seconds."""
+
+autoscale_openmp_idle = 600.0
+"""Stop one extra OpenMP worker each time that the ``openmp`` queue has been
+empty for this many seconds."""
+
 expose_to_public = False
 """Set to True if events meeting the public alert threshold really should be
 exposed to the public."""
@@ -59,6 +90,10 @@ exposed to the public."""
 igwn_alert_group = 'gracedb-playground'
 """IGWN alert group."""
 
+igwn_alert_heartbeat_interval = 60.0
+"""Send the :obj:`~gwcelery.igwn_alert.signals.igwn_alert_heartbeat` signal
+this often, in seconds, while the IGWN alert listener is running."""
+
 gracedb_host = 'gracedb-playground.ligo.org'
 """GraceDB host."""
 
@@ -80,6 +115,13 @@ then completely disable the GCN listener."""
 email_host = 'imap.gmail.com'
 """IMAP hostname to receive the GCN e-mail notice formats."""
 
+bayestar_batch = True
+"""If True, then queue CBC events for BAYESTAR in Redis, so that each OpenMP
+worker localizes all of the events that are waiting by the time it is free, in
+order of alert priority (see
+:meth:`gwcelery.tasks.bayestar.localize_batched`). If False, then localize
+each event in a separate task."""
+
 superevent_d_t_start = {'gstlal': 1.0,
                         'spiir': 1.0,
                         'pycbc': 1.0,
@@ -330,6 +372,48 @@ raven_coincidence_windows = {'GRB_CBC': [-5, 1],
 superevents of the appropriate type are considered to be coincident if
 within time window of each other."""
 
+raven_index_retention = 86400.0
+"""Keep superevents and external events in the local index of recent events
+that RAVEN searches for coincidences (see
+:meth:`gwcelery.tasks.raven.index_event`) until this many seconds after their
+times. Searches for older coincidences query GraceDB instead. Set to zero to
+disable the index."""
+
+raven_index_max_gap = 600
+"""If the IGWN alert listener that feeds the local index of recent events
+that RAVEN searches for coincidences (see
+:meth:`gwcelery.tasks.raven.index_event`) has not reported that it is running
+for this many seconds, then assume that the index may have missed some
+events, and only search it for coincidences after the listener reports that
+it is running again (see :meth:`gwcelery.tasks.raven.index_heartbeat`). This
+must be longer than :obj:`igwn_alert_heartbeat_interval`."""
+
+external_trigger_index_retention = 86400.0
+"""Remember the GraceDB IDs of external events by their pipelines and trigger
+IDs for this many seconds after they are created, so that later GCN notices
+for the same triggers do not have to search GraceDB (see
+:meth:`gwcelery.tasks.external_triggers.index_trigger_id`). This is also how
+far back the index is backfilled from GraceDB when a worker starts. Set to
+zero to disable the index."""
+
+exttrig_partitions = 4
+"""Number of queues, ``exttrig-0`` through ``exttrig-<n-1>``, over which GCN
+notices for external triggers are partitioned by observatory and trigger ID
+(see :meth:`gwcelery.tasks.gcn.exttrig_partition`). Each of these queues must
+be consumed by a worker with a concurrency of 1 so that notices for the same
+trigger are handled in order. ``gwcelery condor submit`` starts one such
+worker for each queue, so changes to this setting take effect when GWCelery
+is resubmitted. Set to zero to handle all notices on the ``exttrig`` queue."""
+
+external_skymap_poll_interval = 10.0
+"""Interval in seconds between attempts to download official Fermi sky maps
+that were not yet available when their notices arrived (see
+:meth:`gwcelery.tasks.external_skymaps.poll_external_skymaps`)."""
+
+external_skymap_poll_timeout = 1200.0
+"""Stop trying to download an official Fermi sky map this many seconds after
+its notice arrived."""
+
 mock_events_simulate_multiple_uploads = False
 """If True, then upload each mock event several times in rapid succession with
 random jitter in order to simulate multiple pipeline uploads."""
@@ -8,7 +8,7 @@ from celery.utils.log import get_logger
 from hop.models import JSONBlob
 from igwn_alert import client
 
-from .signals import igwn_alert_received
+from .signals import igwn_alert_heartbeat, igwn_alert_received
 
 __all__ = ('Receiver',)
 
@@ -103,9 +103,17 @@ class Receiver(IGWNAlertBootStep):
             args=(_send_igwn_alert, consumer.app.conf['igwn_alert_topics']),
             name='IGWNReceiverThread')
         self.thread.start()
+        self._heartbeat = consumer.timer.call_repeatedly(
+            consumer.app.conf['igwn_alert_heartbeat_interval'],
+            self._send_heartbeat)
+
+    def _send_heartbeat(self):
+        if self._client.running and self.thread.is_alive():
+            igwn_alert_heartbeat.send(None)
 
     def stop(self, consumer):
         super().stop(consumer)
+        self._heartbeat.cancel()
         if self._client.running:
             self._client.running = False
             self._client.stream_obj._consumer.stop()
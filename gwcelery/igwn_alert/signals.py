@@ -18,3 +18,9 @@ topic : str
 payload : dict
     Alert dictionary
 """
+
+igwn_alert_heartbeat = Signal(name='igwn_alert_heartbeat')
+"""Fired every :obj:`~gwcelery.conf.igwn_alert_heartbeat_interval` seconds in
+the worker that runs the IGWN alert listener, for as long as the listener is
+running, so that consumers of IGWN alerts can tell whether they may have
+missed any."""
@@ -1,21 +1,89 @@
 """Rapid sky localization with :mod:`BAYESTAR <ligo.skymap.bayestar>`."""
+import functools
 import io
 import logging
+import pickle
+import time
 import urllib.parse
+import uuid
 
+from celery import signature
 from celery.exceptions import Ignore
-from ligo.lw.utils import load_fileobj
-from ligo.lw.utils.ligolw_add import merge_ligolws
+import lal
+from lal.series import make_psd_xmldoc
+from ligo.lw import ligolw
 from ligo.skymap import bayestar as _bayestar
 from ligo.skymap.io import events
 from ligo.skymap.io import fits
 
 from .. import app
+from ..util.ligolw import (parse_ligolw, read_ligolw_psds, remove_ligolw_psds,
+                           saxify_ligolw, serialize_ligolw)
 from . import gracedb
 
 log = logging.getLogger('BAYESTAR')
 
 
+def _psd_xmldoc(psds):
+    """Convert PSDs from :func:`gwcelery.util.ligolw.read_ligolw_psds` to a
+    :mod:`ligo.lw` document.
+
+    The arrays in the new document are already NumPy arrays, so the document
+    is much faster to read with :func:`lal.series.read_psd_xmldoc` than if it
+    had been parsed from XML by :mod:`ligo.lw`.
+    """
+    psddict = {}
+    for ifo, series in psds.items():
+        psd = lal.CreateREAL8FrequencySeries(
+            series.name, lal.LIGOTimeGPS(series.epoch), series.f0,
+            series.deltaF, lal.Unit(series.sampleUnits), len(series.data))
+        psd.data.data[:] = series.data
+        psddict[ifo] = psd
+    return make_psd_xmldoc(psddict)
+
+
+@functools.lru_cache(maxsize=8)
+def _load_psd(filecontents):
+    """Parse a ``psd.xml.gz`` file, or the PSDs that are embedded in a
+    ``coinc.xml`` file.
+
+    Pipelines upload the same PSDs for many events over the course of
+    several minutes, and parsing their large arrays is a significant part of
+    the setup for each localization. Since the OpenMP worker's pool processes
+    are long-lived, the parsed documents are cached in each process, keyed by
+    the contents of the PSDs.
+    """
+    return _psd_xmldoc(read_ligolw_psds(parse_ligolw(filecontents)))
+
+
+def _load_coinc(filecontents):
+    """Parse a ``coinc.xml`` file.
+
+    The file is parsed only once, with the fast reader in
+    :mod:`gwcelery.util.ligolw`. If the PSDs are embedded in the file, then
+    they are removed from the parsed document and read by :func:`_load_psd`,
+    keyed by their XML, so that PSDs that were already read for an earlier
+    event are not read again. The rest of the document is loaded into
+    :mod:`ligo.lw` without parsing it again.
+
+    Returns
+    -------
+    doc : :class:`ligo.lw.ligolw.Document`
+        The document, without PSDs.
+    psd_doc : :class:`ligo.lw.ligolw.Document`, None
+        A document containing only the PSDs, or None if there were none.
+
+    """
+    root = parse_ligolw(filecontents)
+    psd_elems = remove_ligolw_psds(root)
+    doc = ligolw.Document()
+    saxify_ligolw(root, events.ligolw.ContentHandler(doc))
+    if not psd_elems:
+        return doc, None
+    psd_contents = b''.join(serialize_ligolw(elem) for elem in psd_elems)
+    return doc, _load_psd(b'<LIGO_LW>' + psd_contents + b'</LIGO_LW>')
+
+
 @app.task(queue='openmp', shared=False)
 def localize(coinc_psd, graceid, filename='bayestar.fits.gz',
              disabled_detectors=None):
@@ -26,7 +94,8 @@ def localize(coinc_psd, graceid, filename='bayestar.fits.gz',
     ----------
     coinc_psd : tuple
         Tuple consisting of the byte contents of the input event's
-        ``coinc.xml`` and ``psd.xml.gz`` files.
+        ``coinc.xml`` and, if the PSDs are not embedded in it, ``psd.xml.gz``
+        files.
     graceid : str
         The GraceDB ID, used for FITS metadata and recording log messages
         to GraceDB.
@@ -58,15 +127,19 @@ def localize(coinc_psd, graceid, filename='bayestar.fits.gz',
         # A little bit of Cylon humor
         log.info('by your command...')
 
-        # Combine coinc.xml and psd.xml.gz into one XML document
-        doc = None
-        for filecontents in coinc_psd:
-            doc = load_fileobj(io.BytesIO(filecontents), xmldoc=doc,
-                               contenthandler=events.ligolw.ContentHandler)
-        merge_ligolws(doc)
+        # Parse coinc.xml. Pipelines that do not embed the PSDs in coinc.xml
+        # upload them in a separate psd.xml.gz file. Either way, the parsed
+        # PSDs are cached on their contents.
+        coinc, *psd = coinc_psd
+        doc, psd_doc = _load_coinc(coinc)
+        if psd:
+            psd_doc = _load_psd(*psd)
+        elif psd_doc is None:
+            psd_doc = doc
 
         # Parse event
-        event_source = events.ligolw.open(doc, psd_file=doc, coinc_def=None)
+        event_source = events.ligolw.open(
+            doc, psd_file=psd_doc, coinc_def=None)
         if disabled_detectors:
             event_source = events.detector_disabled.open(
                 event_source, disabled_detectors)
@@ -86,3 +159,120 @@ def localize(coinc_psd, graceid, filename='bayestar.fits.gz',
             return f.getvalue()
     except events.DetectorDisabledError:
         raise Ignore()
+
+
+PENDING_KEY = 'gwcelery-bayestar-pending'
+"""Key of the Redis sorted set of the IDs of the events that are waiting for
+:meth:`localize_pending`."""
+
+PAYLOADS_KEY = 'gwcelery-bayestar-payloads'
+"""Key of the Redis hash of the input files and callbacks of the events that
+are waiting for :meth:`localize_pending`, by their IDs in
+:obj:`PENDING_KEY`."""
+
+
+@app.task(shared=False, ignore_result=True)
+def localize_batched(coinc_psd, graceid, priority=0, callback=None):
+    """Queue an event for sky localization by :meth:`localize_pending`.
+
+    When several pipelines upload the same signal at nearly the same time,
+    this lets a single OpenMP worker localize all of the events that are
+    waiting by the time it is free, instead of each event occupying an OpenMP
+    worker of its own.
+
+    Parameters
+    ----------
+    coinc_psd : tuple
+        The byte contents of the input event's files, as for :meth:`localize`.
+    graceid : str
+        The GraceDB ID.
+    priority : int
+        The task priority: 0 for events that should be published, or 1
+        otherwise (see :meth:`gwcelery.tasks.superevents.should_publish`).
+        Events that are waiting are localized in order of priority, and then
+        in the order in which they were queued.
+    callback : celery.canvas.Signature, optional
+        A task to call with the byte contents of the finished FITS file.
+
+    """
+    # Each request gets an ID of its own, so that identical requests are all
+    # kept. Only the ID goes in the sorted set, so that scanning the queue
+    # does not transfer the contents of the files.
+    entry_id = uuid.uuid4().hex
+    # The integer part of the score is the priority, and the fractional part
+    # preserves the order in which events were queued.
+    score = priority + time.time() * 1e-10
+    client = app.backend.client
+    client.hset(PAYLOADS_KEY, entry_id,
+                pickle.dumps((coinc_psd, graceid, priority, callback)))
+    client.zadd(PENDING_KEY, {entry_id: score})
+    localize_pending.apply_async(priority=priority)
+
+
+CLAIM_KEY_PREFIX = 'gwcelery-bayestar-claim-'
+"""Prefix of the Redis keys that record which instance of
+:meth:`localize_pending` is localizing each waiting event."""
+
+CLAIM_EXPIRES = 3600
+"""Lifetime in seconds of a claim on a waiting event. If the worker that
+claimed an event dies without the task being redelivered, then another
+instance of :meth:`localize_pending` may claim the event after this time."""
+
+
+def _claim(client, entry_id, task_id):
+    """Claim the waiting event with the ID `entry_id` for the task `task_id`.
+
+    Returns the key of the claim, or None if another task has claimed the
+    event. A task that is redelivered after its worker died keeps the same ID,
+    so it may resume the event that it was localizing.
+    """
+    key = CLAIM_KEY_PREFIX + entry_id.decode()
+    if client.set(key, task_id, nx=True, ex=CLAIM_EXPIRES) or \
+            client.get(key) == task_id.encode():
+        return key
+    return None
+
+
+@app.task(bind=True, queue='openmp', shared=False, ignore_result=True,
+          acks_late=True, reject_on_worker_lost=True)
+def localize_pending(self):
+    """Localize all events that are waiting in the queue of
+    :meth:`localize_batched`, one after another in the same process.
+
+    Each finished sky map is passed to that event's callback. If more than one
+    instance of this task is running, then they share the events that are
+    waiting between them.
+
+    An event stays in the queue until its sky map has been passed to the
+    callback, and this task is acknowledged only after it returns, so if the
+    worker process is killed, then the task is redelivered and localizes the
+    event again. If sky localization fails, then the event is dropped from the
+    queue and the exception is raised. The remaining events are localized by
+    the other instances of this task, one of which is sent for every event.
+    """
+    client = app.backend.client
+    while True:
+        for entry_id in client.zrange(PENDING_KEY, 0, -1):
+            claim_key = _claim(client, entry_id, self.request.id)
+            if claim_key is not None:
+                break
+        else:
+            break
+        payload = client.hget(PAYLOADS_KEY, entry_id)
+        try:
+            if payload is None:
+                # Another task finished this event after we listed the queue.
+                continue
+            coinc_psd, graceid, priority, callback = pickle.loads(payload)
+            try:
+                filecontents = localize(coinc_psd, graceid)
+            except Ignore:
+                pass
+            else:
+                if callback is not None:
+                    signature(callback).apply_async(
+                        (filecontents,), priority=priority)
+        finally:
+            client.zrem(PENDING_KEY, entry_id)
+            client.hdel(PAYLOADS_KEY, entry_id)
+            client.delete(claim_key)
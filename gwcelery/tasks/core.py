@@ -61,6 +61,30 @@ class DispatchHandler(dict):
         key, *args = args
         return key, args, kwargs
 
+    def route(self, handler, *args, **kwargs):
+        r"""Determine execution options for one of the matching callbacks.
+
+        The default implementation returns no options, so that each callback
+        is sent to the queue that it was registered with. Override this to
+        route callbacks to different queues depending on their arguments.
+
+        Parameters
+        ----------
+        handler : celery.app.task.Task
+            The callback.
+        \*args
+            Arguments passed to :meth:`__call__`.
+        \*\*kwargs
+            Keyword arguments passed to :meth:`__call__`.
+
+        Returns
+        -------
+        dict
+            Execution options for :meth:`celery.canvas.Signature.set`.
+
+        """
+        return {}
+
     def __call__(self, *keys, **kwargs):
         r"""Create a new task and register it as a callback for handling the
         given keys.
@@ -81,10 +105,11 @@ class DispatchHandler(dict):
 
         return wrap
 
-    def dispatch(self, *args, **kwargs):
-        log.debug('considering dispatch: args=%r, kwargs=%r', args, kwargs)
+    def dispatch(self, *orig_args, **orig_kwargs):
+        log.debug('considering dispatch: args=%r, kwargs=%r',
+                  orig_args, orig_kwargs)
         try:
-            key, args, kwargs = self.process_args(*args, **kwargs)
+            key, args, kwargs = self.process_args(*orig_args, **orig_kwargs)
         except (TypeError, ValueError):
             log.exception('error unpacking key')
             return
@@ -96,5 +121,8 @@ class DispatchHandler(dict):
             log.warning('ignoring unrecognized key: %r', key)
         else:
             log.info('calling handlers %r for key %r', matching_handlers, key)
-            group([handler.s() for handler in matching_handlers]).apply_async(
-                args, kwargs)
+            group([
+                handler.s().set(
+                    **self.route(handler, *orig_args, **orig_kwargs))
+                for handler in matching_handlers
+            ]).apply_async(args, kwargs)
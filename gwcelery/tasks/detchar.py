@@ -14,8 +14,8 @@ References
 .. [DMT] https://wiki.ligo.org/DetChar/DmtDqVector
 
 """
+import functools
 import getpass
-import glob
 import io
 import json
 import socket
@@ -26,7 +26,7 @@ from celery import group
 from celery.utils.log import get_task_logger
 from glue.lal import Cache
 from gwdatafind import find_urls
-from gwpy.timeseries import Bits, StateVector, TimeSeries
+from gwpy.timeseries import TimeSeries, TimeSeriesDict
 from gwpy.plot import Plot
 import matplotlib.pyplot as plt
 import numpy as np
@@ -35,7 +35,7 @@ from . import gracedb
 from ..import app
 from ..import _version
 from ..jinja import env
-from ..util import closing_figures
+from ..util import closing_figures, frame_index
 
 
 __author__ = 'Geoffrey Mo <geoffrey.mo@ligo.org>'
@@ -47,6 +47,10 @@ def create_cache(ifo, start, end):
     """Find .gwf files and create cache. Will first look in the llhoft, and
     if the frames have expired from llhoft, will call gwdatafind.
 
+    The llhoft is looked up in a :class:`~gwcelery.util.frames.FrameIndex`
+    that is kept for the lifetime of the worker process, so only the files
+    that overlap the requested times are included in the cache.
+
     Parameters
     ----------
     ifo : str
@@ -69,19 +73,14 @@ def create_cache(ifo, start, end):
       <glue.lal.CacheEntry at 0x7fbae6b15828>]
 
     """
-    pattern = app.conf['llhoft_glob'].format(detector=ifo)
-    filenames = glob.glob(pattern)
-    cache = Cache.from_urls(filenames)
-
-    try:
-        cache_starttime = int(
-            list(cache.to_segmentlistdict().values())[0][0][0])
-    except IndexError:
-        log.exception('Files do not exist in llhoft_glob')
-        return cache  # returns empty cache
+    index = frame_index(app.conf['llhoft_glob'].format(detector=ifo))
+    cache_starttime = index.start
+    if cache_starttime is None:
+        log.error('Files do not exist in llhoft_glob')
+        return Cache()  # returns empty cache
 
     if start >= cache_starttime:  # required data is in llhoft
-        return cache
+        return Cache.from_urls(index.find(start, end))
 
     # otherwise, required data has left llhoft
     high_latency = app.conf['high_latency_frame_types'][ifo]
@@ -258,6 +257,99 @@ def dqr_json(state, summary):
     )
 
 
+def read_channels(cache, channels, start, end):
+    """Read several channels from the same frame files in one pass.
+
+    All of the channels are read together with
+    :meth:`gwpy.timeseries.TimeSeriesDict.read`, so that each frame file is
+    opened and decoded once rather than once per channel. If that fails, then
+    the channels are read one at a time, so that a channel that is missing
+    from the frames does not prevent the others from being checked.
+
+    Parameters
+    ----------
+    cache : :class:`glue.lal.Cache`
+        Cache from which to read.
+    channels : list
+        Names of the channels.
+    start, end : int or float
+        GPS start and end times desired.
+
+    Returns
+    -------
+    dict
+        Maps each channel to a :class:`numpy.ndarray` of its samples, or to
+        None if it could not be read.
+
+    """
+    data = dict.fromkeys(channels)
+    if not cache or not channels:
+        # FIXME: figure out how to get access to low-latency frames outside
+        # of the cluster. Until we figure that out, actual I/O errors have
+        # to be non-fatal.
+        return data
+    try:
+        series = TimeSeriesDict.read(cache, channels, start=start, end=end)
+    except (IndexError, RuntimeError, TypeError, ValueError):
+        # FIXME: TypeError above is due to
+        # https://github.com/gwpy/gwpy/issues/1211
+        if len(channels) > 1:
+            for channel in channels:
+                data.update(read_channels(cache, [channel], start, end))
+        else:
+            # FIXME: Change from log.exception to log.warning until this
+            # fixed, because it's saturating Sentry.
+            log.warning('Failed to read %s from low-latency frame files',
+                        *channels)
+    else:
+        data.update((channel, series[channel].value) for channel in channels)
+    return data
+
+
+def read_detector(ifo, channels, start, end):
+    """Create the cache for a detector and read its channels.
+
+    Parameters
+    ----------
+    ifo : str
+        Interferometer name (e.g. ``H1``).
+    channels : list
+        Names of the channels.
+    start, end : int or float
+        GPS start and end times desired.
+
+    Returns
+    -------
+    dict
+        Maps each channel to a :class:`numpy.ndarray` of its samples, or to
+        None if it could not be read (see :func:`read_channels`).
+
+    """
+    return read_channels(create_cache(ifo, start, end), channels, start, end)
+
+
+def evaluate_idq(data, channel):
+    """Find the maximum P(glitch) in an iDQ channel.
+
+    Parameters
+    ----------
+    data : :class:`numpy.ndarray` or None
+        Samples of the channel, as returned by :func:`read_channels`.
+    channel : str
+        which idq channel (pglitch)
+
+    Returns
+    -------
+    tuple
+        Tuple mapping iDQ channel to its maximum P(glitch), or to None if
+        there is no data.
+
+    """
+    if data is not None and len(data) > 0:
+        return (channel, float(np.max(data)))
+    return (channel, None)
+
+
 def check_idq(cache, channel, start, end):
     """Looks for iDQ frame and reads them.
 
@@ -282,19 +374,94 @@ def check_idq(cache, channel, start, end):
     ('H1:IDQ-PGLITCH-OVL-100-1000', 0.87)
 
     """
-    if cache:
-        try:
-            idq_prob = TimeSeries.read(
-                cache, channel, start=start, end=end)
-            return (channel, float(idq_prob.max().value))
-        except (IndexError, RuntimeError):
-            # FIXME: Change from log.exception to log.warning until this fixed,
-            # because it's saturating Sentry.
-            log.warning('Failed to read from low-latency iDQ frame files')
-    # FIXME: figure out how to get access to low-latency frames outside
-    # of the cluster. Until we figure that out, actual I/O errors have
-    # to be non-fatal.
-    return (channel, None)
+    data = read_channels(cache, [channel], start, end)
+    return evaluate_idq(data[channel], channel)
+
+
+@functools.lru_cache(maxsize=None)
+def _compile_bits(bits):
+    """Compile bit definitions into names and integer masks.
+
+    Parameters
+    ----------
+    bits : tuple
+        Pairs of bit numbers and names, sorted by bit number.
+
+    Returns
+    -------
+    names : tuple
+        Names of the bits.
+    masks : :class:`numpy.ndarray`
+        The mask of each bit, as :class:`numpy.uint32`.
+
+    """
+    numbers = np.asarray([number for number, _ in bits], dtype=np.uint32)
+    return (tuple(name for _, name in bits),
+            np.left_shift(np.uint32(1), numbers))
+
+
+def _bit_masks(bits):
+    """Get the names and masks of bits, compiling them only once per process.
+
+    Parameters
+    ----------
+    bits : dict, list, or :class:`gwpy.timeseries.Bits`
+        Either a dictionary that maps bit numbers to names, as in
+        :obj:`~gwcelery.conf.detchar_bit_definitions`, or a list of names
+        indexed by bit number, with None for unused bits.
+
+    """
+    if not isinstance(bits, dict):
+        bits = {number: name for number, name in enumerate(bits)
+                if name is not None}
+    return _compile_bits(tuple(sorted(bits.items())))
+
+
+def evaluate_vector(data, channel, bits, logic_type='all'):
+    """Check samples of a state vector against a bitmask.
+
+    Rather than testing each bit of each sample, the samples are reduced with
+    a single bitwise AND (for ``logic_type='all'``) or OR (for
+    ``logic_type='any'``), and then the result is tested against the masks of
+    all of the bits at once.
+
+    Parameters
+    ----------
+    data : :class:`numpy.ndarray` or None
+        Samples of the channel, as returned by :func:`read_channels`.
+    channel : str
+        Channel to look at, e.g. ``H1:DMT-DQ_VECTOR``.
+    bits : dict, list, or :class:`gwpy.timeseries.Bits`
+        Definitions of the bits in the channel: either a dictionary that maps
+        bit numbers to names, or a list of names indexed by bit number.
+    logic_type : str, optional
+        Type of logic to apply for vetoing.
+        If ``all``, then all samples in the window must pass the bitmask.
+        If ``any``, then one or more samples in the window must pass.
+
+    Returns
+    -------
+    dict
+        Maps each bit in channel to its state, or to None if there is no
+        data.
+
+    """
+    if logic_type not in ('any', 'all'):
+        raise ValueError("logic_type must be either 'all' or 'any'.")
+    else:
+        logic_map = {'any': np.bitwise_or, 'all': np.bitwise_and}
+    ifo = channel.split(':')[0]
+    names, masks = _bit_masks(bits)
+    # FIXME: In the playground environment, the Virgo state vector
+    # channel is stored as a float. Is this also the case in the
+    # production environment?
+    if data is not None and len(data) > 0:  # statevector must not be empty
+        value = logic_map[logic_type].reduce(
+            np.asarray(data).astype(np.uint32))
+        states = (value & masks) != 0
+        return {f'{ifo}:{name}': state
+                for name, state in zip(names, states.tolist())}
+    return {f'{ifo}:{name}': None for name in names}
 
 
 def check_vector(cache, channel, start, end, bits, logic_type='all'):
@@ -310,8 +477,8 @@ def check_vector(cache, channel, start, end, bits, logic_type='all'):
         Channel to look at, e.g. ``H1:DMT-DQ_VECTOR``.
     start, end : int or float
         GPS start and end times desired.
-    bits: :class:`gwpy.TimeSeries.Bits`
-        Definitions of the bits in the channel.
+    bits : dict, list, or :class:`gwpy.timeseries.Bits`
+        Definitions of the bits in the channel (see :func:`evaluate_vector`).
     logic_type : str, optional
         Type of logic to apply for vetoing.
         If ``all``, then all samples in the window must pass the bitmask.
@@ -336,35 +503,8 @@ def check_vector(cache, channel, start, end, bits, logic_type='all'):
     """
     if logic_type not in ('any', 'all'):
         raise ValueError("logic_type must be either 'all' or 'any'.")
-    else:
-        logic_map = {'any': np.any, 'all': np.all}
-    bitname = '{}:{}'
-    if cache:
-        try:
-            statevector = StateVector.read(cache, channel,
-                                           start=start, end=end, bits=bits)
-        except (IndexError, TypeError):
-            # FIXME: TypeError above is due to
-            # https://github.com/gwpy/gwpy/issues/1211
-            #
-            # FIXME: Change from log.exception to log.warning until this fixed,
-            # because it's saturating Sentry.
-            log.warning('Failed to read from low-latency frame files')
-        else:
-            # FIXME: In the playground environment, the Virgo state vector
-            # channel is stored as a float. Is this also the case in the
-            # production environment?
-            statevector = statevector.astype(np.uint32)
-            if len(statevector) > 0:  # statevector must not be empty
-                return {bitname.format(channel.split(':')[0], key):
-                        bool(logic_map[logic_type](
-                            value.value if len(value.value) > 0 else None))
-                        for key, value in statevector.get_bit_series().items()}
-    # FIXME: figure out how to get access to low-latency frames outside
-    # of the cluster. Until we figure that out, actual I/O errors have
-    # to be non-fatal.
-    return {bitname.format(channel.split(':')[0], key):
-            None for key in bits if key is not None}
+    data = read_channels(cache, [channel], start, end)
+    return evaluate_vector(data[channel], channel, bits, logic_type)
 
 
 @app.task(shared=False)
@@ -379,7 +519,8 @@ def check_vectors(event, graceid, start, end):
     GW170817.
 
     A cache is then created for H1, L1, and V1, regardless of the detectors
-    involved in the event. Then, the bits and channels specified in the
+    involved in the event, and the channels of each detector are read from it
+    (see :func:`read_detector`). Then, the bits and channels specified in the
     configuration file (:obj:`~gwcelery.conf.llhoft_channels`) are checked.
     If an injection is found in the active detectors, 'INJ' is labeled to
     GraceDB. If an injection is found in any detector, a message with the
@@ -392,6 +533,9 @@ def check_vectors(event, graceid, start, end):
     'DQOK' is labeled to GraceDB. Otherwise, 'DQV' is labeled. In all cases,
     the DQ states of all the state vectors checked are logged to GraceDB.
 
+    The label transitions are collected while the checks are evaluated, and
+    only the net changes are applied to GraceDB at the end, removals first.
+
     This skips MDC events.
 
     Parameters
@@ -421,7 +565,7 @@ def check_vectors(event, graceid, start, end):
                  event['graceid'])
         return event
 
-    # Create caches for all detectors
+    # Determine the detectors and the time window to check
     instruments = event['instruments'].split(',')
     pipeline = event['pipeline']
     pre, post = app.conf['check_vector_prepost'][pipeline]
@@ -431,9 +575,7 @@ def check_vectors(event, graceid, start, end):
 
     ifos = {key.split(':')[0] for key, val in
             app.conf['llhoft_channels'].items()}
-    caches = {ifo: create_cache(ifo, start, end) for ifo in ifos}
-    bit_defs = {channel_type: Bits(channel=bitdef['channel'],
-                                   bits=bitdef['bits'])
+    bit_defs = {channel_type: bitdef['bits']
                 for channel_type, bitdef
                 in app.conf['detchar_bit_definitions'].items()}
 
@@ -444,9 +586,23 @@ def check_vectors(event, graceid, start, end):
     if app.conf['uses_gatedhoft'][pipeline]:
         analysis_channels = {k: v for k, v in analysis_channels
                              if k[3:] != 'DMT-DQ_VECTOR'}.items()
+    idq_channels = app.conf['idq_channels']
+
+    # Read all of the channels for each detector in one pass over its frames.
+    data = {}
+    for ifo in ifos:
+        data.update(read_detector(
+            ifo,
+            [channel for channel in [*dict(analysis_channels), *idq_channels]
+             if channel.split(':')[0] == ifo],
+            start, end))
+
+    # Label transitions, applied together once all checks are done.
+    # Maps each label to True to add it or False to remove it.
+    label_changes = {}
+
     for channel, bits in analysis_channels:
-        states.update(check_vector(caches[channel.split(':')[0]], channel,
-                                   start, end, bit_defs[bits]))
+        states.update(evaluate_vector(data[channel], channel, bit_defs[bits]))
     # Pick out DQ and injection states, then filter for active detectors
     dq_states = {key: value for key, value in states.items()
                  if key.split('_')[-1] != 'INJ'}
@@ -458,9 +614,8 @@ def check_vectors(event, graceid, start, end):
                          if key.split(':')[0] in instruments}
 
     # Check iDQ states
-    idq_probs = dict(check_idq(caches[channel.split(':')[0]],
-                               channel, start, end)
-                     for channel in app.conf['idq_channels'])
+    idq_probs = dict(evaluate_idq(data.get(channel), channel)
+                     for channel in idq_channels)
 
     # Logging iDQ to GraceDB
     if None not in idq_probs.values():
@@ -471,14 +626,7 @@ def check_vectors(event, graceid, start, end):
                 json.dumps(idq_probs_readable)[1:-1])
             # If iDQ p(glitch) is high and pipeline enabled, apply DQV
             if app.conf['idq_veto'][pipeline]:
-                gracedb.remove_label('DQOK', graceid)
-                gracedb.create_label('DQV', graceid)
-                # Add labels to return value to avoid querying GraceDB again.
-                event = dict(event, labels=event.get('labels', []) + ['DQV'])
-                try:
-                    event['labels'].remove('DQOK')
-                except ValueError:  # not in list
-                    pass
+                label_changes.update(DQOK=False, DQV=True)
         else:
             idq_msg = ("iDQ glitch probabilities at both H1 and L1 "
                        "are good (below {} threshold). "
@@ -493,9 +641,7 @@ def check_vectors(event, graceid, start, end):
     # Labeling INJ to GraceDB
     if False in active_inj_states.values():
         # Label 'INJ' if injection found in active IFOs
-        gracedb.create_label('INJ', graceid)
-        # Add labels to return value to avoid querying GraceDB again.
-        event = dict(event, labels=event.get('labels', []) + ['INJ'])
+        label_changes['INJ'] = True
     if False in inj_states.values():
         # Write all found injections into GraceDB log
         injs = [k for k, v in inj_states.items() if v is False]
@@ -504,12 +650,7 @@ def check_vectors(event, graceid, start, end):
             generate_table('Injection bits', [], injs, []))
     elif all(inj_states.values()) and len(inj_states.values()) > 0:
         inj_msg = 'No HW injections found. '
-        gracedb.remove_label('INJ', graceid)
-        event = dict(event, labels=list(event.get('labels', [])))
-        try:
-            event['labels'].remove('INJ')
-        except ValueError:  # not in list
-            pass
+        label_changes['INJ'] = False
     else:
         inj_msg = 'Injection state unknown. '
     gracedb.upload.delay(
@@ -542,27 +683,31 @@ def check_vectors(event, graceid, start, end):
         None, None, graceid, msg + prepost_msg + gate_msg, ['data_quality'])
     if overall_dq_active_state is True:
         state = "pass"
-        gracedb.remove_label('DQV', graceid)
-        gracedb.create_label('DQOK', graceid)
-        # Add labels to return value to avoid querying GraceDB again.
-        event = dict(event, labels=event.get('labels', []) + ['DQOK'])
-        try:
-            event['labels'].remove('DQV')
-        except ValueError:  # not in list
-            pass
+        label_changes.update(DQV=False, DQOK=True)
     elif overall_dq_active_state is False:
         state = "fail"
-        gracedb.remove_label('DQOK', graceid)
-        gracedb.create_label('DQV', graceid)
-        # Add labels to return value to avoid querying GraceDB again.
-        event = dict(event, labels=event.get('labels', []) + ['DQV'])
-        try:
-            event['labels'].remove('DQOK')
-        except ValueError:  # not in list
-            pass
+        label_changes.update(DQOK=False, DQV=True)
     else:
         state = "unknown"
 
+    # Apply the net label transitions. Later transitions of the same label
+    # supersede earlier ones, so that, for example, a DQV label from iDQ that
+    # is superseded by DQOK is never applied. Removals go first, so that DQV
+    # and DQOK are never on the event at the same time.
+    if label_changes:
+        for label, add in label_changes.items():
+            if not add:
+                gracedb.remove_label(label, graceid)
+        for label, add in label_changes.items():
+            if add:
+                gracedb.create_label(label, graceid)
+        # Update labels in return value to avoid querying GraceDB again.
+        labels = [label for label in event.get('labels', [])
+                  if label_changes.get(label, True)]
+        labels += [label for label, add in label_changes.items()
+                   if add and label not in labels]
+        event = dict(event, labels=labels)
+
     # Create and upload DQR-compatible json
     state_summary = '{} {} {}'.format(inj_msg, idq_msg, msg)
     if state == "unknown":
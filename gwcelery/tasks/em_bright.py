@@ -10,7 +10,7 @@ from celery.utils.log import get_task_logger
 from ..import app
 from . import gracedb, igwn_alert
 from .p_astro import _format_prob
-from ..util import closing_figures, NamedTemporaryFile
+from ..util import closing_figures, NamedMemoryFile
 
 
 log = get_task_logger(__name__)
@@ -44,7 +44,7 @@ def handle(alert):
         ).delay()
 
 
-@app.task(shared=False)
+@app.task(shared=False, queue='plot')
 @closing_figures()
 def plot(contents):
     """Make a visualization of the source properties.
@@ -107,7 +107,7 @@ def em_bright_posterior_samples(posterior_file_content):
     {"HasNS": 0.014904901243599122, "HasRemnant": 0.0}
 
     """
-    with NamedTemporaryFile(content=posterior_file_content) as samplefile:
+    with NamedMemoryFile(content=posterior_file_content) as samplefile:
         filename = samplefile.name
         has_ns, has_remnant = em_bright.source_classification_pe(filename)
     data = json.dumps({
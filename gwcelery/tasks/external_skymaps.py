@@ -1,26 +1,36 @@
 """Create and upload external sky maps."""
 from astropy import units as u
-from astropy.coordinates import ICRS, SkyCoord
+from astropy.coordinates import ICRS
+from astropy.table import Table
+from astropy.time import Time
 from astropy_healpix import HEALPix, pixel_resolution_to_nside
 from celery import group
-#  import astropy.utils.data
+from celery.utils.log import get_task_logger
 import numpy as np
+from ligo.skymap import distance
+from ligo.skymap import moc
 from ligo.skymap.io import fits
-from ligo.skymap.tool import ligo_skymap_combine
+import functools
 import gcn
 import healpy as hp
-import lxml.etree
+import io
+import pickle
 import re
-import ssl
-import urllib
+import requests
+import time
+import urllib.parse
 
 from ..import app
 from . import gracedb
 from . import skymaps
-from ..util.cmdline import handling_system_exit
-from ..util.tempfile import NamedTemporaryFile
+from ..util.cache import memoize
+from ..util.fetch import fetch
+from ..util.tempfile import BytesFile
+from ..util.voevent import read_gcn_notice
 from ..import _version
 
+log = get_task_logger(__name__)
+
 
 def create_combined_skymap(se_id, ext_id):
     """Creates and uploads the combined LVC-Fermi skymap.
@@ -30,7 +40,8 @@ def create_combined_skymap(se_id, ext_id):
     """
     se_skymap_filename = get_skymap_filename(se_id)
     ext_skymap_filename = get_skymap_filename(ext_id)
-    new_skymap_filename = re.findall(r'(.*).fits.gz', se_skymap_filename)[0]
+    new_skymap_filename = re.match(
+        r'(.*?)(\.multiorder)?\.fits', se_skymap_filename).group(1)
 
     #  FIXME: put download functions in canvas
     se_skymap = gracedb.download(se_skymap_filename, se_id)
@@ -40,14 +51,15 @@ def create_combined_skymap(se_id, ext_id):
     message_png = (
         'Mollweide projection of <a href="/api/events/{graceid}/files/'
         '{filename}">{filename}</a>').format(
-            graceid=se_id, filename=new_skymap_filename + '-ext.fits.gz')
+            graceid=se_id,
+            filename=new_skymap_filename + '-ext.fits')
 
     (
         combine_skymaps.si(se_skymap, ext_skymap)
         |
         group(
-            gracedb.upload.s(new_skymap_filename + '-ext.fits.gz', se_id,
-                             message, ['sky_loc', 'public']),
+            gracedb.upload.s(new_skymap_filename + '-ext.fits',
+                             se_id, message, ['sky_loc', 'public']),
 
             skymaps.plot_allsky.s()
             |
@@ -59,40 +71,220 @@ def create_combined_skymap(se_id, ext_id):
 
 @app.task(autoretry_for=(ValueError,), retry_backoff=10,
           retry_backoff_max=600)
-def get_skymap_filename(graceid):
+def get_skymap_filename(graceid, is_versioned=False):
     """Get the skymap fits filename.
 
     If not available, will try again 10 seconds later, then 20, then 40, etc.
     until up to 10 minutes after initial attempt.
+
+    If `is_versioned` is True, then the file name includes the version of the
+    file, as in ``bayestar.multiorder.fits,0``, so that it always refers to
+    the same contents.
     """
     gracedb_log = gracedb.get_log(graceid)
     if 'S' in graceid:
-        for message in reversed(gracedb_log):
-            filename = message['filename']
-            if filename.endswith('.multiorder.fits'):
-                return filename
+        suffixes = ('.multiorder.fits',)
     else:
-        for message in reversed(gracedb_log):
-            filename = message['filename']
-            if (filename.endswith('.fits') or filename.endswith('.fit') or
-                    filename.endswith('.fits.gz')):
-                return filename
+        suffixes = ('.fits', '.fit', '.fits.gz')
+    for message in reversed(gracedb_log):
+        filename = message['filename']
+        if filename.endswith(suffixes):
+            if is_versioned:
+                return '{},{}'.format(filename, message['file_version'])
+            return filename
     raise ValueError('No skymap available for {0} yet.'.format(graceid))
 
 
+DISTANCE_COLUMNS = ('DISTMU', 'DISTSIGMA', 'DISTNORM')
+"""Names of the columns of the distance ansatz in multi-order sky maps."""
+
+
+def _nested_starts(skymap):
+    """Get the order of each pixel of a multi-order sky map, and the nested
+    index of the first pixel at order 29 (the finest possible order) that it
+    contains.
+    """
+    order, ipix = moc.uniq2nest(skymap['UNIQ'])
+    return order, ipix.astype(np.int64) << (2 * (29 - order.astype(np.int64)))
+
+
+def _match_moc(skymap1, skymap2):
+    """Match up the pixels of two multi-order sky maps.
+
+    Since both sky maps tile the whole sky, and any two HEALPix pixels that
+    overlap are either the same or one contains the other, the pixels of the
+    intersection of the two tilings are the ones that start wherever a pixel
+    of either sky map starts. Each of these is the finer of the two input
+    pixels that contain it, so no resampling is needed: sorting the pixels of
+    each sky map by their ranges of nested indices at the finest order matches
+    them up with a single :func:`numpy.searchsorted`.
+
+    Parameters
+    ----------
+    skymap1, skymap2 : :class:`astropy.table.Table`
+        Multi-order sky maps.
+
+    Returns
+    -------
+    uniq : :class:`numpy.ndarray`
+        The UNIQ indices of the pixels of the intersection of the tilings.
+    index1, index2 : :class:`numpy.ndarray`
+        The row of each sky map that contains each of those pixels.
+
+    """
+    indices = []
+    orders = []
+    all_starts = []
+    for skymap in (skymap1, skymap2):
+        order, starts = _nested_starts(skymap)
+        sort = np.argsort(starts)
+        orders.append(order[sort])
+        all_starts.append(starts[sort])
+        indices.append(sort)
+    starts = np.union1d(*all_starts)
+    for i in range(2):
+        j = np.searchsorted(all_starts[i], starts, side='right') - 1
+        orders[i] = orders[i][j]
+        indices[i] = indices[i][j]
+    order = np.maximum(*orders)
+    uniq = moc.nest2uniq(order.astype(np.int8),
+                         starts >> (2 * (29 - order.astype(np.int64))))
+    return uniq, indices[0], indices[1]
+
+
+def _combine_moc(skymap1, skymap2):
+    """Multiply two multi-order sky maps.
+
+    The combined sky map is defined on the intersection of the tilings of the
+    two sky maps (see :func:`_match_moc`).
+
+    Parameters
+    ----------
+    skymap1, skymap2 : :class:`astropy.table.Table`
+        Multi-order sky maps. At most one of them may have distance columns.
+
+    Returns
+    -------
+    skymap : :class:`astropy.table.Table`
+        The normalized product of the two sky maps, with distance columns if
+        either input had them.
+
+    """
+    if all(name in skymap.colnames
+           for skymap in (skymap1, skymap2) for name in DISTANCE_COLUMNS):
+        raise RuntimeError(
+            'only one input localization can have distance information')
+
+    uniq, *indices = _match_moc(skymap1, skymap2)
+    probdensity = (np.asarray(skymap1['PROBDENSITY'])[indices[0]] *
+                   np.asarray(skymap2['PROBDENSITY'])[indices[1]])
+    prob = probdensity * moc.uniq2pixarea(uniq)
+    norm = prob.sum()
+    if norm == 0:
+        raise RuntimeError('input sky localizations are disjoint')
+
+    skymap = Table({'UNIQ': uniq, 'PROBDENSITY': probdensity / norm})
+    for input_skymap, index in zip((skymap1, skymap2), indices):
+        if DISTANCE_COLUMNS[0] in input_skymap.colnames:
+            for name in DISTANCE_COLUMNS:
+                skymap[name] = np.asarray(input_skymap[name])[index]
+            skymap.meta['distmean'], skymap.meta['diststd'] = \
+                distance.parameters_to_marginal_moments(
+                    prob / norm, skymap['DISTMU'], skymap['DISTSIGMA'])
+
+    gps_times = [input_skymap.meta['gps_time']
+                 for input_skymap in (skymap1, skymap2)
+                 if 'gps_time' in input_skymap.meta]
+    if gps_times:
+        skymap.meta['gps_time'] = np.mean(gps_times)
+    skymap.meta['instruments'] = set.union(*(
+        set(input_skymap.meta.get('instruments', ()))
+        for input_skymap in (skymap1, skymap2)))
+    return skymap
+
+
 @app.task(shared=False)
 def combine_skymaps(skymap1filebytes, skymap2filebytes):
     """This task combines the two input skymaps, in this case the external
-    trigger skymap and the LVC skymap and writes to a temporary output file. It
-    then returns the contents of the file as a byte array.
+    trigger skymap and the LVC skymap, and returns the contents of the
+    combined multi-order FITS file as a byte array.
+
+    Either sky map may be flat or multi-order. The sky maps are multiplied
+    directly in the multi-order representation (see :func:`_combine_moc`), all
+    in memory, so unlike ``ligo-skymap-combine``, this never flattens the sky
+    maps to the finest resolution of either of them or writes them to disk.
+    """
+    skymap1, skymap2 = (
+        fits.read_sky_map(BytesFile(filebytes), moc=True)
+        for filebytes in (skymap1filebytes, skymap2filebytes))
+    skymap = _combine_moc(skymap1, skymap2)
+    with io.BytesIO() as f:
+        fits.write_sky_map(f, skymap, creator='gwcelery',
+                           gps_creation_time=Time.now().gps,
+                           vcs_version=_version.get_versions()['version'])
+        return f.getvalue()
+
+
+@app.task(shared=False)
+@memoize()
+def skymap_overlap(se_filecontents, ext_filecontents=None, ra=None,
+                   dec=None):
+    """Compute the sky map overlap integral of a GW sky map and an external
+    sky map, or of a GW sky map and the position of an external event.
+
+    This is the same quantity as
+    :func:`ligo.raven.search.skymap_overlap_integral`: the ratio of the
+    probability of the two localizations under the hypothesis that they come
+    from a common source to the probability under the hypothesis that they are
+    independent. Here it is computed exactly on the intersection of the
+    multi-order tilings of the two sky maps (see :func:`_match_moc`), instead
+    of by matching the centers of the pixels of one sky map to the nearest
+    pixels of the other.
+
+    The result is memoized by the contents of the sky maps, so it is only
+    computed once for each pair of versions of the sky maps. This provides the
+    sky map overlap integrals for
+    :meth:`gwcelery.tasks.raven.calculate_coincidence_far` and for the batch
+    coincidence FAR computation of :func:`gwcelery.tasks.raven.coinc_fars`.
+
+    Parameters
+    ----------
+    se_filecontents : bytes
+        The contents of the GW sky map FITS file.
+    ext_filecontents : bytes, optional
+        The contents of the external sky map FITS file, which may be flat or
+        multi-order.
+    ra, dec : float, optional
+        The position in degrees of an external event that is so well localized
+        that it can be treated as a point, such as a Swift GRB. Used if
+        `ext_filecontents` is not provided.
+
+    Returns
+    -------
+    float
+        The sky map overlap integral.
+
     """
-    with NamedTemporaryFile(mode='rb', suffix='.fits.gz') as combinedskymap, \
-            NamedTemporaryFile(content=skymap1filebytes) as skymap1file, \
-            NamedTemporaryFile(content=skymap2filebytes) as skymap2file, \
-            handling_system_exit():
-        ligo_skymap_combine.main([skymap1file.name,
-                                  skymap2file.name, combinedskymap.name])
-        return combinedskymap.read()
+    se_skymap = fits.read_sky_map(BytesFile(se_filecontents), moc=True)
+    se_probdensity = np.asarray(se_skymap['PROBDENSITY'])
+    se_norm = np.sum(se_probdensity * moc.uniq2pixarea(se_skymap['UNIQ']))
+
+    if ext_filecontents is None:
+        order, starts = _nested_starts(se_skymap)
+        sort = np.argsort(starts)
+        ipix = HEALPix(nside=2**29, order='nested').lonlat_to_healpix(
+            ra * u.deg, dec * u.deg)
+        i = sort[np.searchsorted(starts[sort], ipix, side='right') - 1]
+        return float(4 * np.pi * se_probdensity[i] / se_norm)
+
+    ext_skymap = fits.read_sky_map(BytesFile(ext_filecontents), moc=True)
+    ext_probdensity = np.asarray(ext_skymap['PROBDENSITY'])
+    ext_norm = np.sum(
+        ext_probdensity * moc.uniq2pixarea(ext_skymap['UNIQ']))
+    uniq, se_index, ext_index = _match_moc(se_skymap, ext_skymap)
+    return float(4 * np.pi * np.sum(
+        se_probdensity[se_index] * ext_probdensity[ext_index] *
+        moc.uniq2pixarea(uniq)) / se_norm / ext_norm)
 
 
 @app.task(shared=False)
@@ -106,6 +298,13 @@ def external_trigger(graceid):
     raise ValueError('No associated GRB EM event(s) for {0}.'.format(graceid))
 
 
+def heasarc_link(lightcurve_url):
+    """Get the HEASARC directory of the data products of a Fermi trigger from
+    the link to its quicklook light curve in a GCN notice.
+    """
+    return re.sub(r'quicklook(.*)', 'current/', lightcurve_url)
+
+
 @app.task(shared=False)
 def external_trigger_heasarc(external_id):
     """Returns the HEASARC fits file link."""
@@ -115,61 +314,73 @@ def external_trigger_heasarc(external_id):
             filename = message['filename']
             xmlfile = gracedb.download(urllib.parse.quote(filename),
                                        external_id)
-            root = lxml.etree.fromstring(xmlfile)
-            heasarc_url = root.find('./What/Param[@name="LightCurve_URL"]'
-                                    ).attrib['value']
-            return re.sub(r'quicklook(.*)', 'current/', heasarc_url)
+            lightcurve_url = read_gcn_notice(xmlfile).lightcurve_url
+            if lightcurve_url is not None:
+                return heasarc_link(lightcurve_url)
     raise ValueError('Not able to retrieve HEASARC link for {0}.'.format(
         external_id))
 
 
-@app.task(autoretry_for=(urllib.error.HTTPError,), retry_backoff=10,
-          retry_backoff_max=600)
-def get_external_skymap(link, search):
+@app.task(shared=False)
+def get_external_skymap(link, search, timeout=60):
     """Download the Fermi sky map fits file and return the contents as a byte
     array. If GRB, will construct a HEASARC url, while if SubGRB, will use the
     link directly.
 
-    If not available, will try again 10 seconds later, then 20, then 40, etc.
-    until up to 10 minutes after initial attempt.
+    The download goes through :func:`gwcelery.util.fetch.fetch`, so it reuses
+    persistent connections and caches the sky map under its trigger ID. The
+    `timeout` in seconds applies to connecting to and reading from the
+    server. Raises :class:`requests.exceptions.RequestException` if the sky
+    map is not available yet.
     """
     if search == 'GRB':
         # if Fermi GRB, determine final HEASARC link
         trigger_id = re.sub(r'.*\/(\D+?)(\d+)(\D+)\/.*', r'\2', link)
         skymap_name = 'glg_healpix_all_bn{0}_v00.fit'.format(trigger_id)
         skymap_link = link + skymap_name
+        key = 'fermi-bn{0}'.format(trigger_id)
     elif search == 'SubGRB':
-        skymap_link = link
-    #  FIXME: Under Anaconda on the LIGO Caltech computing cluster, Python
-    #  (and curl, for that matter) fail to negotiate TLSv1.2 with
-    #  heasarc.gsfc.nasa.gov
-    context = ssl.create_default_context()
-    context.options |= ssl.OP_NO_TLSv1_3
-    #  return astropy.utils.data.get_file_contents(
-    #      (skymap_link), encoding='binary', cache=False)
-    return urllib.request.urlopen(skymap_link, context=context).read()
-
-
-@app.task(autoretry_for=(urllib.error.HTTPError, urllib.error.URLError,),
-          retry_backoff=10, retry_backoff_max=1200)
-def get_upload_external_skymap(event, skymap_link=None):
-    """If a Fermi sky map is not uploaded yet, tries to download one and upload
-    to external event. If sky map is not available, passes so that this can be
-    re-run the next time an update GCN notice is received. If GRB, will
-    construct a HEASARC url, while if SubGRB, will use the link directly.
+        skymap_link = key = link
+    return fetch(skymap_link, key=key, timeout=timeout)
+
+
+PENDING_KEY = 'gwcelery-external-skymaps-pending'
+"""Key of the Redis hash of Fermi events whose sky maps are waiting for
+:meth:`poll_external_skymaps`."""
+
+POLL_LOCK_KEY = 'gwcelery-external-skymaps-poll-lock'
+"""Key of the Redis lock that prevents more than one instance of
+:meth:`poll_external_skymaps` from running at a time."""
+
+POLL_LOCK_EXPIRES = 600
+"""Lifetime in seconds of the lock held by :meth:`poll_external_skymaps`, in
+case the worker that holds it dies."""
+
+FETCH_TIMEOUT = 10
+"""Timeout in seconds of each attempt to download a Fermi sky map that is
+waiting for :meth:`poll_external_skymaps`. A slow response is not waited
+for, because the download is tried again at the next poll."""
+
+
+def _fetch_external_skymap(event, skymap_link):
+    """Try to download the official sky map for a Fermi event.
+
+    Returns the HEASARC link if it had to be looked up, so that it need not be
+    looked up again, and the contents of the sky map, or None if it is not
+    available yet.
     """
-    graceid = event['graceid']
-    search = event['search']
+    try:
+        if skymap_link is None:
+            skymap_link = external_trigger_heasarc(event['graceid'])
+        return skymap_link, get_external_skymap(
+            skymap_link, event['search'], timeout=FETCH_TIMEOUT)
+    except (ValueError, requests.exceptions.RequestException):
+        return skymap_link, None
 
-    if search == 'GRB':
-        external_skymap_canvas = (
-            external_trigger_heasarc.si(graceid)
-            |
-            get_external_skymap.s(search)
-        )
-    elif search == 'SubGRB':
-        external_skymap_canvas = get_external_skymap.si(skymap_link, search)
 
+def _upload_external_skymap(event, skymap):
+    """Upload the official sky map for a Fermi event and a plot of it."""
+    graceid = event['graceid']
     skymap_filename = 'glg_healpix_all_bn_v00'
 
     message = (
@@ -178,16 +389,15 @@ def get_upload_external_skymap(event, skymap_link=None):
             graceid=graceid, filename=skymap_filename + '.fits')
 
     (
-        external_skymap_canvas
-        |
         group(
-            gracedb.upload.s(
+            gracedb.upload.si(
+                skymap,
                 skymap_filename + '.fits',
                 graceid,
                 'Official sky map from Fermi analysis.',
                 ['sky_loc']),
 
-            skymaps.plot_allsky.s()
+            skymaps.plot_allsky.si(skymap)
             |
             gracedb.upload.s(skymap_filename + '.png',
                              graceid,
@@ -199,18 +409,270 @@ def get_upload_external_skymap(event, skymap_link=None):
     ).delay()
 
 
+@app.task(shared=False, ignore_result=True)
+def get_upload_external_skymap(event, skymap_link=None):
+    """If a Fermi sky map is not uploaded yet, tries to download one and upload
+    to external event. If GRB, will construct a HEASARC url, while if SubGRB,
+    will use the link directly.
+
+    If the sky map is not available yet, then the event is added to a Redis
+    hash so that :meth:`poll_external_skymaps` tries again, until
+    :obj:`~gwcelery.conf.external_skymap_poll_timeout` seconds have passed.
+    A single polling task serves all pending events, instead of one task that
+    retries with backoff for each event. If the event is already pending, for
+    example because of an earlier notice for the same trigger, then it is left
+    as it is, so that later notices do not extend its deadline.
+    """
+    skymap_link, skymap = _fetch_external_skymap(event, skymap_link)
+    if skymap is None:
+        deadline = time.time() + app.conf['external_skymap_poll_timeout']
+        app.backend.client.hsetnx(PENDING_KEY, event['graceid'], pickle.dumps(
+            (event, skymap_link, deadline)))
+    else:
+        _upload_external_skymap(event, skymap)
+
+
+def _remove_pending(client, graceid, value):
+    """Remove an event from the Redis hash of events that are waiting for sky
+    maps, unless its entry has changed since it was read."""
+    def remove(pipe):
+        if pipe.hget(PENDING_KEY, graceid) == value:
+            pipe.multi()
+            pipe.hdel(PENDING_KEY, graceid)
+
+    client.transaction(remove, PENDING_KEY)
+
+
+@app.task(shared=False, ignore_result=True)
+def poll_external_skymaps():
+    """Try to download and upload the official sky maps of all of the Fermi
+    events that are waiting in the Redis hash populated by
+    :meth:`get_upload_external_skymap`.
+
+    This task is run periodically. If the previous run is still in progress,
+    for example because a server is slow to respond, then it returns
+    immediately, so that runs do not pile up.
+    """
+    client = app.backend.client
+    if not client.set(POLL_LOCK_KEY, 1, nx=True, ex=POLL_LOCK_EXPIRES):
+        return
+    try:
+        for graceid, value in client.hgetall(PENDING_KEY).items():
+            event, skymap_link, deadline = pickle.loads(value)
+            new_skymap_link, skymap = _fetch_external_skymap(
+                event, skymap_link)
+            if skymap is not None:
+                _remove_pending(client, graceid, value)
+                _upload_external_skymap(event, skymap)
+            elif time.time() > deadline:
+                _remove_pending(client, graceid, value)
+                log.warning('Gave up waiting for Fermi sky map for %s',
+                            event['graceid'])
+            elif new_skymap_link != skymap_link:
+                # Remember the HEASARC link so that it is not looked up again.
+                client.hset(PENDING_KEY, graceid, pickle.dumps(
+                    (event, new_skymap_link, deadline)))
+    finally:
+        client.delete(POLL_LOCK_KEY)
+
+
+@app.on_after_finalize.connect
+def setup_periodic_tasks(sender, **kwargs):
+    """Register periodic tasks.
+
+    See
+    https://docs.celeryproject.org/en/stable/userguide/periodic-tasks.html.
+    """
+    interval = app.conf['external_skymap_poll_interval']
+    # Discard runs that could not start before the next one is due.
+    sender.add_periodic_task(interval, poll_external_skymaps,
+                             expires=interval)
+
+
+FERMI_SYSTEMATICS = {
+    # Flight notice: values from first row of Table 7
+    gcn.NoticeType.FERMI_GBM_FLT_POS: ((0.897, 7.52), (0.103, 55.6)),
+    # Ground notice: values from first row of Table 3
+    gcn.NoticeType.FERMI_GBM_GND_POS: ((0.804, 3.72), (0.196, 13.7)),
+    # Final notice: values from second row of Table 3
+    gcn.NoticeType.FERMI_GBM_FIN_POS: ((0.900, 3.71), (0.100, 14.3))
+}
+"""Weights and 1-sigma radii in degrees of the narrow core and wide tail
+Gaussians that model the systematic errors of Fermi GBM localizations, for
+each notice type, from :doi:`10.1088/0067-0049/216/2/32`."""
+
+
+MAX_ORDER = 16
+"""Finest HEALPix order of external sky maps, other than those for Fermi."""
+
+FERMI_MAX_NSIDE = 128
+"""Maximum HEALPix resolution of external sky maps for Fermi."""
+
+MEMOIZE_MAX_NSIDE = 256
+"""Maximum HEALPix resolution of Gaussian sky maps that are memoized."""
+
+
+@functools.lru_cache(maxsize=2)
+def _pixel_vectors(nside):
+    """Get the unit vectors of the centers of all HEALPix pixels in the RING
+    ordering, as an array of shape (3, npix).
+
+    These are cached in each process for the most recently used resolutions,
+    so that many sky maps at the same resolution can be evaluated with
+    nothing more than a matrix-vector product.
+    """
+    return np.stack(hp.pix2vec(nside, np.arange(hp.nside2npix(nside))))
+
+
+@functools.lru_cache(maxsize=16)
+def _fermi_beam_window(nside, notice_type):
+    """Get the transfer function in harmonic space of the sum of the core and
+    tail Gaussians for Fermi systematics.
+    """
+    lmax = 3 * nside - 1
+    return sum(
+        weight * hp.gauss_beam(
+            np.radians(scale) * np.sqrt(8 * np.log(2)), lmax=lmax)
+        for weight, scale in FERMI_SYSTEMATICS[notice_type])
+
+
+def _apply_fermi_systematics(skymap, notice_type):
+    """Convolve a sky map with the core and tail Gaussians for Fermi
+    systematics.
+
+    Since smoothing is linear, this is equivalent to summing the sky map
+    smoothed by each Gaussian with :func:`healpy.sphtfunc.smoothing`, but it
+    takes only one forward and one inverse spherical harmonic transform.
+    """
+    nside = hp.npix2nside(len(skymap))
+    alm = hp.map2alm(skymap, iter=3)
+    hp.almxfl(alm, _fermi_beam_window(nside, notice_type), inplace=True)
+    return hp.alm2map(alm, nside)
+
+
+def _evaluate_gaussian_skymap(ra, dec, error, nside, notice_type=None):
+    center = hp.ang2vec(ra, dec, lonlat=True)
+    cos_distance = np.clip(center @ _pixel_vectors(nside), -1, 1)
+    skymap = np.exp(-0.5 * np.square(np.arccos(cos_distance) /
+                                     np.radians(error)))
+    skymap /= skymap.sum()
+    if notice_type is not None:
+        skymap = _apply_fermi_systematics(skymap, notice_type)
+    return skymap
+
+
+_memoized_gaussian_skymap = memoize()(_evaluate_gaussian_skymap)
+
+
+def _gaussian_skymap(ra, dec, error, nside, notice_type=None):
+    """Evaluate a normalized Gaussian sky map in the RING ordering with a
+    1-sigma radius of `error` degrees, optionally convolved with the Fermi
+    systematics for `notice_type`.
+
+    Sky maps with resolutions of up to :obj:`MEMOIZE_MAX_NSIDE` are memoized.
+    Finer sky maps would take up too much space in Redis (about 100 MB at
+    nside 1024), so they are evaluated every time.
+    """
+    if nside <= MEMOIZE_MAX_NSIDE:
+        func = _memoized_gaussian_skymap
+    else:
+        func = _evaluate_gaussian_skymap
+    return func(ra, dec, error, nside, notice_type)
+
+
+def _flat_to_moc(skymap):
+    """Convert a flat, RING-ordered probability sky map to a multi-order sky
+    map in which all pixels have the same order.
+    """
+    nside = hp.npix2nside(len(skymap))
+    order = hp.nside2order(nside)
+    ipix = np.arange(len(skymap))
+    return Table({
+        'UNIQ': moc.nest2uniq(np.int8(order), ipix),
+        'PROBDENSITY': hp.reorder(skymap, r2n=True) / hp.nside2pixarea(nside)
+    })
+
+
+def _adaptive_gaussian_moc(ra, dec, error, max_order):
+    """Evaluate a Gaussian sky map on an adaptively refined multi-order grid.
+
+    Starting from the 12 base pixels, each pixel is divided into its four
+    children if it could be within 5 sigma of the center, until the pixels
+    reach `max_order`. The result is only fine near the localization, and
+    coarse elsewhere.
+
+    Parameters
+    ----------
+    ra, dec : float
+        The position of the center, in degrees.
+    error : float
+        The 1-sigma radius in degrees, or 0 to put all of the probability in
+        the pixel of order `max_order` that contains the center.
+    max_order : int
+        The HEALPix order of the finest pixels.
+
+    Returns
+    -------
+    skymap : :class:`astropy.table.Table`
+        The multi-order sky map, with unnormalized probability density.
+
+    """
+    center = hp.ang2vec(ra, dec, lonlat=True)
+    sigma = np.radians(error)
+    orders = []
+    ipixs = []
+    distances = []
+    ipix = np.arange(12)
+    for order in range(max_order + 1):
+        nside = 2 ** order
+        distance = np.arccos(np.clip(
+            center @ np.stack(hp.pix2vec(nside, ipix, nest=True)), -1, 1))
+        if order < max_order:
+            refine = distance <= 5 * sigma + 2 * hp.max_pixrad(nside)
+        else:
+            refine = np.zeros(len(ipix), dtype=bool)
+        orders.append(np.full((~refine).sum(), order, dtype=np.int8))
+        ipixs.append(ipix[~refine])
+        distances.append(distance[~refine])
+        ipix = (4 * ipix[refine, np.newaxis] + np.arange(4)).ravel()
+
+    order = np.concatenate(orders)
+    ipix = np.concatenate(ipixs)
+    if sigma:
+        probdensity = np.exp(-0.5 * np.square(
+            np.concatenate(distances) / sigma))
+    else:
+        probdensity = (
+            (order == max_order) &
+            (ipix == hp.ang2pix(2 ** max_order, ra, dec, nest=True,
+                                lonlat=True))).astype(float)
+    return Table({'UNIQ': moc.nest2uniq(order, ipix),
+                  'PROBDENSITY': probdensity})
+
+
 def create_external_skymap(ra, dec, error, pipeline, notice_type=111):
-    """Create a sky map, either a gaussian or a single
+    """Create a multi-order sky map, either a gaussian or a single
     pixel sky map, given an RA, dec, and error radius.
 
     If from Fermi, convolves the sky map with both a core and
     tail Gaussian and then sums these to account for systematic
-    effects as measured in :doi:`10.1088/0067-0049/216/2/32`
+    effects as measured in :doi:`10.1088/0067-0049/216/2/32`.
+    Since the smoothing is done in harmonic space on a flat grid, and the
+    systematic errors are at least several degrees, Fermi sky maps have a
+    uniform resolution of at most :obj:`FERMI_MAX_NSIDE`.
+
+    Other sky maps are refined only near the localization, down to a pixel
+    size that resolves the error radius, or to :obj:`MAX_ORDER`.
 
     If from Swift, converts the error radius from that containing 90% of the
     credible region to ~68% (see description of Swift error
     here:`https://gcn.gsfc.nasa.gov/swift.html#tc7`)
 
+    Gaussian sky maps for Fermi are memoized (see
+    :func:`gwcelery.util.cache.memoize`), so the position and error radius are
+    first rounded to 0.0001 degrees, the precision of GCN notices, so that
+    repeated notices for the same event share the same result.
+
     Parameters
     ----------
     ra : float
@@ -222,11 +684,26 @@ def create_external_skymap(ra, dec, error, pipeline, notice_type=111):
 
     Returns
     -------
-    skymap : numpy array
-        sky map array
+    skymap : :class:`astropy.table.Table`
+        multi-order sky map with ``UNIQ`` and ``PROBDENSITY`` columns
 
     """
-    max_nside = 2048
+    if pipeline == 'Fermi':
+        # Correct for Fermi systematics based on recommendations from GBM team
+        # Convolve with both a narrow core and wide tail Gaussian with error
+        # radius determined by the scales respectively, each comprising a
+        # fraction determined by the weights respectively
+        if notice_type not in FERMI_SYSTEMATICS:
+            raise AssertionError(
+                'Need to provide a supported Fermi notice type')
+        max_nside = FERMI_MAX_NSIDE
+    else:
+        notice_type = None
+        max_nside = 2 ** MAX_ORDER
+
+    ra = round(float(ra), 4)
+    dec = round(float(dec), 4)
+    error = round(float(error or 0), 4)
     if error:
         # Correct 90% containment to 1-sigma for Swift
         if pipeline == 'Swift':
@@ -235,55 +712,31 @@ def create_external_skymap(ra, dec, error, pipeline, notice_type=111):
         nside = pixel_resolution_to_nside(error_radius, round='up')
     else:
         nside = np.inf
-    if nside >= max_nside:
+    if nside > max_nside:
+        #  Find the one pixel the event can localized to
         nside = max_nside
+        error = 0
 
-        #  Find the one pixel the event can localized to
-        hpx = HEALPix(nside, 'ring', frame=ICRS())
-        skymap = np.zeros(hpx.npix)
-        ind = hpx.lonlat_to_healpix(ra * u.deg, dec * u.deg)
-        skymap[ind] = 1.
-    else:
-        #  If larger error, create gaussian sky map
-        hpx = HEALPix(nside, 'ring', frame=ICRS())
-        ipix = np.arange(hpx.npix)
-
-        #  Evaluate Gaussian.
-        center = SkyCoord(ra * u.deg, dec * u.deg)
-        distance = hpx.healpix_to_skycoord(ipix).separation(center)
-        skymap = np.exp(-0.5 * np.square(distance / error_radius).to_value(
-            u.dimensionless_unscaled))
-        skymap /= skymap.sum()
-    if pipeline == 'Fermi':
-        # Correct for Fermi systematics based on recommendations from GBM team
-        # Convolve with both a narrow core and wide tail Gaussian with error
-        # radius determined by the scales respectively, each comprising a
-        # fraction determined by the weights respectively
-        if notice_type == gcn.NoticeType.FERMI_GBM_FLT_POS:
-            # Flight notice
-            # Values from first row of Table 7
-            weights = [0.897, 0.103]
-            scales = [7.52, 55.6]
-        elif notice_type == gcn.NoticeType.FERMI_GBM_GND_POS:
-            # Ground notice
-            # Values from first row of Table 3
-            weights = [0.804, 0.196]
-            scales = [3.72, 13.7]
-        elif notice_type == gcn.NoticeType.FERMI_GBM_FIN_POS:
-            # Final notice
-            # Values from second row of Table 3
-            weights = [0.900, 0.100]
-            scales = [3.71, 14.3]
+    if notice_type is not None:
+        if error:
+            skymap = _gaussian_skymap(ra, dec, error, int(nside), notice_type)
         else:
-            raise AssertionError(
-                'Need to provide a supported Fermi notice type')
-        skymap = sum(
-            weight * hp.sphtfunc.smoothing(skymap, sigma=np.radians(scale))
-            for weight, scale in zip(weights, scales))
+            hpx = HEALPix(nside, 'ring', frame=ICRS())
+            skymap = np.zeros(hpx.npix)
+            ind = hpx.lonlat_to_healpix(ra * u.deg, dec * u.deg)
+            skymap[ind] = 1.
+            skymap = _apply_fermi_systematics(skymap, notice_type)
+        skymap = _flat_to_moc(skymap)
+    else:
+        skymap = _adaptive_gaussian_moc(
+            ra, dec, error, hp.nside2order(int(nside)))
 
     # Renormalize due to possible lack of precision
     # Enforce the skymap to be non-negative
-    return np.abs(skymap) / np.abs(skymap).sum()
+    probdensity = np.abs(skymap['PROBDENSITY'])
+    skymap['PROBDENSITY'] = probdensity / np.sum(
+        probdensity * moc.uniq2pixarea(skymap['UNIQ']))
+    return skymap
 
 
 def write_to_fits(skymap, event, notice_type, notice_date):
@@ -292,15 +745,15 @@ def write_to_fits(skymap, event, notice_type, notice_date):
 
     Parameters
     ----------
-    skymap : numpy array
-        sky map array
+    skymap : :class:`astropy.table.Table`
+        multi-order sky map
     event : dict
         Dictionary of Swift external event
 
     Returns
     -------
     skymap fits : bytes array
-        bytes array of sky map
+        bytes array of multi-order FITS file
 
     """
     notice_type_dict = {
@@ -322,8 +775,8 @@ def write_to_fits(skymap, event, notice_type, notice_date):
         msgtype = notice_type_dict[str(notice_type)]
 
     gcn_id = event['extra_attributes']['GRB']['trigger_id']
-    with NamedTemporaryFile(suffix='.fits.gz') as f:
-        fits.write_sky_map(f.name, skymap,
+    with io.BytesIO() as f:
+        fits.write_sky_map(f, skymap,
                            objid=gcn_id,
                            url=event['links']['self'],
                            instruments=event['pipeline'],
@@ -334,8 +787,7 @@ def write_to_fits(skymap, event, notice_type, notice_date):
                            origin='LIGO-VIRGO-KAGRA',
                            vcs_version=_version.get_versions()['version'],
                            history='file only for internal use')
-        with open(f.name, 'rb') as file:
-            return file.read()
+        return f.getvalue()
 
 
 @app.task(shared=False)
@@ -350,7 +802,7 @@ def create_upload_external_skymap(event, notice_type, notice_date):
 
     """
     graceid = event['graceid']
-    skymap_filename = event['pipeline'].lower() + '_skymap.fits.gz'
+    skymap_filename = event['pipeline'].lower() + '_skymap.multiorder.fits'
 
     ra = event['extra_attributes']['GRB']['ra']
     dec = event['extra_attributes']['GRB']['dec']
@@ -1,16 +1,17 @@
-from lxml import etree
 from urllib.parse import urlparse
+from astropy.time import Time
 from celery import group
+from celery.signals import celeryd_init
 from celery.utils.log import get_logger
 
 from ..import app
-from .core import identity
 from . import detchar
 from . import gcn
 from . import gracedb
 from . import external_skymaps
 from . import igwn_alert
 from . import raven
+from ..util.voevent import read_gcn_notice
 
 log = get_logger(__name__)
 
@@ -33,6 +34,123 @@ classification, above which we will consider a Fermi Flight Position
 notice."""
 
 
+TRIGGER_ID_KEY_PREFIX = 'gwcelery-external-trigger-id-'
+"""Prefix of the Redis keys of the GraceDB IDs of external events by pipeline
+and trigger ID (see :meth:`index_trigger_id`)."""
+
+
+def _trigger_id_key(pipeline, trig_id):
+    return '{0}{1}-{2}'.format(TRIGGER_ID_KEY_PREFIX, pipeline, trig_id)
+
+
+def _set_trigger_id(pipeline, trig_id, graceid):
+    retention = app.conf['external_trigger_index_retention']
+    if retention:
+        app.backend.client.set(_trigger_id_key(pipeline, trig_id), graceid,
+                               ex=int(retention))
+
+
+@app.task(shared=False)
+def index_trigger_id(event, pipeline, trig_id):
+    """Remember the GraceDB ID of a new external event by its pipeline and
+    trigger ID, so that GraceDB does not have to be searched for it when the
+    next notice for the same trigger arrives.
+
+    Entries expire after :obj:`~gwcelery.conf.external_trigger_index_retention`
+    seconds. Only events in the External group should be indexed, because
+    GraceDB is searched only for those (see :func:`_get_existing_event`); each
+    test notice creates a new event in the Test group.
+
+    Parameters
+    ----------
+    event : dict
+        The external event dictionary, as returned by
+        :meth:`gwcelery.tasks.gracedb.create_event`.
+    pipeline : str
+        The pipeline, such as ``'Fermi'`` or ``'SNEWS'``.
+    trig_id : str
+        The trigger ID from the GCN notice.
+
+    Returns
+    -------
+    event : dict
+        The same external event dictionary, so that this task can be chained.
+
+    """
+    _set_trigger_id(pipeline, trig_id, event['graceid'])
+    return event
+
+
+def _get_existing_event(pipeline, trig_id):
+    """Get the external event in the External group for a trigger.
+
+    The GraceDB ID is looked up in the index of trigger IDs (see
+    :meth:`index_trigger_id`). GraceDB is only searched if it is not there.
+
+    Returns
+    -------
+    graceid : str or None
+        The GraceDB ID of the event, or None if there is no event yet.
+    event : dict or None
+        The event dictionary if GraceDB was searched for it, or None if the
+        GraceDB ID was found in the index. Callers that need the event
+        dictionary in that case must get it from GraceDB.
+
+    """
+    if app.conf['external_trigger_index_retention']:
+        graceid = app.backend.client.get(_trigger_id_key(pipeline, trig_id))
+        if graceid is not None:
+            if isinstance(graceid, bytes):
+                graceid = graceid.decode()
+            return graceid, None
+
+    query = 'group: External pipeline: {} grbevent.trigger_id = "{}"'.format(
+        pipeline, trig_id)
+    events = gracedb.get_events(query=query)
+    if not events:
+        return None, None
+    assert len(events) == 1, 'Found more than one matching GraceDB entry'
+    event, = events
+    _set_trigger_id(pipeline, trig_id, event['graceid'])
+    return event['graceid'], event
+
+
+@app.task(shared=False, ignore_result=True, queue='exttrig')
+def backfill_trigger_ids():
+    """Fill the index of trigger IDs (see :meth:`index_trigger_id`) with the
+    external events that were created in GraceDB within the last
+    :obj:`~gwcelery.conf.external_trigger_index_retention` seconds.
+
+    This runs when a worker that consumes the ``exttrig`` queue starts, so
+    that notices for triggers that arrived while it was down do not have to
+    search GraceDB.
+    """
+    retention = app.conf['external_trigger_index_retention']
+    if not retention:
+        return
+    now = Time.now().gps
+    query = 'group: External gpstime: {0} .. {1}'.format(
+        now - retention, now)
+    for event in gracedb.get_events(query=query):
+        trig_id = event.get('extra_attributes', {}).get(
+            'GRB', {}).get('trigger_id')
+        if trig_id is not None:
+            _set_trigger_id(event['pipeline'], trig_id, event['graceid'])
+
+
+@celeryd_init.connect
+def _backfill_trigger_ids(options, **kwargs):
+    """Celery :doc:`signal handler <celery:userguide/signals>` to backfill the
+    index of trigger IDs when a worker that consumes the ``exttrig`` queue
+    starts.
+    """
+    queues = options.get('queues') or ()
+    if isinstance(queues, str):
+        queues = queues.split(',')
+    if 'exttrig' in queues:
+        backfill_trigger_ids.delay()
+
+
 @gcn.handler(gcn.NoticeType.SNEWS,
              queue='exttrig',
              shared=False)
@@ -41,31 +159,29 @@ def handle_snews_gcn(payload):
 
     Prepares the alert to be sent to graceDB as 'E' events.
     """
-    root = etree.fromstring(payload)
+    notice = read_gcn_notice(payload)
 
     #  Get TrigID and Test Event Boolean
-    trig_id = root.find("./What/Param[@name='TrigID']").attrib['value']
-    ext_group = 'Test' if root.attrib['role'] == 'test' else 'External'
+    trig_id = notice.trig_id
+    ext_group = 'Test' if notice.role == 'test' else 'External'
 
     event_observatory = 'SNEWS'
-    query = 'group: External pipeline: {} grbevent.trigger_id = "{}"'.format(
-        event_observatory, trig_id)
-    events = gracedb.get_events(query=query)
+    graceid, _ = _get_existing_event(event_observatory, trig_id)
 
-    if events:
-        assert len(events) == 1, 'Found more than one matching GraceDB entry'
-        event, = events
-        graceid = event['graceid']
-        canvas = gracedb.replace_event.s(graceid, payload)
+    #  Update GraceDB before returning, so that the next notice for the same
+    #  trigger, which is handled after this one in the same exttrig
+    #  partition, finds the event.
+    if graceid:
+        gracedb.replace_event(graceid, payload)
 
     else:
-        canvas = gracedb.create_event.s(filecontents=payload,
-                                        search='Supernova',
-                                        group=ext_group,
-                                        pipeline=event_observatory)
-        canvas |= _launch_external_detchar.s()
-
-    canvas.delay()
+        event = gracedb.create_event(filecontents=payload,
+                                     search='Supernova',
+                                     group=ext_group,
+                                     pipeline=event_observatory)
+        if ext_group == 'External':
+            index_trigger_id(event, event_observatory, trig_id)
+        _launch_external_detchar.delay(event)
 
 
 @gcn.handler(gcn.NoticeType.FERMI_GBM_ALERT,
@@ -88,6 +204,10 @@ def handle_grb_gcn(payload):
     from the notice if new notice, otherwise updates existing event. Then
     creates and/or grabs external sky map to be uploaded to the external event.
 
+    The notice is parsed only once, by :func:`gwcelery.util.read_gcn_notice`.
+    For Fermi GRBs, the HEASARC link is taken from the notice and passed on to
+    :meth:`gwcelery.tasks.external_skymaps.get_upload_external_skymap`.
+
     More info for these notices can be found at:
     Fermi-GBM: https://gcn.gsfc.nasa.gov/fermi_grbs.html
     Fermi-GBM sub: https://gcn.gsfc.nasa.gov/fermi_gbm_subthresh_archive.html
@@ -95,19 +215,14 @@ def handle_grb_gcn(payload):
     INTEGRAL: https://gcn.gsfc.nasa.gov/integral.html
     AGILE-MCAL: https://gcn.gsfc.nasa.gov/agile_mcal.html
     """
-    root = etree.fromstring(payload)
-    u = urlparse(root.attrib['ivorn'])
-    stream_path = u.path
+    notice = read_gcn_notice(payload)
+    stream_path = urlparse(notice.ivorn).path
 
     #  Get TrigID
-    try:
-        trig_id = root.find("./What/Param[@name='TrigID']").attrib['value']
-    except AttributeError:
-        trig_id = root.find("./What/Param[@name='Trans_Num']").attrib['value']
-    ext_group = 'Test' if root.attrib['role'] == 'test' else 'External'
+    trig_id = notice.trig_id
+    ext_group = 'Test' if notice.role == 'test' else 'External'
 
-    notice_type = \
-        int(root.find("./What/Param[@name='Packet_Type']").attrib['value'])
+    notice_type = notice.notice_type
 
     stream_obsv_dict = {'/SWIFT': 'Swift',
                         '/Fermi': 'Fermi',
@@ -115,18 +230,17 @@ def handle_grb_gcn(payload):
                         '/AGILE': 'AGILE'}
     event_observatory = stream_obsv_dict[stream_path]
 
-    reliability = root.find("./What/Param[@name='Reliability']")
-    if reliability is not None and int(reliability.attrib['value']) <= 4:
+    if notice.reliability is not None and notice.reliability <= 4:
         return
 
     #  Check if Fermi trigger is likely noise by checking classification
     #  Most_Likely_Index of 4 is an astrophysical GRB
     #  If not at least 50% chance of GRB we will not consider it for RAVEN
-    likely_source = root.find("./What/Param[@name='Most_Likely_Index']")
-    likely_prob = root.find("./What/Param[@name='Most_Likely_Prob']")
-    not_likely_grb = likely_source is not None and \
-        (likely_source.attrib['value'] != FERMI_GRB_CLASS_VALUE
-         or likely_prob.attrib['value'] < FERMI_GRB_CLASS_THRESH)
+    #  A classification without a probability is not trusted either
+    not_likely_grb = notice.most_likely_index is not None and \
+        (notice.most_likely_index != FERMI_GRB_CLASS_VALUE
+         or notice.most_likely_prob is None
+         or notice.most_likely_prob < FERMI_GRB_CLASS_THRESH)
 
     #  Check if initial Fermi alert. These are generally unreliable and should
     #  never trigger a RAVEN alert, but will give us earlier warning of a
@@ -134,10 +248,7 @@ def handle_grb_gcn(payload):
     initial_gbm_alert = notice_type == gcn.NoticeType.FERMI_GBM_ALERT
 
     #  Check if Swift has lost lock. If so then veto
-    lost_lock = \
-        root.find("./What/Group[@name='Solution_Status']" +
-                  "/Param[@name='StarTrack_Lost_Lock']")
-    swift_veto = lost_lock is not None and lost_lock.attrib['value'] == 'true'
+    swift_veto = notice.lost_lock
 
     #  Only send alerts if likely a GRB, is not a low-confidence early Fermi
     #  alert, and if not a Swift veto
@@ -146,7 +257,7 @@ def handle_grb_gcn(payload):
     else:
         labels = None
 
-    ivorn = root.attrib['ivorn']
+    ivorn = notice.ivorn
     if 'subthresh' in ivorn.lower():
         search = 'SubGRB'
     elif 'mdc-test_event' in ivorn.lower():
@@ -154,56 +265,54 @@ def handle_grb_gcn(payload):
     else:
         search = 'GRB'
 
-    query = 'group: External pipeline: {} grbevent.trigger_id = "{}"'.format(
-        event_observatory, trig_id)
-    events = gracedb.get_events(query=query)
+    graceid, event = _get_existing_event(event_observatory, trig_id)
 
+    #  Update GraceDB before returning, so that the next notice for the same
+    #  trigger, which is handled after this one in the same exttrig
+    #  partition, finds the event in its current state.
     group_canvas = ()
-    if events:
-        assert len(events) == 1, 'Found more than one matching GraceDB entry'
-        event, = events
-        graceid = event['graceid']
-        if labels:
-            canvas = gracedb.create_label.si(labels[0], graceid)
-        else:
-            canvas = gracedb.remove_label.si('NOT_GRB', graceid)
-
+    if graceid:
         # Prevent SubGRBs from appending GRBs
-        if search == 'GRB':
-            # Replace event and pass already existing event dictionary
-            canvas |= gracedb.replace_event.si(graceid, payload)
-            canvas |= identity.si(event)
-        else:
+        if search != 'GRB':
             return
 
+        if event is None:
+            event = gracedb.get_event(graceid)
+        if labels:
+            gracedb.create_label(labels[0], graceid)
+        else:
+            gracedb.remove_label('NOT_GRB', graceid)
+        # Replace event and pass already existing event dictionary
+        gracedb.replace_event(graceid, payload)
+
     else:
-        canvas = gracedb.create_event.s(filecontents=payload,
-                                        search=search,
-                                        group=ext_group,
-                                        pipeline=event_observatory,
-                                        labels=labels)
+        event = gracedb.create_event(filecontents=payload,
+                                     search=search,
+                                     group=ext_group,
+                                     pipeline=event_observatory,
+                                     labels=labels)
+        if ext_group == 'External':
+            index_trigger_id(event, event_observatory, trig_id)
         group_canvas += _launch_external_detchar.s(),
 
     if search in {'GRB', 'MDC'}:
-        notice_date = root.find("./Who/Date").text
         group_canvas += external_skymaps.create_upload_external_skymap.s(
-                      notice_type, notice_date),
+                      notice_type, notice.notice_date),
     if event_observatory == 'Fermi':
         if search == 'SubGRB':
-            skymap_link = \
-                root.find("./What/Param[@name='HealPix_URL']").attrib['value']
+            skymap_link = notice.healpix_url
             group_canvas += \
                 external_skymaps.get_upload_external_skymap.s(skymap_link),
         elif search == 'GRB':
-            skymap_link = None
+            #  Pass on the HEASARC link from the notice, if it has one, so
+            #  that the original notice does not have to be downloaded from
+            #  GraceDB and parsed again to find it.
+            skymap_link = notice.lightcurve_url and \
+                external_skymaps.heasarc_link(notice.lightcurve_url)
             group_canvas += \
                 external_skymaps.get_upload_external_skymap.s(skymap_link),
 
-    (
-        canvas
-        |
-        group(group_canvas)
-    ).delay()
+    group(group_canvas).delay(event)
 
 
 @igwn_alert.handler('superevent',
@@ -223,8 +332,10 @@ def handle_grb_igwn_alert(alert):
     or GRB external trigger event, or a label associated with completeness of
     skymaps:
 
-    * Any new event triggers a coincidence search with
-      :meth:`gwcelery.tasks.raven.coincidence_search`.
+    * Every alert updates the local index of recent events that RAVEN
+      searches with :meth:`gwcelery.tasks.raven.index_event`.
+    * Any new event triggers all of the applicable coincidence searches at
+      once with :meth:`gwcelery.tasks.raven.coincidence_searches`.
     * When both a GW and GRB sky map are available during a coincidence,
       indicated by the labels ``SKYMAP_READY`` and ``EXT_SKYMAP_READY``
       respectively on the external event, this triggers the spacetime coinc
@@ -237,6 +348,9 @@ def handle_grb_igwn_alert(alert):
     # Determine GraceDB ID
     graceid = alert['uid']
 
+    # keep the local index of recent events for RAVEN up to date
+    raven.index_event(alert['object'])
+
     # launch searches
     if alert['alert_type'] == 'new':
         if alert['object'].get('group') == 'External':
@@ -249,51 +363,50 @@ def handle_grb_igwn_alert(alert):
 
             # launch search with MDC events and exit
             if alert['object']['search'] == 'MDC':
-                raven.coincidence_search(graceid, alert['object'],
-                                         group='CBC', se_searches=['MDC'])
-                raven.coincidence_search(graceid, alert['object'],
-                                         group='Burst', se_searches=['MDC'])
+                raven.coincidence_searches(graceid, alert['object'], [
+                    dict(group='CBC', se_searches=['MDC']),
+                    dict(group='Burst', se_searches=['MDC'])])
                 return
 
             # launch standard Burst-GRB search
-            raven.coincidence_search(graceid, alert['object'], group='Burst',
-                                     se_searches=['Allsky'])
+            search_params = [dict(group='Burst', se_searches=['Allsky'])]
 
             if alert['object']['search'] in ['SubGRB', 'SubGRBTargeted']:
                 # if sub-threshold GRB, launch search with that pipeline
-                raven.coincidence_search(
-                    graceid, alert['object'], group='CBC',
-                    searches=['SubGRB', 'SubGRBTargeted'],
-                    pipelines=[alert['object']['pipeline']])
+                search_params.append(dict(
+                    group='CBC', searches=['SubGRB', 'SubGRBTargeted'],
+                    pipelines=[alert['object']['pipeline']]))
             else:
                 # if threshold GRB, launch standard CBC-GRB search
-                raven.coincidence_search(graceid, alert['object'],
-                                         group='CBC', searches=['GRB'])
+                search_params.append(dict(group='CBC', searches=['GRB']))
+            raven.coincidence_searches(graceid, alert['object'],
+                                       search_params)
         elif 'S' in graceid:
             # launch standard GRB search based on group
             gw_group = alert['object']['preferred_event_data']['group']
 
             # launch search with MDC events and exit
             if alert['object']['preferred_event_data']['search'] == 'MDC':
-                raven.coincidence_search(graceid, alert['object'],
-                                         group=gw_group, searches=['MDC'])
+                raven.coincidence_searches(graceid, alert['object'], [
+                    dict(group=gw_group, searches=['MDC'])])
                 return
 
             if gw_group == 'CBC':
                 # launch subthreshold searches if CBC
                 # for Fermi and Swift separately to use different time windows
-                for pipeline in ['Fermi', 'Swift']:
-                    raven.coincidence_search(
-                        graceid, alert['object'], group='CBC',
-                        searches=['SubGRB', 'SubGRBTargeted'],
-                        pipelines=[pipeline])
+                search_params = [
+                    dict(group='CBC', searches=['SubGRB', 'SubGRBTargeted'],
+                         pipelines=[pipeline])
+                    for pipeline in ['Fermi', 'Swift']]
                 se_searches = []
             else:
+                search_params = []
                 se_searches = ['Allsky']
             # launch standard GRB search
-            raven.coincidence_search(graceid, alert['object'],
-                                     group=gw_group, searches=['GRB'],
-                                     se_searches=se_searches)
+            search_params.append(dict(group=gw_group, searches=['GRB'],
+                                      se_searches=se_searches))
+            raven.coincidence_searches(graceid, alert['object'],
+                                       search_params)
     # rerun raven pipeline or created combined sky map when sky maps are
     # available
     elif alert['alert_type'] == 'label_added' and \
@@ -361,6 +474,8 @@ def handle_snews_igwn_alert(alert):
     This igwn_alert message handler is triggered by creating a new superevent
     or SN external trigger event:
 
+    * Every alert updates the local index of recent events that RAVEN
+      searches with :meth:`gwcelery.tasks.raven.index_event`.
     * Any new event triggers a coincidence search with
       :meth:`gwcelery.tasks.raven.coincidence_search`.
 
@@ -368,6 +483,9 @@ def handle_snews_igwn_alert(alert):
     # Determine GraceDB ID
     graceid = alert['uid']
 
+    # keep the local index of recent events for RAVEN up to date
+    raven.index_event(alert['object'])
+
     if alert['alert_type'] == 'new':
         if alert['object'].get('superevent_id'):
             group = alert['object']['preferred_event_data']['group']
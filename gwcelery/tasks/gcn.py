@@ -8,6 +8,7 @@ References
 import html
 import difflib
 import urllib.parse
+import zlib
 
 from comet.utility.xml import xml_document
 import gcn
@@ -17,6 +18,7 @@ from twisted.internet import reactor
 
 from ..voevent.signals import voevent_received
 from ..import app
+from ..util.voevent import read_gcn_notice
 from .core import DispatchHandler
 from . import gracedb
 
@@ -34,6 +36,50 @@ class _VOEventDispatchHandler(DispatchHandler):
 
         return notice_type, (event.raw_bytes,), {}
 
+    def route(self, handler, event):
+        """Route handlers on the ``exttrig`` queue to per-trigger partitions.
+
+        Notices for the same trigger, identified by the observatory (the path
+        of the IVORN) and the trigger ID, always go to the same partition,
+        ``exttrig-0`` through ``exttrig-<n-1>`` where ``n`` is
+        :obj:`~gwcelery.conf.exttrig_partitions`. Each partition is consumed
+        by a single worker process, so that notices for the same trigger are
+        processed in the order in which they arrive, while notices for
+        different triggers are processed in parallel.
+        """
+        partitions = app.conf['exttrig_partitions']
+        if getattr(handler, 'queue', None) != 'exttrig' or not partitions:
+            return {}
+        return {'queue': 'exttrig-{}'.format(
+            exttrig_partition(event.element, partitions))}
+
+
+def exttrig_partition(root, partitions):
+    """Determine the ``exttrig`` partition for a GCN notice.
+
+    Parameters
+    ----------
+    root : :class:`lxml.etree._Element`
+        The root element of the notice.
+    partitions : int
+        The number of partitions.
+
+    Returns
+    -------
+    int
+        The partition, from 0 to ``partitions - 1``.
+
+    Notes
+    -----
+    This uses :func:`zlib.crc32` rather than :func:`hash`, because the hash of
+    a string is randomized in each Python process.
+
+    """
+    notice = read_gcn_notice(root)
+    observatory = urllib.parse.urlparse(notice.ivorn or '').path
+    key = '{}#{}'.format(observatory, notice.trig_id).encode()
+    return zlib.crc32(key) % partitions
+
 
 handler = _VOEventDispatchHandler()
 r"""Function decorator to register a handler callback for specified GCN notice
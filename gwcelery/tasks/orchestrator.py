@@ -252,14 +252,7 @@ def handle_cbc_event(alert):
                     gracedb.download.s('coinc.xml', graceid)
                 )
                 |
-                bayestar.localize.s(graceid)
-                |
-                gracedb.upload.s(
-                    'bayestar.multiorder.fits', graceid,
-                    'sky localization complete', ['sky_loc', 'public']
-                )
-                |
-                gracedb.create_label.si('SKYMAP_READY', graceid)
+                _localize_and_upload(graceid, priority)
             ).apply_async(priority=priority)
 
     if alert['alert_type'] != 'log':
@@ -282,17 +275,33 @@ def handle_cbc_event(alert):
                 gracedb.download.s('psd.xml.gz', graceid)
             )
             |
-            bayestar.localize.s(graceid)
-            |
-            gracedb.upload.s(
-                'bayestar.multiorder.fits', graceid,
-                'sky localization complete', ['sky_loc', 'public']
-            )
-            |
-            gracedb.create_label.si('SKYMAP_READY', graceid)
+            _localize_and_upload(graceid, priority)
         ).apply_async(priority=priority)
 
 
+def _localize_and_upload(graceid, priority):
+    """Create a canvas to localize a CBC event with BAYESTAR and upload the
+    sky map.
+
+    If :obj:`~gwcelery.conf.bayestar_batch` is set, then the event is queued
+    for :meth:`gwcelery.tasks.bayestar.localize_pending` so that it may be
+    localized in a batch with other events that are waiting.
+    """
+    upload = (
+        gracedb.upload.s(
+            'bayestar.multiorder.fits', graceid,
+            'sky localization complete', ['sky_loc', 'public']
+        )
+        |
+        gracedb.create_label.si('SKYMAP_READY', graceid)
+    )
+    if app.conf['bayestar_batch']:
+        return bayestar.localize_batched.s(
+            graceid, priority=priority, callback=upload)
+    else:
+        return bayestar.localize.s(graceid) | upload
+
+
 @igwn_alert.handler('superevent',
                     'mdc_superevent',
                     shared=False)
@@ -103,7 +103,7 @@ def _format_prob(prob):
         return '{}%'.format(int(np.round(100 * prob)))
 
 
-@app.task(shared=False)
+@app.task(shared=False, queue='plot')
 @closing_figures()
 def plot(contents):
     """Make a visualization of the source classification.
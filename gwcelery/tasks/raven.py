@@ -1,20 +1,59 @@
 """Search for GRB-GW coincidences with ligo-raven."""
+import functools
+import json
+import pickle
+
+from astropy.time import Time
+import ligo.raven.gracedb_events
 import ligo.raven.search
 from celery import group
 from celery.utils.log import get_task_logger
+import numpy as np
 
 from ..import app
 from . import external_skymaps
 from . import gracedb
+from ..igwn_alert.signals import igwn_alert_heartbeat
+from ..util.cache import memoize
 
 log = get_task_logger(__name__)
 
 
+@memoize()
+def _skymap_overlap(superevent_id, se_filename, exttrig_id,
+                    ext_filename=None, ra=None, dec=None):
+    """Download the sky maps of a superevent and an external event and compute
+    their overlap integral with
+    :meth:`gwcelery.tasks.external_skymaps.skymap_overlap`.
+
+    The file names must include their versions, so that they always refer to
+    the same contents and the result can be memoized by them. This way, the
+    sky maps are not downloaded again unless a new version is uploaded.
+    Without an external sky map, the external event is treated as a point at
+    the given position.
+    """
+    se_filecontents = gracedb.download(se_filename, superevent_id)
+    if ext_filename is None:
+        return external_skymaps.skymap_overlap(se_filecontents, ra=ra, dec=dec)
+    return external_skymaps.skymap_overlap(
+        se_filecontents, gracedb.download(ext_filename, exttrig_id))
+
+
 @app.task(shared=False)
 def calculate_coincidence_far(superevent, exttrig, tl, th):
     """Compute coincidence FAR for external trigger and superevent
-    coincidence by calling ligo.raven.search.calc_signif_gracedb,
-    using sky map info if available.
+    coincidence, using sky map info if available.
+
+    The temporal coincidence FAR is computed by
+    :func:`ligo.raven.search.coinc_far`. If both sky maps are available, then
+    the spatiotemporal coincidence FAR is the temporal coincidence FAR divided
+    by the sky map overlap integral. The overlap integral is computed in
+    memory on the multi-order sky maps and memoized (see
+    :meth:`_skymap_overlap`), so that it is not recomputed, and the sky maps
+    are not downloaded again, when this task runs again because of unrelated
+    label changes. The results are written to the GraceDB logs of both events
+    through the ligo-raven event objects, as by
+    :func:`ligo.raven.search.calc_signif_gracedb`.
 
     Parameters
     ----------
@@ -27,6 +66,13 @@ def calculate_coincidence_far(superevent, exttrig, tl, th):
     th: float
         end of coincident time window
 
+    Raises
+    ------
+    ZeroDivisionError
+        If the coincidence FAR could not be computed, for example because the
+        sky maps do not overlap, as from
+        :func:`ligo.raven.search.calc_signif_gracedb`.
+
     """
     superevent_id = superevent['superevent_id']
     exttrig_id = exttrig['graceid']
@@ -35,29 +81,61 @@ def calculate_coincidence_far(superevent, exttrig, tl, th):
     if exttrig['pipeline'] == 'SNEWS':
         return {}
 
-    if {'EXT_SKYMAP_READY', 'SKYMAP_READY'}.issubset(exttrig['labels']):
-        #  if both sky maps available, calculate spatial coinc far
-        se_skymap = external_skymaps.get_skymap_filename(
-            superevent_id)
-        ext_skymap = external_skymaps.get_skymap_filename(
-            exttrig_id)
-
-        return ligo.raven.search.calc_signif_gracedb(
-                   superevent_id, exttrig_id, tl, th,
-                   se_dict=superevent, ext_dict=exttrig,
-                   grb_search=exttrig['search'],
-                   se_fitsfile=se_skymap, ext_fitsfile=ext_skymap,
-                   se_moc=True, ext_moc=False,
-                   use_radec=True if exttrig['pipeline'] == 'Swift' else False,
-                   incl_sky=True, gracedb=gracedb.client,
-                   far_grb=exttrig['far'])
-    else:
-        return ligo.raven.search.calc_signif_gracedb(
-                   superevent_id, exttrig_id, tl, th,
-                   se_dict=superevent, ext_dict=exttrig,
-                   grb_search=exttrig['search'],
-                   incl_sky=False, gracedb=gracedb.client,
-                   far_grb=exttrig['far'])
+    coinc_far = ligo.raven.search.coinc_far(
+        superevent_id, exttrig_id, tl, th,
+        se_dict=superevent, ext_dict=exttrig,
+        grb_search=exttrig['search'],
+        incl_sky=False, gracedb=gracedb.client,
+        far_grb=exttrig['far'])
+
+    #  if both sky maps available, calculate spatial coinc far
+    if not isinstance(coinc_far, str) and \
+            {'EXT_SKYMAP_READY', 'SKYMAP_READY'}.issubset(exttrig['labels']):
+        se_filename = external_skymaps.get_skymap_filename(
+            superevent_id, is_versioned=True)
+        if exttrig['pipeline'] == 'Swift':
+            skymap_overlap = _skymap_overlap(
+                superevent_id, se_filename, exttrig_id,
+                ra=exttrig['extra_attributes']['GRB']['ra'],
+                dec=exttrig['extra_attributes']['GRB']['dec'])
+        else:
+            skymap_overlap = _skymap_overlap(
+                superevent_id, se_filename, exttrig_id,
+                external_skymaps.get_skymap_filename(
+                    exttrig_id, is_versioned=True))
+        if skymap_overlap > 0:
+            coinc_far['skymap_overlap'] = skymap_overlap
+            coinc_far['spatiotemporal_coinc_far'] = \
+                coinc_far['temporal_coinc_far'] / skymap_overlap
+        else:
+            coinc_far = (
+                'RAVEN: WARNING: Sky maps minimally overlap. Sky map overlap '
+                'integral is {0:.2e}. There is strong evidence against these '
+                'events being coincident.').format(skymap_overlap)
+
+    se = ligo.raven.gracedb_events.SE(
+        superevent_id, event_dict=superevent, gracedb=gracedb.client)
+    ext = ligo.raven.gracedb_events.ExtTrig(
+        exttrig_id, event_dict=exttrig, gracedb=gracedb.client)
+    if isinstance(coinc_far, str):
+        se.submit_gracedb_log(coinc_far, tags=['ext_coinc'])
+        ext.submit_gracedb_log(coinc_far, tags=['ext_coinc'])
+        raise ZeroDivisionError(coinc_far)
+
+    base_url, _, _ = gracedb.client.url.partition('api/')
+    filecontents = json.dumps(coinc_far)
+    se.submit_gracedb_log(
+        "RAVEN: Computed coincident FAR(s) in Hz with external trigger "
+        "<a href='{0}events/{1}'>{1}</a>".format(base_url, exttrig_id),
+        filename='coincidence_far.json', filecontents=filecontents,
+        tags=['ext_coinc'])
+    ext.submit_gracedb_log(
+        "RAVEN: Computed coincident FAR(s) in Hz with superevent "
+        "<a href='{0}superevents/{1}'>{1}</a>".format(
+            base_url, superevent_id),
+        filename='coincidence_far.json', filecontents=filecontents,
+        tags=['ext_coinc'])
+    return coinc_far
 
 
 @app.task(shared=False)
@@ -66,6 +144,8 @@ def coincidence_search(gracedb_id, alert_object, group=None, pipelines=[],
     """Perform ligo-raven search for coincidences. Determines time window to
     use. If events found, launches raven pipeline.
 
+    This is the same as :meth:`coincidence_searches` with a single search.
+
     Parameters
     ----------
     gracedb_id: str
@@ -78,13 +158,43 @@ def coincidence_search(gracedb_id, alert_object, group=None, pipelines=[],
         list of external trigger pipeline names
 
     """
-    tl, th = _time_window(gracedb_id, group, pipelines, searches)
+    coincidence_searches(gracedb_id, alert_object, [
+        dict(group=group, pipelines=pipelines, searches=searches,
+             se_searches=se_searches)])
+
+
+@app.task(shared=False)
+def coincidence_searches(gracedb_id, alert_object, search_params):
+    """Perform several ligo-raven searches for coincidences at once.
+    Determines the time window to use for each search, finds the coincident
+    events for all of them in a single pass with :meth:`search_windows`, and
+    launches the raven pipeline for each search that found events.
+
+    Parameters
+    ----------
+    gracedb_id: str
+        ID of the trigger used by GraceDB
+    alert_object: dict
+        Alert dictionary
+    search_params: list
+        list of dictionaries of the keyword arguments ``group``,
+        ``pipelines``, ``searches``, and ``se_searches`` of
+        :meth:`coincidence_search`, one for each search
+
+    """
+    windows = []
+    for params in search_params:
+        group = params.get('group')
+        pipelines = params.get('pipelines', [])
+        searches = params.get('searches', [])
+        tl, th = _time_window(gracedb_id, group, pipelines, searches)
+        windows.append((tl, th, group, pipelines, searches,
+                        params.get('se_searches', [])))
 
     (
-        search.si(gracedb_id, alert_object, tl, th, group, pipelines,
-                  searches, se_searches)
+        search_windows.si(gracedb_id, alert_object, windows)
         |
-        raven_pipeline.s(gracedb_id, alert_object, tl, th, group)
+        raven_pipelines.s(gracedb_id, alert_object, windows)
     ).delay()
 
 
@@ -133,11 +243,191 @@ def _time_window(gracedb_id, group, pipelines, searches):
     return tl, th
 
 
+INDEX_KEYS = {'E': 'gwcelery-raven-external',
+              'S': 'gwcelery-raven-superevents'}
+"""Keys of the Redis sorted sets of the IDs of recent external events and
+superevents, scored by their GPS times."""
+
+EVENTS_KEY = 'gwcelery-raven-events'
+"""Key of the Redis hash of the most recent dictionaries of the events in the
+index."""
+
+INDEX_START_KEY = 'gwcelery-raven-index-start'
+"""Key of the GPS time at which the index started receiving events."""
+
+INDEX_HEARTBEAT_KEY = 'gwcelery-raven-index-heartbeat'
+"""Key of the GPS time at which the IGWN alert listener last reported that it
+was running. It expires after :obj:`~gwcelery.conf.raven_index_max_gap`
+seconds."""
+
+
+def _index_entry(event):
+    """Get the type, ID, and GPS time of a superevent or external event, or
+    None if it is neither.
+    """
+    if 'superevent_id' in event and 't_0' in event:
+        return 'S', event['superevent_id'], float(event['t_0'])
+    elif event.get('group') == 'External' and 'gpstime' in event:
+        return 'E', event['graceid'], float(event['gpstime'])
+
+
+def index_event(event):
+    """Add or update a superevent or external event in the local index of
+    recent events that :meth:`search` queries for coincidences.
+
+    This is called for every IGWN alert about superevents and external events,
+    so that the index always has their latest state. Events whose times are
+    more than :obj:`~gwcelery.conf.raven_index_retention` seconds in the past
+    are dropped from the index.
+
+    The index is only trusted for times at which the IGWN alert listener was
+    running (see :meth:`index_heartbeat`).
+
+    Parameters
+    ----------
+    event : dict
+        Superevent or external event dictionary
+
+    """
+    retention = app.conf['raven_index_retention']
+    entry = _index_entry(event)
+    if not retention or entry is None:
+        return
+    event_type, graceid, gpstime = entry
+    now = float(Time.now().gps)
+
+    client = app.backend.client
+    client.hset(EVENTS_KEY, graceid, pickle.dumps(event))
+    client.zadd(INDEX_KEYS[event_type], {graceid: gpstime})
+    for key in INDEX_KEYS.values():
+        expired = client.zrangebyscore(key, '-inf', now - retention)
+        if expired:
+            client.zrem(key, *expired)
+            client.hdel(EVENTS_KEY, *expired)
+
+
+@igwn_alert_heartbeat.connect
+def index_heartbeat(**kwargs):
+    """Record that the IGWN alert listener, which feeds the local index of
+    recent events, is running.
+
+    This is called periodically by the worker that runs the listener. If it
+    has not been called for more than
+    :obj:`~gwcelery.conf.raven_index_max_gap` seconds, then the listener may
+    have been down and the index may have missed events, so the index is only
+    trusted for times after the listener reports that it is running again.
+    """
+    if not app.conf['raven_index_retention']:
+        return
+    now = float(Time.now().gps)
+    client = app.backend.client
+    if not client.exists(INDEX_HEARTBEAT_KEY):
+        client.set(INDEX_START_KEY, now)
+    client.set(INDEX_HEARTBEAT_KEY, now,
+               ex=int(app.conf['raven_index_max_gap']))
+
+
+def _query_index(event_type, gpstime, windows):
+    """Find events of type `event_type` in the local index that are in the
+    union of the time windows of all of the searches in `windows`.
+
+    Returns the list of event dictionaries, or None if the index does not
+    cover all of the time windows.
+    """
+    retention = app.conf['raven_index_retention']
+    if not retention:
+        return None
+    client = app.backend.client
+    index_start = client.get(INDEX_START_KEY)
+    start = gpstime + min(window[0] for window in windows)
+    end = gpstime + max(window[1] for window in windows)
+    if index_start is None or not client.exists(INDEX_HEARTBEAT_KEY) or \
+            start < max(float(index_start), Time.now().gps - retention):
+        return None
+
+    ids = client.zrangebyscore(INDEX_KEYS[event_type], start, end)
+    return [
+        pickle.loads(value) for value in client.hmget(EVENTS_KEY, ids)
+        if value is not None] if ids else []
+
+
+def _query_gracedb(event_type, gpstime, windows):
+    """Find events of type `event_type` in GraceDB that are in the union of
+    the time windows of all of the searches in `windows`, with one query for
+    the MDC searches and one for the others.
+    """
+    column = 5 if event_type == 'S' else 4
+    results = []
+    for mdc in sorted({'MDC' in window[column] for window in windows}):
+        searches = ['MDC'] if mdc else []
+        results += ligo.raven.search.query(
+            'Superevent' if event_type == 'S' else 'External', gpstime,
+            min(window[0] for window in windows),
+            max(window[1] for window in windows),
+            gracedb=gracedb.client,
+            searches=searches if event_type == 'E' else [],
+            se_searches=searches if event_type == 'S' else [])
+    return results
+
+
+def _window_candidates(candidates, event_type, gpstime, window):
+    """Select the candidates in the time window of one search, and that are
+    MDC events if and only if the search is for MDC events, like the GraceDB
+    query of :func:`ligo.raven.search.query` does."""
+    tl, th, _, _, searches, se_searches = window
+    if event_type == 'S':
+        time_key, mdc = 't_0', 'MDC' in se_searches
+    else:
+        time_key, mdc = 'gpstime', 'MDC' in searches
+    return [
+        event for event in candidates
+        if gpstime + tl <= float(event[time_key]) <= gpstime + th and
+        _is_mdc(event) == mdc]
+
+
+def _is_mdc(event):
+    if 'superevent_id' in event:
+        return event.get('category') == 'MDC'
+    else:
+        return event.get('search') == 'MDC'
+
+
+class _CandidateResource:
+    """Stand-in for the ``events`` or ``superevents`` resource of the GraceDB
+    client whose searches return a list of candidates that were found in
+    advance, and whose items are those of the real resource."""
+
+    def __init__(self, resource, candidates):
+        self.resource = resource
+        self.candidates = candidates
+
+    def search(self, query):
+        return list(self.candidates)
+
+    def __getitem__(self, graceid):
+        return self.resource[graceid]
+
+
+class _CandidateClient:
+    """Stand-in for the GraceDB client that lets
+    :func:`ligo.raven.search.search` apply its filters and log its results for
+    the candidates of one search that were found in advance.
+    """
+
+    def __init__(self, candidates):
+        self.url = gracedb.client.url
+        self.events = _CandidateResource(gracedb.client.events, candidates)
+        self.superevents = _CandidateResource(
+            gracedb.client.superevents, candidates)
+
+
 @app.task(shared=False)
 def search(gracedb_id, alert_object, tl=-5, th=5, group=None,
            pipelines=[], searches=[], se_searches=[]):
     """Perform ligo-raven search for coincidences.
 
+    This is the same as :meth:`search_windows` with a single search.
+
     Parameters
     ----------
     gracedb_id: str
@@ -159,12 +449,110 @@ def search(gracedb_id, alert_object, tl=-5, th=5, group=None,
         list with the dictionaries of related gracedb events
 
     """
-    return ligo.raven.search.search(gracedb_id, tl, th,
-                                    event_dict=alert_object,
-                                    gracedb=gracedb.client,
-                                    group=group, pipelines=pipelines,
-                                    searches=searches,
-                                    se_searches=se_searches)
+    results, = search_windows(
+        gracedb_id, alert_object,
+        [(tl, th, group, pipelines, searches, se_searches)])
+    return results
+
+
+@app.task(shared=False)
+def search_windows(gracedb_id, alert_object, windows):
+    """Perform several ligo-raven searches for coincidences in a single pass.
+
+    The candidates for all of the searches are found at once in the union of
+    their time windows, with a range query of the local index of recent events
+    (see :meth:`index_event`). If the index does not cover the whole time
+    range, if it is disabled, or if the event is not one that is indexed,
+    then the candidates are found with a single GraceDB query instead. Then,
+    the candidates in the time window of each search are selected (see
+    :meth:`_window_candidates`) and passed to
+    :func:`ligo.raven.search.search`, which applies the group, pipeline, and
+    search filters and logs the results to GraceDB. GraceDB is only contacted
+    to get the latest state of the coincident events that are found in the
+    index.
+
+    Parameters
+    ----------
+    gracedb_id: str
+        ID of the trigger used by GraceDB
+    alert_object: dict
+        Alert dictionary
+    windows: list
+        list of tuples of the arguments ``tl, th, group, pipelines,
+        searches, se_searches`` of :meth:`search`, one for each search
+
+    Returns
+    -------
+        list with a list of the dictionaries of related gracedb events for
+        each search
+
+    """
+    event_type = 'E' if 'S' in gracedb_id else 'S'
+    gpstime = float(alert_object['t_0' if event_type == 'E' else 'gpstime'])
+    # Events that are not indexed, such as external events in the Test group,
+    # are searched for in GraceDB.
+    if _index_entry(alert_object) is None:
+        candidates = None
+    else:
+        candidates = _query_index(event_type, gpstime, windows)
+    from_index = candidates is not None
+    if not from_index:
+        candidates = _query_gracedb(event_type, gpstime, windows)
+
+    latest = {}
+    results = []
+    for window in windows:
+        tl, th, gw_group, pipelines, searches, se_searches = window
+        client = _CandidateClient(_window_candidates(
+            candidates, event_type, gpstime, window))
+        neighbors = ligo.raven.search.search(
+            gracedb_id, tl, th, gracedb=client, group=gw_group,
+            pipelines=pipelines, searches=searches, se_searches=se_searches,
+            event_dict=alert_object)
+        if from_index:
+            neighbors = [_latest_state(neighbor, latest)
+                         for neighbor in neighbors]
+        results.append(neighbors)
+    return results
+
+
+def _latest_state(event, latest):
+    """Get the latest state of an event that was found in the index from
+    GraceDB, only once per event, and update the index with it."""
+    _, graceid, _ = _index_entry(event)
+    if graceid not in latest:
+        if 'superevent_id' in event:
+            latest[graceid] = gracedb.get_superevent(graceid)
+        else:
+            latest[graceid] = gracedb.get_event(graceid)
+        index_event(latest[graceid])
+    return latest[graceid]
+
+
+@app.task(shared=False, ignore_result=True)
+def raven_pipelines(search_windows_results, gracedb_id, alert_object,
+                    windows):
+    """Launch the raven pipeline for each search in :meth:`search_windows`
+    that found coincident events.
+
+    Parameters
+    ----------
+    search_windows_results: list
+        list of the results of each search
+    gracedb_id: str
+        ID of either a superevent or external trigger
+    alert_object: dict
+        Alert dictionary, either a superevent or an external event
+    windows: list
+        list of tuples of the arguments ``tl, th, group, pipelines,
+        searches, se_searches`` of :meth:`search`, one for each search
+
+    """
+    for results, window in zip(search_windows_results, windows):
+        tl, th, gw_group, *_ = window
+        if results:
+            raven_pipeline(results, gracedb_id, alert_object, tl, th,
+                           gw_group)
 
 
 @app.task(shared=False)
@@ -240,7 +628,8 @@ def preferred_superevent(raven_search_results):
 def update_coinc_far(coinc_far_dict, superevent, ext_event):
     """Update joint info in superevent based on the current preferred
     coincidence. This prefers a spacetime joint FAR over a time-only joint
-    FAR. A SNEWS coincidence is preferred over either.
+    FAR. A SNEWS coincidence is preferred over either. The new coincidence is
+    compared with the current one by :func:`preferred_coincidences`.
 
       Parameters
     ----------
@@ -263,28 +652,180 @@ def update_coinc_far(coinc_far_dict, superevent, ext_event):
                                   space_coinc_far=None)
         return coinc_far_dict
 
-    #  Load needed variables
-    infty = float('inf')
-    new_time_far = coinc_far_dict['temporal_coinc_far']
-    new_space_far = coinc_far_dict['spatiotemporal_coinc_far']
-    #  Map None to infinity to make logic easier
-    new_space_far_f = new_space_far if new_space_far else infty
-    old_time_far = superevent['time_coinc_far']
-    old_time_far_f = old_time_far if old_time_far else infty
-    old_space_far = superevent['space_coinc_far']
-    old_space_far_f = old_space_far if old_space_far else infty
-
     superevent_id = superevent['superevent_id']
     ext_id = ext_event['graceid']
+    new_time_far = coinc_far_dict['temporal_coinc_far']
+    new_space_far = coinc_far_dict['spatiotemporal_coinc_far']
 
-    if new_space_far_f < old_space_far_f or \
-            (new_time_far < old_time_far_f and old_space_far_f == infty):
+    #  The current coincidence goes first, so that it is only replaced by a
+    #  strictly better one
+    preferred = preferred_coincidences(
+        [superevent_id, superevent_id],
+        [np.nan if far is None else far
+         for far in (superevent['time_coinc_far'], new_time_far)],
+        [np.nan if far is None else far
+         for far in (superevent['space_coinc_far'], new_space_far)])
+    if preferred[superevent_id] == 1:
         gracedb.update_superevent(superevent_id, em_type=ext_id,
                                   time_coinc_far=new_time_far,
                                   space_coinc_far=new_space_far)
     return coinc_far_dict
 
 
+def _raven_temporal_coinc_far(search, pipeline, gw_far, ext_far=None):
+    """Compute the temporal coincidence FAR of a pair of events for a time
+    window of one second with :func:`ligo.raven.search.coinc_far`.
+    """
+    try:
+        result = ligo.raven.search.coinc_far(
+            'S', 'E', 0, 1, grb_search=search, far_grb=ext_far,
+            se_dict={'far': gw_far, 'preferred_event': None, 't_0': 0},
+            ext_dict={'pipeline': pipeline, 'gpstime': 0},
+            gracedb=gracedb.client)
+    except AssertionError as e:
+        raise ValueError(str(e))
+    if isinstance(result, str):
+        raise ValueError(result)
+    return result['temporal_coinc_far']
+
+
+@functools.lru_cache(maxsize=None)
+def _raven_unit_coinc_far(search, pipeline):
+    """Compute the temporal coincidence FAR that
+    :func:`ligo.raven.search.coinc_far` gives for a search with a GW FAR and
+    an external FAR of 1 Hz and a time window of one second.
+
+    For all searches but the targeted subthreshold search, this is the
+    detection rate of external events in Hz. For the targeted subthreshold
+    search, whose FAR for a product of FARs z is z (1 - log(z / z_max)), it is
+    1 + log(z_max).
+    """
+    return _raven_temporal_coinc_far(search, pipeline, 1.0, 1.0)
+
+
+def coinc_fars(gw_far, tl, th, search='GRB', ext_pipeline='Fermi',
+               ext_far=None, em_rate=None, skymap_overlap=None):
+    """Compute the coincidence FARs of many pairs of superevents and external
+    events at once.
+
+    This is a vectorized version of :func:`ligo.raven.search.coinc_far` for
+    replays and mock data challenges, which takes the properties of the events
+    and the sky map overlap integrals (see
+    :meth:`gwcelery.tasks.external_skymaps.skymap_overlap`) instead of their
+    GraceDB IDs. All of the arguments are broadcast against each other.
+
+    Parameters
+    ----------
+    gw_far : array_like
+        FAR of each superevent in Hz.
+    tl, th : array_like
+        Start and end of each coincidence time window in seconds.
+    search : array_like
+        Search of each external event: ``'GRB'``, ``'MDC'``, ``'SubGRB'``, or
+        ``'SubGRBTargeted'``.
+    ext_pipeline : array_like
+        Pipeline of each external event. Only used for the targeted
+        subthreshold search, which supports ``'Fermi'`` and ``'Swift'``.
+    ext_far : array_like, optional
+        FAR of each external event in Hz. Only used for the targeted
+        subthreshold search.
+    em_rate : array_like, optional
+        Detection rate of external events in Hz. By default, the rate that
+        :func:`ligo.raven.search.coinc_far` assumes for each search.
+    skymap_overlap : array_like, optional
+        Sky map overlap integral of each pair, or NaN if it is not available.
+
+    Returns
+    -------
+    dict
+        Dictionary with the keys ``temporal_coinc_far`` and
+        ``spatiotemporal_coinc_far``, whose values are arrays of FARs in Hz.
+        The spatiotemporal coincidence FAR is NaN for pairs without a positive
+        sky map overlap integral.
+
+    Raises
+    ------
+    ValueError
+        If any of the searches or pipelines are not supported.
+
+    """
+    gw_far, tl, th, search, ext_pipeline, ext_far, em_rate, skymap_overlap = \
+        np.broadcast_arrays(
+            np.asarray(gw_far, dtype=float), tl, th, search, ext_pipeline,
+            np.asarray(ext_far, dtype=float), np.asarray(em_rate, dtype=float),
+            np.asarray(skymap_overlap, dtype=float))
+    duration = th - tl
+
+    # The rates and thresholds of each search are those of ligo-raven, so
+    # that these FARs agree with the ones of calculate_coincidence_far.
+    is_targeted = search == 'SubGRBTargeted'
+    unit_coinc_far = np.full(gw_far.shape, np.nan)
+    for key in set(zip(np.ravel(search).tolist(),
+                       np.ravel(ext_pipeline).tolist())):
+        i = (search == key[0]) & (ext_pipeline == key[1])
+        unit_coinc_far[i] = _raven_unit_coinc_far(*key)
+
+    em_rate = np.where(np.isnan(em_rate), unit_coinc_far, em_rate)
+    # Map the product of uniformly drawn distributions to CDF. For the
+    # targeted search, z (1 - log(z / (duration z_max))) is equal to
+    # z (1 + log(z_max) - log(z / duration)).
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = duration * ext_far * gw_far
+        temporal_coinc_far = np.where(
+            is_targeted, z * (unit_coinc_far - np.log(z / duration)),
+            duration * em_rate * gw_far)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        spatiotemporal_coinc_far = np.where(
+            skymap_overlap > 0, temporal_coinc_far / skymap_overlap, np.nan)
+
+    return {'temporal_coinc_far': temporal_coinc_far,
+            'spatiotemporal_coinc_far': spatiotemporal_coinc_far}
+
+
+def preferred_coincidences(superevent_ids, temporal_coinc_far,
+                           spatiotemporal_coinc_far, snews=False):
+    """Choose the preferred coincidence of each of many superevents at once.
+
+    This applies the rules of :meth:`update_coinc_far` to all of the
+    coincidences of each superevent: a SNEWS coincidence is preferred over any
+    other, then the coincidence with the lowest spatiotemporal coincidence FAR,
+    or, if there are none, the one with the lowest temporal coincidence FAR.
+    Ties go to the coincidence that comes first. To take into account the
+    coincidence that is already recorded for a superevent, include it as one of
+    the candidates.
+
+    Parameters
+    ----------
+    superevent_ids : array_like
+        Superevent ID of each coincidence.
+    temporal_coinc_far, spatiotemporal_coinc_far : array_like
+        Coincidence FARs of each coincidence in Hz. NaN means not available.
+    snews : array_like
+        Whether each coincidence is with a SNEWS event.
+
+    Returns
+    -------
+    dict
+        Dictionary mapping each superevent ID to the index of its preferred
+        coincidence.
+
+    """
+    superevent_ids, time_far, space_far, snews = np.broadcast_arrays(
+        np.asarray(superevent_ids), np.asarray(temporal_coinc_far, float),
+        np.asarray(spatiotemporal_coinc_far, float), snews)
+    time_far = np.where(np.isnan(time_far), np.inf, time_far)
+    space_far = np.where(np.isnan(space_far), np.inf, space_far)
+    # Compare the temporal coincidence FARs only if there are no
+    # spatiotemporal coincidence FARs, so that ties are broken by order.
+    time_far = np.where(np.isinf(space_far), time_far, 0)
+    unique_ids, group_index = np.unique(superevent_ids, return_inverse=True)
+    order = np.lexsort((time_far, space_far, ~snews.astype(bool),
+                        group_index))
+    _, first = np.unique(group_index[order], return_index=True)
+    return dict(zip(unique_ids.tolist(), order[first].tolist()))
+
+
 @app.task(shared=False)
 def trigger_raven_alert(coinc_far_dict, superevent, gracedb_id,
                         ext_event, gw_group):
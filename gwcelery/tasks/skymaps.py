@@ -1,26 +1,41 @@
 """Annotations for sky maps."""
+import functools
 import io
 import os
 import tempfile
 
+from astropy.coordinates import SkyCoord
 from astropy.io import fits
-from astropy import table
+from astropy.wcs import WCS
 from celery import group
 from celery.exceptions import Ignore
+from celery.signals import celeryd_init
+import healpy as hp
+from ligo.skymap import distance
+from ligo.skymap import moc
+from ligo.skymap import plot  # noqa: F401
+from ligo.skymap import postprocess
+from ligo.skymap.io import read_sky_map
 from ligo.skymap.tool import ligo_skymap_flatten
 from ligo.skymap.tool import ligo_skymap_from_samples
-from ligo.skymap.tool import ligo_skymap_plot
 from ligo.skymap.tool import ligo_skymap_plot_volume
 from matplotlib import pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 import numpy as np
 
 from . import gracedb
 from . import igwn_alert
 from ..import app
 from ..jinja import env
+from ..util.cache import memoize
 from ..util.cmdline import handling_system_exit
-from ..util.matplotlib import closing_figures
-from ..util.tempfile import NamedTemporaryFile
+from ..util.matplotlib import closing_figures, removing_new_artists
+from ..util.tempfile import BytesFile, NamedMemoryFile, NamedTemporaryFile
+
+CONTOUR_ORDER = 8
+"""HEALPix order at which :meth:`credible_contours` traces credible
+contours."""
 
 
 @app.task(ignore_result=True, shared=False)
@@ -86,9 +101,13 @@ def annotate_fits(filecontents, versioned_filename, graceid, tags):
 
 
 def is_3d_fits_file(filecontents):
-    """Determine if a FITS file has distance information."""
-    with NamedTemporaryFile(content=filecontents) as fitsfile:
-        return 'DISTNORM' in table.Table.read(fitsfile.name).colnames
+    """Determine if a FITS file has distance information.
+
+    This reads only the column names from the FITS header. See
+    :meth:`summarize` for statistics that require the sky map's data.
+    """
+    with fits.open(BytesFile(filecontents)) as hdus:
+        return 'DISTNORM' in hdus[1].columns.names
 
 
 @app.task(ignore_result=True, shared=False)
@@ -102,37 +121,296 @@ def annotate_fits_volume(filecontents, *args):
         ).apply_async()
 
 
+@memoize()
+def _fits_header_cards(filecontents):
+    """Get the keyword, value, and comment of every card in every HDU of a
+    FITS file."""
+    with fits.open(BytesFile(filecontents)) as hdus:
+        return [[(card.keyword, card.value, card.comment)
+                 for card in hdu.header.cards] for hdu in hdus]
+
+
 @app.task(shared=False)
 def fits_header(filecontents, filename):
     """Dump FITS header to HTML."""
     template = env.get_template('fits_header.jinja2')
-    with NamedTemporaryFile(content=filecontents) as fitsfile, \
-            fits.open(fitsfile.name) as hdus:
-        return template.render(filename=filename, hdus=hdus)
+    return template.render(filename=filename,
+                           hdus=_fits_header_cards(filecontents))
+
+
+@functools.lru_cache(maxsize=16)
+def _projection_grid(header, order):
+    """Find the nested HEALPix pixel index at a given order for every image
+    pixel of an all-sky projection.
+
+    This is the expensive part of rendering a HEALPix map into a projection,
+    but it only depends on the shape and WCS of the axes and on the HEALPix
+    resolution, so it is cached for the lifetime of the worker process.
+
+    Parameters
+    ----------
+    header : str
+        The FITS header of the axes' WCS, as a string.
+    order : int
+        The HEALPix order.
+
+    Returns
+    -------
+    ipix : numpy.ndarray
+        Read-only array of nested pixel indices with the same shape as the
+        image, or -1 for image pixels that fall outside of the sky.
+
+    """
+    header = fits.Header.fromstring(header)
+    shape = (header['NAXIS2'], header['NAXIS1'])
+    x, y = np.meshgrid(np.arange(shape[1]), np.arange(shape[0]))
+    lon, lat = WCS(header).pixel_to_world_values(x, y)
+    valid = np.isfinite(lon) & np.isfinite(lat)
+    ipix = np.full(shape, -1, dtype=np.int64)
+    ipix[valid] = hp.ang2pix(
+        2**order, lon[valid], lat[valid], nest=True, lonlat=True)
+    ipix.flags.writeable = False
+    return ipix
+
+
+def _moc_index(uniq, order, ipix):
+    """Find the rows of a multi-order sky map that contain a set of pixels.
+
+    Parameters
+    ----------
+    uniq : numpy.ndarray
+        The UNIQ pixel indices of the multi-order sky map.
+    order : int
+        The HEALPix order of the pixels to look up.
+    ipix : numpy.ndarray
+        The nested pixel indices to look up.
+
+    Returns
+    -------
+    index : numpy.ndarray
+        The row of the sky map that contains each pixel (or, for pixels that
+        are larger than the sky map's pixels, each pixel's first descendant).
+
+    """
+    moc_order, moc_ipix = moc.uniq2nest(uniq)
+    max_order = max(int(moc_order.max()), order)
+    first = moc_ipix << (2 * (max_order - moc_order))
+    sort = np.argsort(first)
+    i = np.searchsorted(
+        first[sort], ipix << (2 * (max_order - order)), side='right') - 1
+    return sort[i]
+
+
+def _credible_levels(skymap):
+    """Find the credible level of every pixel of a multi-order sky map.
+
+    Returns
+    -------
+    levels : numpy.ndarray
+        The credible level of each pixel, in percent.
+    prob : numpy.ndarray
+        The cumulative probability, in descending order of probability density.
+    area : numpy.ndarray
+        The cumulative area in deg², in the same order as `prob`.
+
+    """
+    i = np.argsort(skymap['PROBDENSITY'])[::-1]
+    pixarea = moc.uniq2pixarea(skymap['UNIQ'][i])
+    prob = np.cumsum(skymap['PROBDENSITY'][i] * pixarea)
+    levels = np.empty(len(skymap))
+    levels[i] = 100 * prob
+    return levels, prob, np.cumsum(pixarea) * np.rad2deg(1)**2
 
 
 @app.task(shared=False)
-@closing_figures()
-def plot_allsky(filecontents, ra=None, dec=None):
-    """Plot a Mollweide projection of a sky map using the command-line tool
-    :doc:`ligo-skymap-plot <ligo.skymap:tool/ligo_skymap_plot>`.
+@memoize()
+def summarize(filecontents, contours=(50, 90)):
+    """Compute summary statistics of a sky map.
+
+    Multi-order sky maps are summarized directly, without flattening. The
+    result is memoized, so every consumer of the same sky map, such as
+    :meth:`plot_allsky`, shares a single computation.
+
+    Parameters
+    ----------
+    filecontents : bytes
+        The contents of the FITS file.
+    contours : tuple
+        Credible levels in percent.
+
+    Returns
+    -------
+    dict
+        A dictionary with the following keys:
+
+        * ``objid``: the event ID from the FITS header, or None
+        * ``is_3d``: True if the sky map has distance information
+        * ``credible_areas``: dictionary of the area in deg² of the smallest
+          region that contains each credible level
+        * ``distmean``, ``diststd``: posterior mean and standard deviation of
+          the luminosity distance in Mpc, or None for a 2D sky map
+
     """
-    # Explicitly use a non-interactive Matplotlib backend.
+    skymap = read_sky_map(BytesFile(filecontents), moc=True)
+    _, cumprob, cumarea = _credible_levels(skymap)
+    areas = {}
+    for contour in contours:
+        i = min(np.searchsorted(cumprob, 1e-2 * contour), len(cumarea) - 1)
+        areas[contour] = float(cumarea[i])
+
+    is_3d = 'DISTNORM' in skymap.colnames
+    distmean = skymap.meta.get('distmean')
+    diststd = skymap.meta.get('diststd')
+    if is_3d and (distmean is None or diststd is None):
+        prob = skymap['PROBDENSITY'] * moc.uniq2pixarea(skymap['UNIQ'])
+        distmean, diststd = distance.parameters_to_marginal_moments(
+            prob, skymap['DISTMU'], skymap['DISTSIGMA'])
+
+    return {
+        'objid': skymap.meta.get('objid'),
+        'is_3d': is_3d,
+        'credible_areas': areas,
+        'distmean': None if distmean is None else float(distmean),
+        'diststd': None if diststd is None else float(diststd)
+    }
+
+
+@app.task(shared=False)
+@memoize()
+def credible_contours(filecontents, contours=(50, 90)):
+    """Trace the boundaries of the credible regions of a sky map.
+
+    Parameters
+    ----------
+    filecontents : bytes
+        The contents of the FITS file.
+    contours : tuple
+        Credible levels in percent.
+
+    Returns
+    -------
+    dict
+        A dictionary of the boundaries of the smallest regions that contain
+        each credible level, as lists of polylines of (RA, Dec) points in
+        degrees, traced at a resolution of HEALPix order
+        :obj:`CONTOUR_ORDER`.
+
+    """
+    skymap = read_sky_map(BytesFile(filecontents), moc=True)
+    levels, _, _ = _credible_levels(skymap)
+    ipix = np.arange(hp.nside2npix(2**CONTOUR_ORDER))
+    paths = postprocess.contour(
+        levels[_moc_index(skymap['UNIQ'], CONTOUR_ORDER, ipix)], contours,
+        nest=True, degrees=True, simplify=True)
+    return {
+        contour: [np.asarray(path).tolist() for path in contour_path]
+        for contour, contour_path in zip(contours, paths)}
+
+
+@functools.lru_cache(maxsize=None)
+def _allsky_axes():
+    """Create the axes that are reused as a template for all-sky plots.
+
+    The figure is not managed by :mod:`matplotlib.pyplot`, so it is not
+    affected by the backend or by :func:`closing_figures`.
+    """
+    fig = Figure(figsize=(8, 6))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(projection='astro hours mollweide')
+    ax.grid()
+    return ax
+
+
+@celeryd_init.connect
+def _preload_plotting(options, **kwargs):
+    """Celery :doc:`signal handler <celery:userguide/signals>` to warm up
+    Matplotlib in workers that consume the ``plot`` queue.
+
+    This runs in the parent process before the pool processes are forked, so
+    the loaded fonts, style sheets, projections, and figure templates are
+    shared by all of the pool processes.
+    """
+    queues = options.get('queues') or ()
+    if isinstance(queues, str):
+        queues = queues.split(',')
+    if 'plot' not in queues:
+        return
     plt.switch_backend('agg')
+    for style in ['seaborn-notebook', 'seaborn-white']:
+        with plt.style.context(style), closing_figures():
+            fig, ax = plt.subplots()
+            ax.barh(['foo'], [1.0])
+            fig.canvas.draw()
+    _allsky_axes().figure.canvas.draw()
 
-    with NamedTemporaryFile(mode='rb', suffix='.png') as pngfile, \
-            NamedTemporaryFile(content=filecontents) as fitsfile, \
-            handling_system_exit():
-        if ra is not None and dec is not None:
-            ligo_skymap_plot.main([fitsfile.name, '-o', pngfile.name,
-                                   '--annotate', '--radec', str(ra), str(dec)])
-        else:
-            ligo_skymap_plot.main([fitsfile.name, '-o', pngfile.name,
-                                   '--annotate', '--contour', '50', '90'])
-        return pngfile.read()
+
+@app.task(shared=False, queue='plot')
+@memoize()
+def plot_allsky(filecontents, ra=None, dec=None):
+    """Plot a Mollweide projection of a sky map.
+
+    This produces the same plot as the command-line tool
+    :doc:`ligo-skymap-plot <ligo.skymap:tool/ligo_skymap_plot>` with the
+    ``--annotate`` option and either ``--contour 50 90`` or, if `ra` and `dec`
+    are provided, ``--radec``. Rather than reprojecting the sky map for every
+    plot, it looks up the sky map's pixels directly in multi-order form using
+    a projection grid that is cached in each worker process, and it draws
+    onto a figure template that is reused from one call to the next. The
+    annotations are taken from the memoized :meth:`summarize`.
+    """
+    skymap = read_sky_map(BytesFile(filecontents), moc=True)
+    summary = summarize(filecontents)
+    ax = _allsky_axes()
+    with removing_new_artists(ax.figure):
+        return _plot_allsky(ax, skymap, summary, ra, dec)
+
+
+def _plot_allsky(ax, skymap, summary, ra, dec):
+
+    max_order = int(moc.uniq2order(skymap['UNIQ']).max())
+    grid = _projection_grid(ax.header.tostring(), max_order)
+    valid = grid >= 0
+    index = _moc_index(skymap['UNIQ'], max_order, grid[valid])
+
+    def rasterize(values):
+        image = np.full(grid.shape, np.nan)
+        image[valid] = values[index]
+        return np.ma.masked_invalid(image)
+
+    probperdeg2 = skymap['PROBDENSITY'] * np.deg2rad(1)**2
+    ax.imshow(rasterize(probperdeg2), vmin=0, vmax=probperdeg2.max(),
+              cmap='cylon')
+
+    text = []
+    if summary['objid'] is not None:
+        text.append(f'event ID: {summary["objid"]}')
+
+    if ra is not None and dec is not None:
+        ax.plot_coord(SkyCoord(ra, dec, unit='deg'), '*',
+                      markerfacecolor='white', markeredgecolor='black',
+                      markersize=10)
+    else:
+        areas = summary['credible_areas']
+        levels, _, _ = _credible_levels(skymap)
+        cs = ax.contour(rasterize(levels), colors='k', linewidths=0.5,
+                        levels=sorted(areas))
+        ax.clabel(cs, fmt='%g%%', fontsize=6, inline=True)
+        for contour, area in areas.items():
+            text.append(f'{contour:d}% area: {round(area):d} deg²')
+
+    if summary['distmean'] is not None:
+        text.append(f'distance: {summary["distmean"]:.0f} ± '
+                    f'{summary["diststd"]:.0f} Mpc')
+
+    ax.text(1, 1, '\n'.join(text), transform=ax.transAxes, ha='right')
+
+    outfile = io.BytesIO()
+    ax.figure.savefig(outfile, format='png', dpi=300)
+    return outfile.getvalue()
 
 
 @app.task(priority=1, queue='openmp', shared=False)
+@memoize()
 @closing_figures()
 def plot_volume(filecontents):
     """Plot a 3D volume rendering of a sky map using the command-line tool
@@ -142,7 +420,7 @@ def plot_volume(filecontents):
     plt.switch_backend('agg')
 
     with NamedTemporaryFile(mode='rb', suffix='.png') as pngfile, \
-            NamedTemporaryFile(content=filecontents) as fitsfile, \
+            NamedMemoryFile(content=filecontents) as fitsfile, \
             handling_system_exit():
         ligo_skymap_plot_volume.main([fitsfile.name, '-o',
                                       pngfile.name, '--annotate'])
@@ -150,12 +428,14 @@ def plot_volume(filecontents):
 
 
 @app.task(shared=False)
+@memoize(key=lambda filecontents, filename: (
+    filecontents, os.path.splitext(filename)[1]))
 def flatten(filecontents, filename):
     """Convert a HEALPix FITS file from multi-resolution UNIQ indexing to the
     more common IMPLICIT indexing using the command-line tool
     :doc:`ligo-skymap-flatten <ligo.skymap:tool/ligo_skymap_flatten>`.
     """
-    with NamedTemporaryFile(content=filecontents) as infile, \
+    with NamedMemoryFile(content=filecontents) as infile, \
             tempfile.TemporaryDirectory() as tmpdir, \
             handling_system_exit():
         outfilename = os.path.join(tmpdir, filename)
@@ -262,7 +542,7 @@ def plot_bayes_factor(logb,
     return fig, ax
 
 
-@app.task(shared=False)
+@app.task(shared=False, queue='plot')
 @closing_figures()
 def plot_coherence(filecontents):
     """IGWN alert handler to plot the coherence Bayes factor.
@@ -285,8 +565,7 @@ def plot_coherence(filecontents):
     # Explicitly use a non-interactive Matplotlib backend.
     plt.switch_backend('agg')
 
-    with NamedTemporaryFile(content=filecontents) as fitsfile:
-        header = fits.getheader(fitsfile, 1)
+    header = fits.getheader(BytesFile(filecontents), 1)
     try:
         logb = header['LOGBCI']
     except KeyError:
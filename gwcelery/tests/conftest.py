@@ -6,6 +6,7 @@ import pytest
 from pytest_socket import disable_socket
 
 from .. import app
+from .. import conf
 from .process import starter  # noqa: F401
 
 
@@ -28,6 +29,120 @@ def no_sockets():
     disable_socket()
 
 
+def _to_bytes(value):
+    if isinstance(value, bytes):
+        return value
+    elif isinstance(value, float):
+        value = repr(value)
+    return str(value).encode()
+
+
+class FakeRedis:
+    """Just enough of a Redis client to test tasks that keep state in the
+    result backend.
+
+    Like :class:`redis.Redis`, it stores keys, fields, members, and values as
+    bytes. Expiration times are ignored.
+    """
+
+    def __init__(self):
+        self.data = {}
+
+    def _get(self, key, default):
+        return self.data.setdefault(_to_bytes(key), default)
+
+    def get(self, key):
+        return self.data.get(_to_bytes(key))
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and _to_bytes(key) in self.data:
+            return None
+        self.data[_to_bytes(key)] = _to_bytes(value)
+        return True
+
+    def exists(self, *keys):
+        return sum(_to_bytes(key) in self.data for key in keys)
+
+    def delete(self, *keys):
+        return sum(self.data.pop(_to_bytes(key), None) is not None
+                   for key in keys)
+
+    def hset(self, key, field, value):
+        self._get(key, {})[_to_bytes(field)] = _to_bytes(value)
+
+    def hsetnx(self, key, field, value):
+        items = self._get(key, {})
+        if _to_bytes(field) in items:
+            return 0
+        items[_to_bytes(field)] = _to_bytes(value)
+        return 1
+
+    def hget(self, key, field):
+        return self._get(key, {}).get(_to_bytes(field))
+
+    def hgetall(self, key):
+        return dict(self._get(key, {}))
+
+    def hmget(self, key, fields):
+        return [self.hget(key, field) for field in fields]
+
+    def hdel(self, key, *fields):
+        items = self._get(key, {})
+        return sum(items.pop(_to_bytes(field), None) is not None
+                   for field in fields)
+
+    def transaction(self, func, *watches):
+        # Nothing else can change the data while func runs.
+        func(self)
+
+    def multi(self):
+        pass
+
+    def zadd(self, key, mapping):
+        self._get(key, {}).update(
+            (_to_bytes(member), float(score))
+            for member, score in mapping.items())
+
+    def _zsorted(self, key):
+        items = self._get(key, {})
+        return sorted(items, key=lambda member: (items[member], member))
+
+    def zrange(self, key, start, end):
+        members = self._zsorted(key)
+        return members[start:len(members) if end == -1 else end + 1]
+
+    def zrangebyscore(self, key, min, max):
+        items = self._get(key, {})
+        return [member for member in self._zsorted(key)
+                if float(min) <= items[member] <= float(max)]
+
+    def zrem(self, key, *members):
+        items = self._get(key, {})
+        return sum(items.pop(_to_bytes(member), None) is not None
+                   for member in members)
+
+
+@pytest.fixture
+def redis_client(monkeypatch):
+    """Replace the result backend's Redis client with a :class:`FakeRedis`."""
+    client = FakeRedis()
+    monkeypatch.setattr(app.backend, 'client', client)
+    return client
+
+
+@pytest.fixture
+def production_defaults(celery_app, redis_client, monkeypatch):
+    """Restore the production values of the settings that
+    :func:`celery_config` turns off: caching, the event indexes, and batched
+    localization. The state that they keep is stored in a :class:`FakeRedis`.
+    """
+    for key in ['memoize_expires', 'fetch_cache_expires',
+                'raven_index_retention', 'external_trigger_index_retention',
+                'bayestar_batch']:
+        monkeypatch.setitem(app.conf, key, getattr(conf, key))
+    return redis_client
+
+
 #
 # The following methods override `fixtures provided by the Celery pytest plugin
 # <https://docs.celeryproject.org/en/stable/userguide/testing.html#fixtures>`_.
@@ -52,7 +167,12 @@ def celery_config(request):
         voevent_receiver_address='gcn.invalid:8099',
         lvalert_host='lvalert.invalid',
         gracedb_host='gracedb.invalid',
-        expose_to_public=True
+        expose_to_public=True,
+        memoize_expires=0,
+        fetch_cache_expires=0,
+        raven_index_retention=0,
+        external_trigger_index_retention=0,
+        bayestar_batch=False
     )
 
 
@@ -1,6 +1,6 @@
 from importlib import resources
-from unittest.mock import patch
-from xml.sax import SAXParseException
+import pickle
+from unittest.mock import Mock, patch
 
 from astropy import table
 from astropy.io import fits
@@ -9,7 +9,9 @@ import numpy as np
 import pytest
 
 from . import data
-from ..tasks.bayestar import localize
+from .. import util
+from ..tasks import bayestar
+from ..tasks.bayestar import _load_psd, localize
 from ..util.tempfile import NamedTemporaryFile
 
 
@@ -20,7 +22,7 @@ def test_localize_bad_psd():
     psd = b''
 
     # Run function under test
-    with pytest.raises(SAXParseException):
+    with pytest.raises(SyntaxError):
         localize((coinc, psd), 'G211117')
 
 
@@ -51,8 +53,141 @@ def test_localize(coinc_psd):
         assert url == 'https://gracedb.invalid/events/G211117'
 
 
+@patch('ligo.skymap.bayestar.localize', mock_bayestar)
+def test_localize_embedded_psd(coinc_psd):
+    """Test running BAYESTAR with PSDs embedded in coinc.xml"""
+    _load_psd.cache_clear()
+    coinc, psd = coinc_psd
+    with patch('ligo.skymap.io.events.ligolw.open') as mock_open:
+        mock_open.return_value = {1: Mock()}
+        localize((coinc,), 'G211117')
+    (doc,), kwargs = mock_open.call_args
+    assert kwargs['psd_file'] is doc
+    assert _load_psd.cache_info().currsize == 0
+
+
+@patch('ligo.skymap.bayestar.localize', mock_bayestar)
+def test_localize_psd_in_coinc(coinc_psd):
+    """Test running BAYESTAR with PSDs that are read by the fast reader"""
+    coinc, psd = coinc_psd
+    root = util.parse_ligolw(coinc)
+    for elem in list(util.parse_ligolw(psd)):
+        root.append(elem)
+    fitscontent = localize((util.serialize_ligolw(root),), 'G211117')
+    with NamedTemporaryFile(content=fitscontent) as fitsfile:
+        url = fits.getval(fitsfile.name, 'REFERENC', 1)
+        assert url == 'https://gracedb.invalid/events/G211117'
+
+
 @patch('ligo.skymap.bayestar.localize', mock_bayestar)
 def test_localize_all_detectors_disabled(coinc_psd):
     """Test running BAYESTAR on G211117, all detectors disabled"""
     with pytest.raises(Ignore):
         localize(coinc_psd, 'G211117', disabled_detectors=['H1', 'L1', 'V1'])
+
+
+@patch('ligo.skymap.bayestar.localize', mock_bayestar)
+def test_localize_reuses_psd(coinc_psd):
+    """Test that the parsed PSD is reused by repeated localizations"""
+    _load_psd.cache_clear()
+    localize(coinc_psd, 'G211117')
+    localize(coinc_psd, 'G211118')
+    info = _load_psd.cache_info()
+    assert info.misses == 1
+    assert info.hits == 1
+
+
+@patch('ligo.skymap.bayestar.localize', mock_bayestar)
+def test_localize_reuses_embedded_psd(coinc_psd):
+    """Test that PSDs embedded in coinc.xml are reused by repeated
+    localizations"""
+    _load_psd.cache_clear()
+    coinc, psd = coinc_psd
+    root = util.parse_ligolw(coinc)
+    for elem in list(util.parse_ligolw(psd)):
+        root.append(elem)
+    coinc = util.serialize_ligolw(root)
+    localize((coinc,), 'G211117')
+    localize((coinc,), 'G211118')
+    info = _load_psd.cache_info()
+    assert info.misses == 1
+    assert info.hits == 1
+
+
+def test_localize_pending(coinc_psd, monkeypatch, redis_client):
+    """Test that waiting events are localized in order of priority"""
+    callback = Mock()
+    monkeypatch.setattr('gwcelery.tasks.bayestar.signature', callback)
+
+    # Queue events without starting the batch task.
+    with patch.object(bayestar.localize_pending, 'apply_async'):
+        bayestar.localize_batched(coinc_psd, 'G1', priority=1, callback='cb1')
+        bayestar.localize_batched(coinc_psd, 'G2', priority=0, callback='cb2')
+        bayestar.localize_batched(coinc_psd, 'G3', priority=1, callback='cb3')
+
+    with patch('gwcelery.tasks.bayestar.localize.run',
+               side_effect=lambda _, graceid: graceid.encode()) as mock_run:
+        bayestar.localize_pending.delay()
+
+    assert [call.args[1] for call in mock_run.call_args_list] == [
+        'G2', 'G1', 'G3']
+    assert [call.args[0] for call in callback.call_args_list] == [
+        'cb2', 'cb1', 'cb3']
+    assert [call.args[0] for call in
+            callback.return_value.apply_async.call_args_list] == [
+        (b'G2',), (b'G1',), (b'G3',)]
+    assert not redis_client.zrange(bayestar.PENDING_KEY, 0, -1)
+    assert not redis_client.hgetall(bayestar.PAYLOADS_KEY)
+    assert not redis_client.data.keys() - {
+        bayestar.PENDING_KEY.encode(), bayestar.PAYLOADS_KEY.encode()}
+
+
+def test_localize_batched_identical(coinc_psd, redis_client):
+    """Test that identical requests are all kept, and that only their IDs are
+    in the sorted set."""
+    with patch.object(bayestar.localize_pending, 'apply_async'):
+        bayestar.localize_batched(coinc_psd, 'G1', callback='cb1')
+        bayestar.localize_batched(coinc_psd, 'G1', callback='cb1')
+
+    entry_ids = redis_client.zrange(bayestar.PENDING_KEY, 0, -1)
+    assert len(entry_ids) == 2
+    assert all(len(entry_id) == 32 for entry_id in entry_ids)
+    assert sorted(redis_client.hgetall(bayestar.PAYLOADS_KEY)) == sorted(
+        entry_ids)
+
+
+def test_localize_pending_error(coinc_psd, monkeypatch, redis_client):
+    """Test that a failed localization is dropped from the queue and raised,
+    leaving the other waiting events for the next task."""
+    monkeypatch.setattr('gwcelery.tasks.bayestar.signature', Mock())
+    with patch.object(bayestar.localize_pending, 'apply_async'):
+        bayestar.localize_batched(coinc_psd, 'G1', callback='cb1')
+        bayestar.localize_batched(coinc_psd, 'G2', callback='cb2')
+
+    with patch('gwcelery.tasks.bayestar.localize.run',
+               side_effect=RuntimeError), pytest.raises(RuntimeError):
+        bayestar.localize_pending.delay()
+
+    entry_id, = redis_client.zrange(bayestar.PENDING_KEY, 0, -1)
+    assert pickle.loads(
+        redis_client.hget(bayestar.PAYLOADS_KEY, entry_id))[1] == 'G2'
+    assert list(redis_client.hgetall(bayestar.PAYLOADS_KEY)) == [entry_id]
+    assert not redis_client.data.keys() - {
+        bayestar.PENDING_KEY.encode(), bayestar.PAYLOADS_KEY.encode()}
+
+
+def test_localize_pending_claimed(coinc_psd, monkeypatch, redis_client):
+    """Test that events that another task is localizing are skipped."""
+    monkeypatch.setattr('gwcelery.tasks.bayestar.signature', Mock())
+    with patch.object(bayestar.localize_pending, 'apply_async'):
+        bayestar.localize_batched(coinc_psd, 'G1', callback='cb1')
+        bayestar.localize_batched(coinc_psd, 'G2', callback='cb2')
+    entry_id, _ = redis_client.zrange(bayestar.PENDING_KEY, 0, -1)
+    bayestar._claim(redis_client, entry_id, 'other-task')
+
+    with patch('gwcelery.tasks.bayestar.localize.run',
+               return_value=b'') as mock_run:
+        bayestar.localize_pending.delay()
+
+    mock_run.assert_called_once_with(coinc_psd, 'G2')
+    assert redis_client.zrange(bayestar.PENDING_KEY, 0, -1) == [entry_id]
@@ -1,10 +1,10 @@
 from io import BytesIO
 import logging
 from pathlib import Path
-from unittest.mock import call, patch
+from unittest.mock import Mock, call, patch
 
 from astropy.time import Time
-from gwpy.timeseries import Bits
+from gwpy.timeseries import Bits, TimeSeriesDict
 import matplotlib.pyplot as plt
 import numpy as np
 import pytest
@@ -120,6 +120,30 @@ def test_check_idq(llhoft_glob_pass):
         'H1:IDQ-PGLITCH_OVL_32_2048', 0)
 
 
+def test_read_channels(llhoft_glob_pass):
+    """Test that all of the channels are read in one pass."""
+    channels = ['H1:DMT-DQ_VECTOR', 'H1:GDS-CALIB_STATE_VECTOR',
+                'H1:IDQ-PGLITCH_OVL_32_2048']
+    start, end = 1216577976, 1216577980
+    cache = detchar.create_cache('H1', start, end)
+    with patch('gwcelery.tasks.detchar.TimeSeriesDict.read',
+               wraps=TimeSeriesDict.read) as mock_read:
+        data = detchar.read_channels(cache, channels, start, end)
+    mock_read.assert_called_once()
+    assert list(data) == channels
+    assert all(len(value) > 0 for value in data.values())
+
+
+def test_read_channels_missing(llhoft_glob_pass):
+    """Test that a missing channel does not prevent reading the others."""
+    channels = ['H1:DMT-DQ_VECTOR', 'H1:NOT-A_CHANNEL']
+    start, end = 1216577976, 1216577980
+    cache = detchar.create_cache('H1', start, end)
+    data = detchar.read_channels(cache, channels, start, end)
+    assert len(data['H1:DMT-DQ_VECTOR']) > 0
+    assert data['H1:NOT-A_CHANNEL'] is None
+
+
 @patch('time.strftime', return_value='00:00:00 UTC Mon 01 Jan 2000')
 @patch('socket.gethostname', return_value='test_host')
 @patch('getpass.getuser', return_value='test_user')
@@ -167,8 +191,9 @@ def test_check_vector(llhoft_glob_pass):
         'H1:NO_DMT-ETMY_ESD_DAC_OVERFLOW': True}
 
 
-@patch('gwcelery.tasks.detchar.StateVector.read', return_value=np.asarray([]))
-def test_check_vector_fails_on_empty(mock_statevector, llhoft_glob_pass):
+@patch('gwcelery.tasks.detchar.read_channels',
+       return_value={'H1:DMT-DQ_VECTOR': np.asarray([])})
+def test_check_vector_fails_on_empty(mock_read_channels, llhoft_glob_pass):
     channel = 'H1:DMT-DQ_VECTOR'
     start, end = 1216577976, 1216577980
     cache = detchar.create_cache('H1', start, end)
@@ -182,6 +207,28 @@ def test_check_vector_fails_on_empty(mock_statevector, llhoft_glob_pass):
         'H1:NO_DMT-ETMY_ESD_DAC_OVERFLOW': None}
 
 
+@pytest.mark.parametrize('logic_type,data,expected', [
+    ['all', [0b110, 0b111], [True, True]],
+    ['all', [0b110, 0b011], [True, False]],
+    ['any', [0b110, 0b011], [True, True]],
+    ['any', [0b001, 0b001], [False, False]],
+    ['all', [6.0, 2.0], [True, False]]])
+def test_evaluate_vector(logic_type, data, expected):
+    bits = app.conf['detchar_bit_definitions']['dmt_dq_vector_bits']['bits']
+    gwpy_bits = Bits(channel='DMT-DQ_VECTOR', bits=bits)
+    result = dict(zip(['H1:NO_OMC_DCPD_ADC_OVERFLOW',
+                       'H1:NO_DMT-ETMY_ESD_DAC_OVERFLOW'], expected))
+    for bits in [bits, gwpy_bits]:
+        assert detchar.evaluate_vector(
+            np.asarray(data), 'H1:DMT-DQ_VECTOR', bits, logic_type) == result
+
+
+def test_evaluate_vector_invalid_logic_type():
+    with pytest.raises(ValueError):
+        detchar.evaluate_vector(np.asarray([0]), 'H1:DMT-DQ_VECTOR', {},
+                                logic_type='xor')
+
+
 def test_check_vectors_skips_mdc(caplog):
     """Test that detchar checks are skipped for MDC events."""
     caplog.set_level(logging.INFO)
@@ -245,6 +292,35 @@ def test_check_vectors(mock_create_label, mock_remove_label, mock_upload,
         any_order=True)
 
 
+@patch('gwcelery.tasks.detchar.dqr_json', return_value='dqrjson')
+@patch('gwcelery.tasks.gracedb.upload.run')
+@patch('gwcelery.tasks.gracedb.remove_label')
+@patch('gwcelery.tasks.gracedb.create_label')
+def test_check_vectors_batches_labels(mock_create_label, mock_remove_label,
+                                      mock_upload, mock_json, monkeypatch,
+                                      llhoft_glob_pass, ifo_h1, ifo_h1_idq):
+    """Test that a DQV label from iDQ that is superseded by DQOK is never
+    applied, and that labels are removed before any are created."""
+    calls = Mock()
+    calls.attach_mock(mock_create_label, 'create_label')
+    calls.attach_mock(mock_remove_label, 'remove_label')
+    monkeypatch.setitem(app.conf, 'idq_pglitch_thresh', 0.0)
+    monkeypatch.setitem(app.conf, 'idq_veto', {'oLIB': True})
+    event = {'search': 'AllSky', 'instruments': 'H1', 'pipeline': 'oLIB',
+             'labels': ['DQV', 'INJ', 'EMBRIGHT_READY']}
+    superevent_id = 'S12345a'
+    start, end = 1216577978, 1216577978.1
+    event = detchar.check_vectors(event, superevent_id, start, end)
+    mock_create_label.assert_called_once_with('DQOK', superevent_id)
+    mock_remove_label.assert_has_calls(
+        [call('DQV', superevent_id),
+         call('INJ', superevent_id)],
+        any_order=True)
+    assert mock_remove_label.call_count == 2
+    assert calls.mock_calls[-1] == call.create_label('DQOK', superevent_id)
+    assert event['labels'] == ['EMBRIGHT_READY', 'DQOK']
+
+
 @patch('gwcelery.tasks.detchar.dqr_json', return_value='dqrjson')
 @patch('gwcelery.tasks.gracedb.upload.run')
 @patch('gwcelery.tasks.gracedb.remove_label')
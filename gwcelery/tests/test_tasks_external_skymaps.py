@@ -1,10 +1,21 @@
 from importlib import resources
+import io
+import pickle
 from unittest.mock import patch
 
+from astropy import units as u
+from astropy.coordinates import ICRS, SkyCoord
+from astropy_healpix import HEALPix, pixel_resolution_to_nside
+import gcn
+import healpy as hp
+from ligo.skymap import moc
+from ligo.skymap.io import fits
 import numpy as np
 import pytest
+import requests
 
 from . import data
+from .. import app
 from ..util import read_json
 from .test_tasks_skymaps import toy_fits_filecontents  # noqa: F401
 from .test_tasks_skymaps import toy_3d_fits_filecontents  # noqa: F401
@@ -66,7 +77,7 @@ def mock_get_file_contents(monkeypatch, toy_fits_filecontents):  # noqa: F811
 @patch('gwcelery.tasks.external_skymaps.combine_skymaps.run')
 @patch('gwcelery.tasks.gracedb.download')
 @patch('gwcelery.tasks.external_skymaps.get_skymap_filename',
-       return_value='fermi_skymap.fits.gz,0')
+       return_value='bayestar.multiorder.fits')
 def test_create_combined_skymap(mock_get_skymap_filename,
                                 mock_download,
                                 mock_combine_skymaps, mock_upload,
@@ -75,7 +86,88 @@ def test_create_combined_skymap(mock_get_skymap_filename,
     # Run function under test
     external_skymaps.create_combined_skymap('S12345', 'E12345')
     mock_combine_skymaps.assert_called_once()
-    mock_upload.assert_called()
+    filenames = {call.args[1] for call in mock_upload.call_args_list}
+    assert filenames == {'bayestar-ext.fits', 'bayestar-ext.png'}
+
+
+def test_combine_skymaps():
+    """Test that combining sky maps in the multi-order representation is
+    the same as combining them at a common resolution."""
+    gw_filecontents = resources.read_binary(
+        data, 'MS220722v_bayestar.multiorder.fits')
+    ext_skymap = external_skymaps.create_external_skymap(
+        45.0, 30.0, 5.0, 'Fermi', gcn.NoticeType.FERMI_GBM_GND_POS)
+    ext_filecontents = external_skymaps.write_to_fits(
+        ext_skymap,
+        {'pipeline': 'Fermi',
+         'gpstime': 1342571974.0,
+         'extra_attributes': {'GRB': {'trigger_id': 680000000}},
+         'links': {'self': 'https://gracedb.invalid/api/events/E1'}},
+        gcn.NoticeType.FERMI_GBM_GND_POS, '2022-07-22T00:39:16')
+
+    combined = fits.read_sky_map(io.BytesIO(
+        external_skymaps.combine_skymaps(gw_filecontents, ext_filecontents)),
+        moc=True)
+    gw_skymap = fits.read_sky_map(io.BytesIO(gw_filecontents), moc=True)
+
+    assert np.sum(skymap_prob(combined)) == pytest.approx(1)
+    assert {'DISTMU', 'DISTSIGMA', 'DISTNORM'} <= set(combined.colnames)
+    assert 'distmean' in combined.meta
+    assert combined.meta['instruments'] >= gw_skymap.meta['instruments']
+    # The combined sky map is no finer than the finer of the two.
+    assert np.max(moc.uniq2order(combined['UNIQ'])) == max(
+        np.max(moc.uniq2order(skymap['UNIQ']))
+        for skymap in (gw_skymap, ext_skymap))
+
+    order = np.max(moc.uniq2order(combined['UNIQ']))
+    expected = (moc.rasterize(gw_skymap, order)['PROBDENSITY'] *
+                moc.rasterize(ext_skymap, order)['PROBDENSITY'])
+    result = moc.rasterize(combined, order)['PROBDENSITY']
+    np.testing.assert_allclose(
+        result / result.sum(), expected / expected.sum(), atol=1e-12)
+
+
+def test_combine_skymaps_disjoint():
+    """Test that combining sky maps that do not overlap is an error."""
+    skymap1, skymap2 = (
+        external_skymaps.create_external_skymap(ra, 0, 0, 'Swift')
+        for ra in (0, 180))
+    with pytest.raises(RuntimeError):
+        external_skymaps._combine_moc(skymap1, skymap2)
+
+
+def test_skymap_overlap():
+    """Test the sky map overlap integral against the same integral computed
+    at a common resolution."""
+    gw_filecontents = resources.read_binary(
+        data, 'MS220722v_bayestar.multiorder.fits')
+    gw_skymap = fits.read_sky_map(io.BytesIO(gw_filecontents), moc=True)
+    ra, dec = 98.0, -27.0
+    ext_skymap = external_skymaps.create_external_skymap(
+        ra, dec, 5.0, 'Fermi', gcn.NoticeType.FERMI_GBM_GND_POS)
+    ext_filecontents = external_skymaps.write_to_fits(
+        ext_skymap,
+        {'pipeline': 'Fermi',
+         'gpstime': 1342571974.0,
+         'extra_attributes': {'GRB': {'trigger_id': 680000000}},
+         'links': {'self': 'https://gracedb.invalid/api/events/E1'}},
+        gcn.NoticeType.FERMI_GBM_GND_POS, '2022-07-22T00:39:16')
+
+    order = np.max(moc.uniq2order(gw_skymap['UNIQ']))
+    gw_probdensity = moc.rasterize(gw_skymap, order)['PROBDENSITY']
+    ext_probdensity = moc.rasterize(ext_skymap, order)['PROBDENSITY']
+    expected = (np.sum(gw_probdensity * ext_probdensity) /
+                np.sum(gw_probdensity) / np.sum(ext_probdensity) *
+                len(gw_probdensity))
+    assert external_skymaps.skymap_overlap(
+        gw_filecontents, ext_filecontents) == pytest.approx(expected)
+
+    hpx = HEALPix(nside=2**int(order), order='nested', frame=ICRS())
+    ipix = hpx.lonlat_to_healpix(ra * u.deg, dec * u.deg)
+    expected = (gw_probdensity[ipix] / np.sum(gw_probdensity) *
+                len(gw_probdensity))
+    assert external_skymaps.skymap_overlap(
+        gw_filecontents, ra=ra, dec=dec) == pytest.approx(expected)
 
 
 @patch('gwcelery.tasks.gracedb.get_log', mock_get_log)
@@ -84,6 +176,18 @@ def test_get_skymap_filename():
     external_skymaps.get_skymap_filename('S12345')
 
 
+@patch('gwcelery.tasks.gracedb.get_log', return_value=[
+    {'filename': 'bayestar.multiorder.fits', 'file_version': 1},
+    {'filename': 'bayestar-ext.fits', 'file_version': 0},
+    {'filename': 'bayestar-ext.png', 'file_version': 0}])
+def test_get_skymap_filename_skips_combined(mock_get_log):
+    """Test that the combined sky map is not mistaken for the GW sky map."""
+    assert external_skymaps.get_skymap_filename(
+        'S12345') == 'bayestar.multiorder.fits'
+    assert external_skymaps.get_skymap_filename(
+        'S12345', is_versioned=True) == 'bayestar.multiorder.fits,1'
+
+
 @patch('gwcelery.tasks.gracedb.get_event', mock_get_event)
 @patch('gwcelery.tasks.gracedb.get_superevent',
        return_value={'em_events': ['E12345']})
@@ -99,12 +203,15 @@ def test_external_trigger_heasarc(mock_download):
     assert heasarc_link == true_heasarc_link
 
 
-@patch('urllib.request.urlopen')
-def test_get_external_skymap(mock_urlopen):
-    """Assert that the correct call to astropy.get_file_contents is used"""
-    external_skymaps.get_external_skymap(true_heasarc_link, 'GRB')
+@patch('gwcelery.tasks.external_skymaps.fetch', return_value=b'skymap')
+def test_get_external_skymap(mock_fetch):
+    """Assert that the sky map is fetched from HEASARC and cached under the
+    trigger ID."""
+    assert external_skymaps.get_external_skymap(
+        true_heasarc_link, 'GRB') == b'skymap'
 
-    mock_urlopen.assert_called_once()
+    mock_fetch.assert_called_once_with(true_skymap_link,
+                                       key='fermi-bn170817529', timeout=60)
 
 
 @patch('gwcelery.tasks.gracedb.upload.run')
@@ -139,23 +246,224 @@ def test_get_upload_external_skymap_subgrb(mock_get_external_skymap,
     mock_upload.assert_called()
 
 
-@pytest.mark.parametrize('ra,dec,error,pix',
-                         [[0, 90, 0, 0],
-                          [270, -90, .01, -1]])
-def test_create_swift_skymap(ra, dec, error, pix):
+@patch('gwcelery.tasks.gracedb.create_label.run')
+@patch('gwcelery.tasks.gracedb.upload.run')
+@patch('gwcelery.tasks.skymaps.plot_allsky.run')
+@patch('gwcelery.tasks.external_skymaps.external_trigger_heasarc.run',
+       return_value=true_heasarc_link)
+def test_poll_external_skymaps(mock_external_trigger_heasarc,
+                               mock_plot_allsky, mock_upload,
+                               mock_create_label, redis_client):
+    """Test that sky maps that are not available yet are polled for."""
+    event = {'graceid': 'E12345', 'search': 'GRB'}
+
+    with patch('gwcelery.tasks.external_skymaps.get_external_skymap.run',
+               side_effect=requests.exceptions.HTTPError):
+        external_skymaps.get_upload_external_skymap(event)
+        external_skymaps.poll_external_skymaps()
+    mock_upload.assert_not_called()
+    assert list(redis_client.hgetall(external_skymaps.PENDING_KEY)) == [
+        b'E12345']
+
+    with patch('gwcelery.tasks.external_skymaps.get_external_skymap.run',
+               return_value=b'skymap') as mock_get_external_skymap:
+        external_skymaps.poll_external_skymaps()
+    mock_get_external_skymap.assert_called_once_with(
+        true_heasarc_link, 'GRB', timeout=external_skymaps.FETCH_TIMEOUT)
+    # The HEASARC link is only looked up once.
+    mock_external_trigger_heasarc.assert_called_once()
+    mock_upload.assert_called()
+    mock_create_label.assert_called_once_with('EXT_SKYMAP_READY', 'E12345')
+    assert not redis_client.hgetall(external_skymaps.PENDING_KEY)
+
+
+@patch('gwcelery.tasks.external_skymaps.get_external_skymap.run',
+       side_effect=requests.exceptions.HTTPError)
+def test_poll_external_skymaps_timeout(mock_get_external_skymap,
+                                       monkeypatch, redis_client):
+    """Test that polling for a sky map stops after the timeout."""
+    monkeypatch.setitem(app.conf, 'external_skymap_poll_timeout', -1)
+    event = {'graceid': 'E12345', 'search': 'SubGRB'}
+
+    external_skymaps.get_upload_external_skymap(event, true_skymap_link)
+    assert redis_client.hgetall(external_skymaps.PENDING_KEY)
+    external_skymaps.poll_external_skymaps()
+    assert not redis_client.hgetall(external_skymaps.PENDING_KEY)
+    assert not redis_client.get(external_skymaps.POLL_LOCK_KEY)
+
+
+@patch('gwcelery.tasks.external_skymaps.get_external_skymap.run',
+       side_effect=requests.exceptions.HTTPError)
+def test_get_upload_external_skymap_keeps_deadline(mock_get_external_skymap,
+                                                   monkeypatch, redis_client):
+    """Test that later notices for a pending event do not extend its
+    deadline."""
+    event = {'graceid': 'E12345', 'search': 'SubGRB'}
+    external_skymaps.get_upload_external_skymap(event, true_skymap_link)
+    value = redis_client.hget(external_skymaps.PENDING_KEY, 'E12345')
+
+    monkeypatch.setitem(app.conf, 'external_skymap_poll_timeout', 1e6)
+    external_skymaps.get_upload_external_skymap(event, true_skymap_link)
+    assert redis_client.hget(external_skymaps.PENDING_KEY, 'E12345') == value
+
+
+@patch('gwcelery.tasks.external_skymaps._upload_external_skymap')
+def test_poll_external_skymaps_changed(mock_upload_external_skymap,
+                                       redis_client):
+    """Test that polling does not remove an entry that was rewritten after it
+    was read."""
+    event = {'graceid': 'E12345', 'search': 'SubGRB'}
+    redis_client.hset(external_skymaps.PENDING_KEY, 'E12345', pickle.dumps(
+        (event, true_skymap_link, 0)))
+    new_value = pickle.dumps((event, true_skymap_link, 1))
+
+    def fetch(event, skymap_link):
+        redis_client.hset(external_skymaps.PENDING_KEY, 'E12345', new_value)
+        return skymap_link, b'skymap'
+
+    with patch('gwcelery.tasks.external_skymaps._fetch_external_skymap',
+               side_effect=fetch):
+        external_skymaps.poll_external_skymaps()
+    mock_upload_external_skymap.assert_called_once_with(event, b'skymap')
+    assert redis_client.hget(
+        external_skymaps.PENDING_KEY, 'E12345') == new_value
+
+
+@patch('gwcelery.tasks.external_skymaps.get_external_skymap.run')
+def test_poll_external_skymaps_locked(mock_get_external_skymap,
+                                      redis_client):
+    """Test that polling does nothing while another poll is running."""
+    redis_client.hset(external_skymaps.PENDING_KEY, 'E12345', pickle.dumps(
+        ({'graceid': 'E12345', 'search': 'SubGRB'}, true_skymap_link, 0)))
+    redis_client.set(external_skymaps.POLL_LOCK_KEY, 1)
+    external_skymaps.poll_external_skymaps()
+    mock_get_external_skymap.assert_not_called()
+    assert redis_client.hgetall(external_skymaps.PENDING_KEY)
+
+
+def skymap_prob(skymap):
+    return skymap['PROBDENSITY'] * moc.uniq2pixarea(skymap['UNIQ'])
+
+
+@pytest.mark.parametrize('ra,dec,error',
+                         [[0, 90, 0],
+                          [270, -90, 1e-5]])
+def test_create_swift_skymap(ra, dec, error):
     """Test created single pixel sky maps for Swift localization."""
     skymap = external_skymaps.create_external_skymap(ra, dec, error, 'Swift')
-    assert skymap[pix] == 1
+    prob = skymap_prob(skymap)
+    i = np.argmax(prob)
+    assert prob[i] == pytest.approx(1)
+    order, ipix = map(int, moc.uniq2nest(skymap['UNIQ'][i]))
+    assert order == external_skymaps.MAX_ORDER
+    assert ipix == hp.ang2pix(2 ** order, ra, dec, nest=True, lonlat=True)
+    # Only the neighborhood of the localization is refined.
+    assert len(skymap) < 1000
+
+
+def test_create_swift_gaussian_skymap():
+    """Test created multi-order Gaussian sky maps for Swift localization."""
+    ra, dec, error = 120.0, 45.0, 0.05
+    skymap = external_skymaps.create_external_skymap(ra, dec, error, 'Swift')
+    assert np.sum(skymap_prob(skymap)) == pytest.approx(1)
+
+    # The finest pixels resolve the 1-sigma radius.
+    sigma = error / np.sqrt(-2 * np.log1p(-.9))
+    max_order = int(moc.uniq2order(skymap['UNIQ']).max())
+    assert hp.nside2resol(2 ** max_order, arcmin=True) <= sigma * 60
+
+    # Compare with the Gaussian evaluated on a flat grid.
+    nside = 2 ** max_order
+    ipix = hp.query_disc(nside, hp.ang2vec(ra, dec, lonlat=True),
+                         np.radians(sigma), nest=True)
+    distance = np.arccos(np.clip(
+        hp.ang2vec(ra, dec, lonlat=True) @
+        np.stack(hp.pix2vec(nside, ipix, nest=True)), -1, 1))
+    expected = np.exp(-0.5 * np.square(distance / np.radians(sigma)))
+    expected /= 2 * np.pi * np.radians(sigma) ** 2
+    uniq = moc.nest2uniq(np.int8(max_order), ipix)
+    i = np.searchsorted(skymap['UNIQ'], uniq, sorter=np.argsort(
+        skymap['UNIQ']))
+    result = skymap['PROBDENSITY'][np.argsort(skymap['UNIQ'])[i]]
+    np.testing.assert_allclose(result, expected, rtol=0.02)
+
+    # Far fewer pixels than a flat sky map at the same resolution.
+    assert len(skymap) < hp.nside2npix(nside) / 1000
 
 
 def test_create_fermi_skymap():
     """Test created single pixel sky maps for Swift localization."""
     ra, dec, error = 0, 90, 10
-    assert (np.sum(external_skymaps.create_external_skymap(
-               ra, dec, error, 'Fermi')) ==
+    assert (np.sum(skymap_prob(external_skymaps.create_external_skymap(
+               ra, dec, error, 'Fermi'))) ==
            pytest.approx(1.0, 1.e-9))
 
 
+@pytest.mark.parametrize('notice_type', [111, 112, 115])
+def test_create_fermi_skymap_systematics(notice_type):
+    """Test that the Fermi systematics match smoothing by the core and tail
+    Gaussians separately.
+    """
+    ra, dec, error = 30.0, -20.0, 10.0
+    nside = pixel_resolution_to_nside(error * u.deg, round='up')
+    skymap = external_skymaps._gaussian_skymap(ra, dec, error, nside)
+    expected = sum(
+        weight * hp.sphtfunc.smoothing(skymap, sigma=np.radians(scale))
+        for weight, scale
+        in external_skymaps.FERMI_SYSTEMATICS[notice_type])
+    expected = np.abs(expected) / np.abs(expected).sum()
+    expected = hp.reorder(expected, r2n=True) / hp.nside2pixarea(nside)
+
+    result = external_skymaps.create_external_skymap(
+        ra, dec, error, 'Fermi', notice_type)
+    order, ipix = moc.uniq2nest(result['UNIQ'])
+    np.testing.assert_array_equal(order, hp.nside2order(nside))
+    np.testing.assert_allclose(
+        result['PROBDENSITY'][np.argsort(ipix)], expected,
+        rtol=1e-6, atol=1e-12)
+
+
+def test_create_gaussian_skymap():
+    """Test the Gaussian sky map against separations computed by Astropy."""
+    ra, dec, error, nside = 120.0, 45.0, 5.0, 32
+    hpx = HEALPix(nside, 'ring', frame=ICRS())
+    distance = hpx.healpix_to_skycoord(np.arange(hpx.npix)).separation(
+        SkyCoord(ra * u.deg, dec * u.deg)).deg
+    expected = np.exp(-0.5 * np.square(distance / error))
+    expected /= expected.sum()
+
+    result = external_skymaps._gaussian_skymap(ra, dec, error, nside)
+    np.testing.assert_allclose(result, expected, rtol=1e-9, atol=1e-15)
+    assert external_skymaps._pixel_vectors.cache_info().currsize >= 1
+
+
+def test_create_external_skymap_memoized(monkeypatch, redis_client):
+    """Test that repeated notices with the same quantized position reuse the
+    sky map.
+    """
+    monkeypatch.setitem(app.conf, 'memoize_expires', 7200)
+
+    with patch.object(external_skymaps, '_pixel_vectors',
+                      wraps=external_skymaps._pixel_vectors) as mock_vectors:
+        result1 = external_skymaps.create_external_skymap(
+            10.0, 20.0, 5.0, 'Fermi', 112)
+        result2 = external_skymaps.create_external_skymap(
+            10.00001, 20.0, 5.0, 'Fermi', 112)
+
+    mock_vectors.assert_called_once()
+    np.testing.assert_array_equal(result1['PROBDENSITY'],
+                                  result2['PROBDENSITY'])
+
+
+@pytest.mark.parametrize('nside,memoized', [[64, True], [512, False]])
+def test_gaussian_skymap_memoized_size(nside, memoized, monkeypatch,
+                                       redis_client):
+    """Test that only coarse Gaussian sky maps are memoized."""
+    monkeypatch.setitem(app.conf, 'memoize_expires', 7200)
+    external_skymaps._gaussian_skymap(10.0, 20.0, 5.0, nside)
+    assert bool(redis_client.data) == memoized
+
+
 @patch('gwcelery.tasks.gracedb.upload.run')
 @patch('gwcelery.tasks.skymaps.plot_allsky.run')
 def test_create_upload_swift_skymap(mock_plot_allsky,
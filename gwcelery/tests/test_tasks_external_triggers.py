@@ -8,6 +8,10 @@ from ..tasks import external_triggers
 from ..tasks import detchar
 from ..util import read_json
 
+# Run with the production settings for caching, the event indexes, and
+# batched localization, so that the flows are tested as they are deployed.
+pytestmark = pytest.mark.usefixtures('production_defaults')
+
 
 @pytest.mark.parametrize('pipeline, path',
                          [['Fermi', 'fermi_grb_gcn.xml'],
@@ -80,6 +84,13 @@ def test_handle_create_grb_event(mock_create_event,
                   }
          },
         gcn_type_dict[pipeline], time_dict[pipeline])
+    if pipeline == 'Fermi':
+        mock_get_upload_external_skymap.assert_called_once_with(
+            mock_create_event.return_value,
+            'http://heasarc.gsfc.nasa.gov/FTP/fermi/data/gbm/triggers/2018/'
+            'bn180524416/current/')
+    else:
+        mock_get_upload_external_skymap.assert_not_called()
 
 
 @patch('gwcelery.tasks.gracedb.get_events', return_value=[])
@@ -155,6 +166,56 @@ def test_handle_noise_fermi_event(mock_check_vectors,
     mock_get_upload_external_skymap.assert_called_once()
 
 
+@patch('gwcelery.tasks.external_skymaps.get_upload_external_skymap.run')
+@patch('gwcelery.tasks.gracedb.get_events', return_value=[])
+@patch('gwcelery.tasks.gracedb.create_event.run', return_value={
+    'graceid': 'E1', 'gpstime': 1, 'instruments': '', 'pipeline': 'Fermi',
+    'search': 'GRB',
+    'extra_attributes': {'GRB': {'trigger_duration': 1, 'trigger_id': 123,
+                                 'ra': 0., 'dec': 0., 'error_radius': 10.}},
+    'links': {'self': 'https://gracedb.ligo.org/events/E356793/'}})
+@patch('gwcelery.tasks.detchar.check_vectors.run')
+def test_handle_classified_fermi_grb_event(mock_check_vectors,
+                                           mock_create_event,
+                                           mock_get_events,
+                                           mock_get_upload_external_skymap):
+    """Test that a Fermi notice that classifies the trigger as a GRB with
+    enough confidence is not labeled NOT_GRB."""
+    text = read_binary(data, 'fermi_grb_classified_gcn.xml')
+    external_triggers.handle_grb_gcn(payload=text)
+    mock_create_event.assert_called_once_with(filecontents=text,
+                                              search='GRB',
+                                              pipeline='Fermi',
+                                              group='External',
+                                              labels=None)
+    mock_check_vectors.assert_called_once()
+
+
+@patch('gwcelery.tasks.external_skymaps.get_upload_external_skymap.run')
+@patch('gwcelery.tasks.gracedb.get_events', return_value=[])
+@patch('gwcelery.tasks.gracedb.create_event.run', return_value={
+    'graceid': 'E1', 'gpstime': 1, 'instruments': '', 'pipeline': 'Fermi',
+    'search': 'GRB',
+    'extra_attributes': {'GRB': {'trigger_duration': 1, 'trigger_id': 123,
+                                 'ra': 0., 'dec': 0., 'error_radius': 10.}},
+    'links': {'self': 'https://gracedb.ligo.org/events/E356793/'}})
+@patch('gwcelery.tasks.detchar.check_vectors.run')
+def test_handle_fermi_grb_event_without_prob(mock_check_vectors,
+                                             mock_create_event,
+                                             mock_get_events,
+                                             mock_get_upload_external_skymap):
+    """Test that a Fermi notice that classifies the trigger as a GRB without
+    giving a probability is labeled NOT_GRB."""
+    text = read_binary(data, 'fermi_grb_classified_gcn.xml').replace(
+        b'<Param name="Most_Likely_Prob"      value="90" />', b'')
+    external_triggers.handle_grb_gcn(payload=text)
+    mock_create_event.assert_called_once_with(filecontents=text,
+                                              search='GRB',
+                                              pipeline='Fermi',
+                                              group='External',
+                                              labels=['NOT_GRB'])
+
+
 @patch('gwcelery.tasks.external_skymaps.create_external_skymap')
 @patch('gwcelery.tasks.external_skymaps.get_upload_external_skymap.run')
 @patch('gwcelery.tasks.gracedb.get_events', return_value=[])
@@ -392,8 +453,125 @@ def test_handle_replace_snews_event(mock_get_events, mock_replace_event):
     mock_replace_event.assert_called_once_with('E1', text)
 
 
-@patch('gwcelery.tasks.raven.coincidence_search')
-def test_handle_grb_exttrig_creation(mock_raven_coincidence_search):
+@pytest.fixture
+def trigger_index(production_defaults):
+    return production_defaults
+
+
+@patch('gwcelery.tasks.detchar.check_vectors.run')
+@patch('gwcelery.tasks.gracedb.get_event.run',
+       return_value={'graceid': 'E1'})
+@patch('gwcelery.tasks.gracedb.replace_event.run')
+@patch('gwcelery.tasks.gracedb.get_events', return_value=[])
+@patch('gwcelery.tasks.gracedb.create_event.run', return_value={
+    'graceid': 'E1', 'gpstime': 1, 'pipeline': 'SNEWS',
+    'search': 'Supernova', 'extra_attributes': {'GRB': {'trigger_id': 1}}})
+def test_handle_snews_event_trigger_index(mock_create_event, mock_get_events,
+                                          mock_replace_event, mock_get_event,
+                                          mock_check_vectors, trigger_index):
+    """Test that a second notice for the same trigger is looked up in the
+    index of trigger IDs instead of searching GraceDB."""
+    text = read_binary(data, 'snews_gcn.xml')
+    external_triggers.handle_snews_gcn(payload=text)
+    mock_get_events.assert_called_once()
+    mock_create_event.assert_called_once()
+    assert trigger_index.data == {
+        b'gwcelery-external-trigger-id-SNEWS-1000194': b'E1'}
+
+    external_triggers.handle_snews_gcn(payload=text)
+    mock_get_events.assert_called_once()
+    mock_get_event.assert_not_called()
+    mock_replace_event.assert_called_once_with('E1', text)
+
+
+@patch('gwcelery.tasks.external_triggers._launch_external_detchar.delay')
+@patch('gwcelery.tasks.gracedb.replace_event.run')
+@patch('gwcelery.tasks.gracedb.get_events', return_value=[])
+@patch('gwcelery.tasks.gracedb.create_event.run', return_value={
+    'graceid': 'E1', 'gpstime': 1, 'pipeline': 'SNEWS',
+    'search': 'Supernova'})
+def test_handle_snews_test_event_not_indexed(
+        mock_create_event, mock_get_events, mock_replace_event,
+        mock_launch_external_detchar, trigger_index):
+    """Test that events in the Test group are not indexed, so that the next
+    test notice for the same trigger creates a new event, as it would if
+    GraceDB were searched."""
+    text = read_binary(data, 'snews_gcn.xml').replace(
+        b'role="observation"', b'role="test"')
+    external_triggers.handle_snews_gcn(payload=text)
+    external_triggers.handle_snews_gcn(payload=text)
+    assert mock_create_event.call_count == 2
+    assert mock_create_event.call_args[1]['group'] == 'Test'
+    assert trigger_index.data == {}
+    mock_replace_event.assert_not_called()
+
+
+@patch('gwcelery.tasks.external_skymaps.create_upload_external_skymap.run')
+@patch('gwcelery.tasks.external_skymaps.get_upload_external_skymap.run')
+@patch('gwcelery.tasks.gracedb.remove_label.run')
+@patch('gwcelery.tasks.gracedb.replace_event.run')
+@patch('gwcelery.tasks.gracedb.get_events')
+@patch('gwcelery.tasks.gracedb.get_event.run', return_value={
+    'graceid': 'E1', 'gpstime': 1, 'pipeline': 'Fermi', 'search': 'GRB'})
+def test_handle_replace_grb_event_trigger_index(
+        mock_get_event, mock_get_events, mock_replace_event,
+        mock_remove_label, mock_get_upload_external_skymap,
+        mock_create_upload_external_skymap, trigger_index):
+    """Test that an indexed GRB is fetched from GraceDB by its ID, and that
+    SubGRB notices for it do not fetch it at all."""
+    trigger_index.set('gwcelery-external-trigger-id-Fermi-578679123', 'E1')
+    trigger_index.set('gwcelery-external-trigger-id-Fermi-548848711', 'E1')
+
+    text = read_binary(data, 'fermi_subthresh_grb_gcn.xml')
+    external_triggers.handle_grb_gcn(payload=text)
+    mock_get_event.assert_not_called()
+
+    text = read_binary(data, 'fermi_grb_gcn.xml')
+    external_triggers.handle_grb_gcn(payload=text)
+    mock_get_events.assert_not_called()
+    mock_get_event.assert_called_once_with('E1')
+    mock_replace_event.assert_called_once_with('E1', text)
+    mock_create_upload_external_skymap.assert_called_once()
+    assert mock_create_upload_external_skymap.call_args[0][0] == \
+        mock_get_event.return_value
+
+
+@patch('gwcelery.tasks.external_triggers._launch_external_detchar.delay')
+@patch('gwcelery.tasks.gracedb.get_events', return_value=[])
+@patch('gwcelery.tasks.gracedb.create_event.run', return_value={
+    'graceid': 'E1', 'gpstime': 1, 'pipeline': 'SNEWS',
+    'search': 'Supernova'})
+def test_handle_snews_event_created_synchronously(
+        mock_create_event, mock_get_events, mock_launch_external_detchar,
+        trigger_index):
+    """Test that the event is created and indexed before the handler returns,
+    rather than in a canvas that could run after the next notice for the
+    same trigger."""
+    text = read_binary(data, 'snews_gcn.xml')
+    external_triggers.handle_snews_gcn(payload=text)
+    mock_create_event.assert_called_once()
+    assert trigger_index.data == {
+        b'gwcelery-external-trigger-id-SNEWS-1000194': b'E1'}
+    mock_launch_external_detchar.assert_called_once_with(
+        mock_create_event.return_value)
+
+
+@patch('gwcelery.tasks.gracedb.get_events', return_value=[
+    {'graceid': 'E1', 'pipeline': 'Fermi',
+     'extra_attributes': {'GRB': {'trigger_id': 123}}},
+    {'graceid': 'E2', 'pipeline': 'SNEWS',
+     'extra_attributes': {'GRB': {'trigger_id': 456}}},
+    {'graceid': 'E3', 'pipeline': 'Swift', 'extra_attributes': {}}])
+def test_backfill_trigger_ids(mock_get_events, trigger_index):
+    external_triggers.backfill_trigger_ids()
+    mock_get_events.assert_called_once()
+    assert trigger_index.data == {
+        b'gwcelery-external-trigger-id-Fermi-123': b'E1',
+        b'gwcelery-external-trigger-id-SNEWS-456': b'E2'}
+
+
+@patch('gwcelery.tasks.raven.coincidence_searches')
+def test_handle_grb_exttrig_creation(mock_raven_coincidence_searches):
     """Test dispatch of an IGWN alert message for an exttrig creation."""
     # Test IGWN alert payload.
     alert = read_json(data, 'igwn_alert_exttrig_creation.json')
@@ -402,13 +580,14 @@ def test_handle_grb_exttrig_creation(mock_raven_coincidence_search):
     external_triggers.handle_grb_igwn_alert(alert)
 
     # Check that the correct tasks were dispatched.
-    mock_raven_coincidence_search.assert_has_calls([
-        call('E1234', alert['object'], group='Burst', se_searches=['Allsky']),
-        call('E1234', alert['object'], group='CBC', searches=['GRB'])])
+    mock_raven_coincidence_searches.assert_called_once_with(
+        'E1234', alert['object'], [
+            dict(group='Burst', se_searches=['Allsky']),
+            dict(group='CBC', searches=['GRB'])])
 
 
-@patch('gwcelery.tasks.raven.coincidence_search')
-def test_handle_subgrb_exttrig_creation(mock_raven_coincidence_search):
+@patch('gwcelery.tasks.raven.coincidence_searches')
+def test_handle_subgrb_exttrig_creation(mock_raven_coincidence_searches):
     """Test dispatch of an IGWN alert message for an exttrig creation."""
     # Test IGWN alert payload.
     alert = read_json(data, 'igwn_alert_subgrb_creation.json')
@@ -417,15 +596,16 @@ def test_handle_subgrb_exttrig_creation(mock_raven_coincidence_search):
     external_triggers.handle_grb_igwn_alert(alert)
 
     # Check that the correct tasks were dispatched.
-    mock_raven_coincidence_search.assert_has_calls([
-        call('E1234', alert['object'], group='Burst', se_searches=['Allsky']),
-        call('E1234', alert['object'], group='CBC',
-             searches=['SubGRB', 'SubGRBTargeted'], pipelines=['Fermi'])])
+    mock_raven_coincidence_searches.assert_called_once_with(
+        'E1234', alert['object'], [
+            dict(group='Burst', se_searches=['Allsky']),
+            dict(group='CBC', searches=['SubGRB', 'SubGRBTargeted'],
+                 pipelines=['Fermi'])])
 
 
 @patch('gwcelery.tasks.external_skymaps.create_upload_external_skymap')
-@patch('gwcelery.tasks.raven.coincidence_search')
-def test_handle_subgrb_targeted_creation(mock_raven_coincidence_search,
+@patch('gwcelery.tasks.raven.coincidence_searches')
+def test_handle_subgrb_targeted_creation(mock_raven_coincidence_searches,
                                          mock_create_upload_external_skymap):
     """Test dispatch of an IGWN alert message for an exttrig creation."""
     # Test IGWN alert payload.
@@ -439,11 +619,11 @@ def test_handle_subgrb_targeted_creation(mock_raven_coincidence_search,
         alert['object'], None, alert['object']['created'])
 
     # Check that the correct tasks were dispatched.
-    mock_raven_coincidence_search.assert_has_calls([
-        call('E1234', alert['object'], group='Burst', se_searches=['Allsky']),
-        call('E1234', alert['object'], group='CBC',
-             searches=['SubGRB', 'SubGRBTargeted'],
-             pipelines=['Swift'])])
+    mock_raven_coincidence_searches.assert_called_once_with(
+        'E1234', alert['object'], [
+            dict(group='Burst', se_searches=['Allsky']),
+            dict(group='CBC', searches=['SubGRB', 'SubGRBTargeted'],
+                 pipelines=['Swift'])])
 
 
 @pytest.mark.parametrize('path',
@@ -475,8 +655,8 @@ def test_handle_sntrig_creation(mock_raven_coincidence_search, path):
 @patch('gwcelery.tasks.gracedb.get_superevent',
        return_value={'preferred_event': 'M4634'})
 @patch('gwcelery.tasks.gracedb.get_group', return_value='CBC')
-@patch('gwcelery.tasks.raven.coincidence_search')
-def test_handle_superevent_cbc_creation(mock_raven_coincidence_search,
+@patch('gwcelery.tasks.raven.coincidence_searches')
+def test_handle_superevent_cbc_creation(mock_raven_coincidence_searches,
                                         mock_get_group,
                                         mock_get_superevent):
     """Test dispatch of an IGWN alert message for a CBC superevent creation."""
@@ -487,19 +667,19 @@ def test_handle_superevent_cbc_creation(mock_raven_coincidence_search,
     external_triggers.handle_grb_igwn_alert(alert)
 
     # Check that the correct tasks were dispatched.
-    mock_raven_coincidence_search.assert_has_calls([
-        call('S180616h', alert['object'], group='CBC',
-             pipelines=['Fermi'], searches=['SubGRB', 'SubGRBTargeted']),
-        call('S180616h', alert['object'], group='CBC',
-             pipelines=['Swift'], searches=['SubGRB', 'SubGRBTargeted']),
-        call('S180616h', alert['object'], group='CBC',
-             searches=['GRB'], se_searches=[])])
+    mock_raven_coincidence_searches.assert_called_once_with(
+        'S180616h', alert['object'], [
+            dict(group='CBC', pipelines=['Fermi'],
+                 searches=['SubGRB', 'SubGRBTargeted']),
+            dict(group='CBC', pipelines=['Swift'],
+                 searches=['SubGRB', 'SubGRBTargeted']),
+            dict(group='CBC', searches=['GRB'], se_searches=[])])
 
 
 @patch('gwcelery.tasks.gracedb.get_superevent',
        return_value={'preferred_event': 'M4634'})
-@patch('gwcelery.tasks.raven.coincidence_search')
-def test_handle_superevent_burst_creation(mock_raven_coincidence_search,
+@patch('gwcelery.tasks.raven.coincidence_searches')
+def test_handle_superevent_burst_creation(mock_raven_coincidence_searches,
                                           mock_get_superevent):
     """
     Test dispatch of an IGWN alert message for a burst superevent
@@ -513,16 +693,16 @@ def test_handle_superevent_burst_creation(mock_raven_coincidence_search,
     external_triggers.handle_grb_igwn_alert(alert)
 
     # Check that the correct tasks were dispatched.
-    mock_raven_coincidence_search.assert_has_calls([
-        call('S180616h', alert['object'], group='Burst', searches=['GRB'],
-             se_searches=['Allsky'])])
+    mock_raven_coincidence_searches.assert_called_once_with(
+        'S180616h', alert['object'], [
+            dict(group='Burst', searches=['GRB'], se_searches=['Allsky'])])
 
 
 @pytest.mark.parametrize('path',
                          ['igwn_alert_superevent_creation.json',
                           'igwn_alert_exttrig_creation.json'])
-@patch('gwcelery.tasks.raven.coincidence_search')
-def test_handle_mdc_creation(mock_raven_coincidence_search,
+@patch('gwcelery.tasks.raven.coincidence_searches')
+def test_handle_mdc_creation(mock_raven_coincidence_searches,
                              path):
     """Test dispatch of an IGWN alert message for a CBC superevent creation."""
     # Test IGWN alert payload.
@@ -537,11 +717,11 @@ def test_handle_mdc_creation(mock_raven_coincidence_search,
 
     # Check that the correct tasks were dispatched.
     if 'superevent' in path:
-        calls = [call('S180616h', alert['object'], group='CBC',
-                      searches=['MDC'])]
+        mock_raven_coincidence_searches.assert_called_once_with(
+            'S180616h', alert['object'], [
+                dict(group='CBC', searches=['MDC'])])
     elif 'exttrig' in path:
-        calls = [call('E1234', alert['object'], group='CBC',
-                      se_searches=['MDC']),
-                 call('E1234', alert['object'], group='Burst',
-                      se_searches=['MDC'])]
-    mock_raven_coincidence_search.assert_has_calls(calls, any_order=True)
+        mock_raven_coincidence_searches.assert_called_once_with(
+            'E1234', alert['object'], [
+                dict(group='CBC', se_searches=['MDC']),
+                dict(group='Burst', se_searches=['MDC'])])
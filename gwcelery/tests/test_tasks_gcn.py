@@ -6,6 +6,7 @@ from comet.utility.xml import xml_document
 import lxml.etree
 import pytest
 
+from .. import app
 from ..tasks import gcn
 from . import data
 
@@ -56,3 +57,51 @@ def test_registered_notice_type(reset_handlers):
         mock_run.assert_not_called()
         gcn.handler.dispatch(fake_gcn(gcn.NoticeType.AGILE_POINTDIR))
         mock_run.assert_called_once()
+
+
+def read_notice(filename, trig_id=None):
+    root = lxml.etree.fromstring(resources.read_binary(data, filename))
+    if trig_id is not None:
+        root.find(".//Param[@name='TrigID']").attrib['value'] = trig_id
+    return root
+
+
+@pytest.mark.parametrize('filename,partition', [
+    ['fermi_initial_grb_gcn.xml', 64],
+    ['fermi_grb_gcn.xml', 324],
+    ['swift_grb_gcn.xml', 166],
+    ['snews_gcn.xml', 342]])
+def test_exttrig_partition(filename, partition):
+    """Test that partitions do not depend on the process."""
+    assert gcn.exttrig_partition(read_notice(filename), 1000) == partition
+
+
+def test_exttrig_partition_same_trigger():
+    """Test that notices for the same trigger go to the same partition."""
+    initial = read_notice('fermi_initial_grb_gcn.xml', '548848711')
+    final = read_notice('fermi_grb_gcn.xml')
+    assert (gcn.exttrig_partition(initial, 1000) ==
+            gcn.exttrig_partition(final, 1000))
+
+    # Same trigger ID, but a different observatory
+    snews = read_notice('snews_gcn.xml', '548848711')
+    assert (gcn.exttrig_partition(snews, 1000) !=
+            gcn.exttrig_partition(final, 1000))
+
+
+@pytest.mark.parametrize('partitions,queue', [[0, None], [4, 'exttrig-2']])
+def test_route(monkeypatch, reset_handlers, partitions, queue):
+    @gcn.handler(gcn.NoticeType.SWIFT_BAT_GRB_POS_ACK, queue='exttrig',
+                 shared=False)
+    def exttrig_handler(payload):
+        pass
+
+    @gcn.handler(gcn.NoticeType.SWIFT_BAT_GRB_POS_ACK, shared=False)
+    def other_handler(payload):
+        pass
+
+    monkeypatch.setitem(app.conf, 'exttrig_partitions', partitions)
+    event = xml_document(read_notice('swift_grb_gcn.xml'))
+    expected = {} if queue is None else {'queue': queue}
+    assert gcn.handler.route(exttrig_handler, event) == expected
+    assert gcn.handler.route(other_handler, event) == {}
@@ -5,6 +5,7 @@ from unittest.mock import call, Mock, patch
 import pytest
 
 from .. import app
+from ..tasks import bayestar
 from ..tasks import inference
 from ..tasks import orchestrator
 from ..tasks import superevents
@@ -12,6 +13,10 @@ from ..util import read_json
 from .test_tasks_skymaps import toy_3d_fits_filecontents  # noqa: F401
 from . import data
 
+# Run with the production settings for caching, the event indexes, and
+# batched localization, so that the flows are tested as they are deployed.
+pytestmark = pytest.mark.usefixtures('production_defaults')
+
 
 @pytest.mark.parametrize(  # noqa: F811
     'alert_type,label,group,pipeline,offline,far,instruments',
@@ -404,16 +409,41 @@ def test_handle_posterior_samples(monkeypatch, alert_type, filename):
         flatten.assert_called_once()
 
 
+@pytest.mark.parametrize('bayestar_batch', [True, False])
 @patch('gwcelery.tasks.gracedb.download._orig_run', mock_download)
 @patch('gwcelery.tasks.bayestar.localize.run')
 @patch('gwcelery.tasks.em_bright.classifier_gstlal.run')
-def test_handle_cbc_event_new_event(mock_classifier, mock_localize):
+def test_handle_cbc_event_new_event(mock_classifier, mock_localize,
+                                    bayestar_batch, monkeypatch):
+    monkeypatch.setitem(app.conf, 'bayestar_batch', bayestar_batch)
     alert = read_json(data, 'lvalert_event_creation.json')
     orchestrator.handle_cbc_event(alert)
     mock_classifier.assert_called_once()
     mock_localize.assert_called_once()
 
 
+@patch('gwcelery.tasks.gracedb.create_label._orig_run')
+@patch('gwcelery.tasks.gracedb.upload._orig_run')
+@patch('gwcelery.tasks.gracedb.download._orig_run', mock_download)
+@patch('gwcelery.tasks.bayestar.localize.run', return_value=b'skymap')
+@patch('gwcelery.tasks.em_bright.classifier_gstlal.run')
+def test_handle_cbc_event_batched(mock_classifier, mock_localize,
+                                  mock_upload, mock_create_label,
+                                  redis_client):
+    """Test that BAYESTAR sky maps are uploaded when events are localized in
+    batches."""
+    alert = read_json(data, 'lvalert_event_creation.json')
+    graceid = alert['uid']
+    orchestrator.handle_cbc_event(alert)
+    mock_localize.assert_called_once()
+    assert mock_localize.call_args.args[1] == graceid
+    mock_upload.assert_any_call(
+        b'skymap', 'bayestar.multiorder.fits', graceid,
+        'sky localization complete', ['sky_loc', 'public'])
+    mock_create_label.assert_any_call('SKYMAP_READY', graceid)
+    assert not redis_client.zrange(bayestar.PENDING_KEY, 0, -1)
+
+
 @patch(
     'gwcelery.tasks.gracedb.get_event._orig_run',
     return_value={'graceid': 'T250822', 'group': 'CBC', 'pipeline': 'gstlal',
@@ -1,11 +1,19 @@
-from unittest.mock import call, patch
+from unittest.mock import call, Mock, patch
 
+from astropy.time import Time
+import ligo.raven.search
+import numpy as np
 import pytest
 
 from .test_tasks_skymaps import toy_fits_filecontents  # noqa: F401
+from ..igwn_alert.signals import igwn_alert_heartbeat
 from ..tasks import gracedb
 from ..tasks import raven
 
+# Run with the production settings for caching, the event indexes, and
+# batched localization, so that the flows are tested as they are deployed.
+pytestmark = pytest.mark.usefixtures('production_defaults')
+
 
 @pytest.mark.live_worker
 @pytest.mark.parametrize(
@@ -18,9 +26,9 @@ from ..tasks import raven
      ['CBC', 'E1', ['Fermi'], [], ['GRB'], -5, 1],
      ['CBC', 'M1', ['Fermi'], [], ['MDC'], -5, 1]])
 @patch('gwcelery.tasks.gracedb.create_label')
-@patch('gwcelery.tasks.raven.raven_pipeline.s')
-@patch('gwcelery.tasks.raven.search.si', return_value=[{'superevent_id': 'S5',
-                                                        'graceid': 'E2'}])
+@patch('gwcelery.tasks.raven.raven_pipelines.s')
+@patch('gwcelery.tasks.raven.search_windows.si',
+       return_value=[[{'superevent_id': 'S5', 'graceid': 'E2'}]])
 @patch('gwcelery.tasks.raven.calculate_coincidence_far')
 def test_coincidence_search(mock_calculate_coincidence_far,
                             mock_search, mock_raven_pipeline,
@@ -34,123 +42,350 @@ def test_coincidence_search(mock_calculate_coincidence_far,
     raven.coincidence_search(gracedb_id, alert_object, group,
                              pipelines, ext_search, se_search)
 
-    mock_search.assert_called_once_with(
-        gracedb_id, alert_object, tl, th, group, pipelines,
-        ext_search, se_search)
+    windows = [(tl, th, group, pipelines, ext_search, se_search)]
+    mock_search.assert_called_once_with(gracedb_id, alert_object, windows)
     mock_raven_pipeline.assert_called_once_with(
-        gracedb_id, alert_object, tl, th, group)
+        gracedb_id, alert_object, windows)
 
 
-@pytest.mark.parametrize(
-    'event_type,event_id', [['SE', 'S1234'], ['ExtTrig', 'E1234']])
-@patch('ligo.raven.search.search')
-def test_raven_search(mock_raven_search, event_type, event_id):
+@pytest.fixture
+def gracedb_logs():
+    """Record the messages that ligo-raven logs to GraceDB."""
+    logs = []
+
+    def get_resource(graceid):
+        resource = Mock()
+        resource.logs.create.side_effect = \
+            lambda comment, **kwargs: logs.append((graceid, comment))
+        return resource
+
+    for name in ('events', 'superevents'):
+        getattr(gracedb.client, name).__getitem__.side_effect = get_resource
+    return logs
+
+
+def make_superevent(superevent_id, t_0, group='CBC', search='AllSky',
+                    category='Production'):
+    return {'superevent_id': superevent_id, 't_0': t_0, 'far': 1e-7,
+            'preferred_event': 'G1', 'category': category,
+            'preferred_event_data': {'group': group, 'search': search}}
+
+
+def make_external(graceid, gpstime, pipeline='Fermi', search='GRB'):
+    return {'graceid': graceid, 'gpstime': gpstime, 'group': 'External',
+            'pipeline': pipeline, 'search': search}
+
+
+@pytest.mark.parametrize('event_type', ['SE', 'ExtTrig'])
+def test_raven_search(event_type, gracedb_logs):
     """Test that correct input parameters are used for raven."""
-    alert_object = {}
     if event_type == 'SE':
-        alert_object['superevent_id'] = event_id
+        event_id = 'S1234'
+        alert_object = make_superevent(event_id, 100.0)
+        mock_query = gracedb.client.events.search
+        query = 'External 95.0 .. 105.0'
+    else:
+        event_id = 'E1234'
+        alert_object = make_external(event_id, 100.0)
+        mock_query = gracedb.client.superevents.search
+        query = '95.0 .. 105.0'
+    mock_query.return_value = []
 
     # call raven search
-    raven.search(event_id, alert_object)
-    mock_raven_search.assert_called_once_with(
-        event_id, -5, 5, event_dict=alert_object,
-        gracedb=gracedb.client, group=None, pipelines=[], searches=[],
-        se_searches=[])
+    assert raven.search(event_id, alert_object) == []
+    mock_query.assert_called_once_with(query=query)
+    assert [graceid for graceid, _ in gracedb_logs] == [event_id]
+
+
+@patch('gwcelery.tasks.raven.raven_pipeline')
+def test_coincidence_searches(mock_raven_pipeline, gracedb_logs):
+    """Test that several RAVEN searches are done in a single pass."""
+    superevent = make_superevent('S1', 1000.0)
+    externals = [make_external('E1', 1002.0),
+                 make_external('E2', 1008.0, search='SubGRB'),
+                 make_external('E3', 1015.0, pipeline='Swift',
+                               search='SubGRB')]
+    gracedb.client.events.search.return_value = externals
+
+    raven.coincidence_searches('S1', superevent, [
+        dict(group='CBC', searches=['SubGRB', 'SubGRBTargeted'],
+             pipelines=['Fermi']),
+        dict(group='CBC', searches=['SubGRB', 'SubGRBTargeted'],
+             pipelines=['Swift']),
+        dict(group='CBC', searches=['GRB'])])
+
+    # One query covers the union of the time windows.
+    gracedb.client.events.search.assert_called_once_with(
+        query='External 990.0 .. 1020.0')
+    # Each search logs its results.
+    assert len(gracedb_logs) == 2 + 2 + 2
+    # The raven pipeline is launched for each search that found events.
+    mock_raven_pipeline.assert_has_calls([
+        call([externals[1]], 'S1', superevent, -1, 11, 'CBC'),
+        call([externals[2]], 'S1', superevent, -10, 20, 'CBC'),
+        call([externals[0]], 'S1', superevent, -1, 5, 'CBC')])
+
+
+@patch('gwcelery.tasks.raven.raven_pipeline')
+def test_coincidence_searches_no_results(mock_raven_pipeline, gracedb_logs):
+    """Test that the raven pipeline is not launched if nothing is found."""
+    gracedb.client.superevents.search.return_value = []
+    external = make_external('E1', 1000.0)
+    raven.coincidence_searches('E1', external, [
+        dict(group='Burst', se_searches=['Allsky']),
+        dict(group='CBC', searches=['GRB'])])
+    gracedb.client.superevents.search.assert_called_once()
+    assert len(gracedb_logs) == 2
+    mock_raven_pipeline.assert_not_called()
+
+
+@pytest.fixture
+def raven_index(redis_client):
+    now = float(Time.now().gps)
+    redis_client.set(raven.INDEX_START_KEY, now - 3600)
+    redis_client.set(raven.INDEX_HEARTBEAT_KEY, now)
+    return redis_client
+
+
+def test_raven_search_index(raven_index, gracedb_logs):
+    """Test searching the local index of recent events."""
+    t_0 = Time.now().gps - 100
+    superevent = make_superevent('S1', t_0)
+    externals = {
+        'E1': make_external('E1', t_0 - 2),
+        'E2': make_external('E2', t_0 - 2, search='SubGRB'),
+        'E3': make_external('E3', t_0 + 3),
+        'E4': make_external('E4', t_0 - 100),
+        'E5': make_external('E5', t_0 - 2, search='MDC')}
+    raven.index_event(superevent)
+    for external in externals.values():
+        raven.index_event(external)
+
+    with patch('gwcelery.tasks.gracedb.get_event.run',
+               side_effect=externals.get) as mock_get_event:
+        results = raven.search('S1', superevent, -5, 1, 'CBC', ['Fermi'],
+                               ['GRB'])
+
+    # Only the matching candidate is confirmed with GraceDB.
+    mock_get_event.assert_called_once_with('E1')
+    gracedb.client.events.search.assert_not_called()
+    assert results == [externals['E1']]
+    assert sorted(graceid for graceid, _ in gracedb_logs) == ['E1', 'S1']
+    assert 'about 2.000 second(s) before' in dict(gracedb_logs)['S1']
+
+
+def test_raven_search_index_no_results(raven_index, gracedb_logs):
+    """Test searching the local index of recent events with no results."""
+    gpstime = Time.now().gps - 100
+    external = make_external('E1', gpstime)
+    raven.index_event(external)
+    raven.index_event(make_superevent('S1', gpstime + 10))
+    raven.index_event(make_superevent('S2', gpstime + 1, group='Burst'))
+    raven.index_event(make_superevent('S3', gpstime, category='MDC'))
+
+    assert raven.search('E1', external, -5, 1, 'CBC') == []
+    gracedb.client.superevents.search.assert_not_called()
+    (graceid, message), = gracedb_logs
+    assert graceid == 'E1'
+    assert message.startswith(
+        'RAVEN: No Superevent CBC candidates in window [-5, +1] seconds')
+
+
+def test_raven_search_index_fallback(raven_index, gracedb_logs):
+    """Test that windows that start before the index fall back to
+    GraceDB."""
+    gracedb.client.superevents.search.return_value = []
+    gpstime = Time.now().gps - 3500
+    external = make_external('E1', gpstime)
+    raven.index_event(external)
+
+    raven.search('E1', external, -600, 60, 'Burst')
+    gracedb.client.superevents.search.assert_called_once()
+
+
+def test_raven_search_not_indexed(raven_index, gracedb_logs):
+    """Test that events that are not indexed are searched for in GraceDB."""
+    mock_query = gracedb.client.superevents.search
+    mock_query.return_value = []
+    external = dict(make_external('E1', Time.now().gps - 100), group='Test')
+
+    assert raven.search('E1', external, -5, 1, 'CBC') == []
+    mock_query.assert_called_once()
+
+
+def test_ligo_raven_candidate_client(gracedb_logs):
+    """Test that ligo.raven.search.search only needs the parts of the GraceDB
+    client that the stand-in client for the candidates provides."""
+    superevents = [make_superevent('S1', 102.0),
+                   make_superevent('S2', 101.0, group='Burst')]
+    external = make_external('E1', 100.0)
+    client = raven._CandidateClient(superevents)
+    assert ligo.raven.search.search(
+        'E1', -5, 5, gracedb=client, group='CBC',
+        event_dict=external) == superevents[:1]
+    assert sorted(graceid for graceid, _ in gracedb_logs) == ['E1', 'S1']
+
+
+def test_raven_search_index_gap(raven_index, gracedb_logs):
+    """Test that the index is not trusted for times before a gap in the
+    heartbeat of the IGWN alert listener."""
+    mock_query = gracedb.client.superevents.search
+    mock_query.return_value = []
+    gpstime = Time.now().gps - 100
+    external = make_external('E1', gpstime)
+    # The heartbeat expired because the listener stopped for a while.
+    raven_index.delete(raven.INDEX_HEARTBEAT_KEY)
+
+    raven.search('E1', external, -5, 1, 'CBC')
+    mock_query.assert_called_once()
+
+    # Events do not restart the index...
+    raven.index_event(external)
+    raven.search('E1', external, -5, 1, 'CBC')
+    assert mock_query.call_count == 2
+
+    # ...but the next heartbeat does, so it still does not cover the time
+    # window.
+    igwn_alert_heartbeat.send(None)
+    assert float(raven_index.get(raven.INDEX_START_KEY)) > gpstime
+    raven.search('E1', external, -5, 1, 'CBC')
+    assert mock_query.call_count == 3
+
+
+def test_raven_index_heartbeat(raven_index):
+    """Test that heartbeats keep the index trusted without any events."""
+    index_start = raven_index.get(raven.INDEX_START_KEY)
+    igwn_alert_heartbeat.send(None)
+    assert raven_index.get(raven.INDEX_START_KEY) == index_start
+    assert raven_index.exists(raven.INDEX_HEARTBEAT_KEY)
+
+
+def test_index_event_expires(raven_index):
+    """Test that old events are dropped from the index."""
+    now = Time.now().gps
+    raven.index_event(make_external('E1', now - 2 * 86400))
+    raven.index_event(make_external('E2', now))
+    assert raven_index.zrange(raven.INDEX_KEYS['E'], 0, -1) == [b'E2']
+    assert list(raven_index.hgetall(raven.EVENTS_KEY)) == [b'E2']
+
+
+def mock_raven_coinc_far(se_id, ext_id, tl, th, **kwargs):
+    return {'temporal_coinc_far': 1e-7,
+            'spatiotemporal_coinc_far': None,
+            'skymap_overlap': None,
+            'preferred_event': 'G1',
+            'external_event': ext_id}
+
+
+def make_exttrig(pipeline='Fermi', labels=(), far=None):
+    return {'graceid': 'E4321', 'gpstime': 0.0, 'pipeline': pipeline,
+            'search': 'GRB', 'labels': list(labels), 'far': far,
+            'extra_attributes': {'GRB': {'ra': 120.0, 'dec': -30.0}}}
+
+
+COINC_FAR_LOGS = [
+    ('S1234', "RAVEN: Computed coincident FAR(s) in Hz with external "
+              "trigger <a href='https://gracedb.invalid/events/E4321'>"
+              "E4321</a>"),
+    ('E4321', "RAVEN: Computed coincident FAR(s) in Hz with superevent "
+              "<a href='https://gracedb.invalid/superevents/S1234'>"
+              "S1234</a>")]
 
 
 @pytest.mark.parametrize('group', ['CBC', 'Burst'])
-@patch('ligo.raven.search.calc_signif_gracedb')
-def test_calculate_coincidence_far(
-        mock_calc_signif, group):
-    se = {'superevent_id': 'S1234'}
-    ext = {'graceid': 'E4321',
-           'pipeline': 'Fermi',
-           'search': 'GRB',
-           'labels': [],
-           'far': None}
+@patch('ligo.raven.search.coinc_far', side_effect=mock_raven_coinc_far)
+def test_calculate_coincidence_far(mock_coinc_far, group, gracedb_logs):
+    se = make_superevent('S1234', 0.0)
+    ext = make_exttrig()
     if group == 'CBC':
         tl, th = -5, 1
     else:
         tl, th = -600, 60
-    raven.calculate_coincidence_far(se, ext, tl, th)
-    mock_calc_signif.assert_called_once_with(
+    result = raven.calculate_coincidence_far(se, ext, tl, th)
+    mock_coinc_far.assert_called_once_with(
         'S1234', 'E4321', tl, th,
         se_dict=se, ext_dict=ext,
         incl_sky=False, grb_search='GRB',
         gracedb=gracedb.client, far_grb=None)
+    assert result['spatiotemporal_coinc_far'] is None
+    assert gracedb_logs == COINC_FAR_LOGS
 
 
-@patch('ligo.raven.search.calc_signif_gracedb')
-def test_calculate_coincidence_far_subgrb(mock_calc_signif):
-    se = {'superevent_id': 'S1234'}
-    ext = {'graceid': 'E4321',
-           'pipeline': 'Fermi',
-           'search': 'GRB',
-           'labels': [],
-           'far': 1e5}
+@patch('ligo.raven.search.coinc_far', side_effect=mock_raven_coinc_far)
+def test_calculate_coincidence_far_subgrb(mock_coinc_far, gracedb_logs):
+    se = make_superevent('S1234', 0.0)
+    ext = make_exttrig(far=1e5)
     tl, th = -1, 10
     raven.calculate_coincidence_far(se, ext, tl, th)
-    mock_calc_signif.assert_called_once_with(
+    mock_coinc_far.assert_called_once_with(
         'S1234', 'E4321', tl, th,
         se_dict=se, ext_dict=ext,
         incl_sky=False, grb_search='GRB',
         gracedb=gracedb.client, far_grb=1e5)
 
 
-@pytest.mark.parametrize('group', ['CBC', 'Burst'])  # noqa: F811
-@patch('gwcelery.tasks.external_skymaps.get_skymap_filename',
-       return_value='fermi_skymap.fits.gz')
-@patch('ligo.raven.search.calc_signif_gracedb')
-def test_calculate_spacetime_coincidence_far_fermi(
-        mock_calc_signif, mock_get_skymap_filename, group):
-    se = {'superevent_id': 'S1234'}
-    ext = {'graceid': 'E4321',
-           'pipeline': 'Fermi',
-           'search': 'GRB',
-           'labels': ['EXT_SKYMAP_READY', 'SKYMAP_READY'],
-           'far': None}
-    if group == 'CBC':
-        tl, th = -5, 1
-    else:
-        tl, th = -600, 60
-    raven.calculate_coincidence_far(se, ext, tl, th)
-    mock_calc_signif.assert_called_once_with(
-        'S1234', 'E4321', tl, th,
-        incl_sky=True, grb_search='GRB',
-        se_dict=se, ext_dict=ext,
-        se_fitsfile='fermi_skymap.fits.gz',
-        ext_fitsfile='fermi_skymap.fits.gz',
-        se_moc=True, ext_moc=False,
-        use_radec=False,
-        gracedb=gracedb.client, far_grb=None)
+@patch('ligo.raven.search.coinc_far',
+       return_value='RAVEN: WARNING: Invalid search.')
+def test_calculate_coincidence_far_error(mock_coinc_far, gracedb_logs):
+    with pytest.raises(ZeroDivisionError):
+        raven.calculate_coincidence_far(
+            make_superevent('S1234', 0.0), make_exttrig(), -1, 5)
+    assert gracedb_logs == [('S1234', 'RAVEN: WARNING: Invalid search.'),
+                            ('E4321', 'RAVEN: WARNING: Invalid search.')]
 
 
-@pytest.mark.parametrize('group', ['CBC', 'Burst'])  # noqa: F811
+@pytest.mark.parametrize('pipeline', ['Fermi', 'Swift'])
+@patch('gwcelery.tasks.external_skymaps.skymap_overlap', return_value=4.0)
+@patch('gwcelery.tasks.gracedb.download',
+       side_effect=lambda filename, graceid: graceid.encode())
 @patch('gwcelery.tasks.external_skymaps.get_skymap_filename',
-       return_value='swift_skymap.fits.gz')
-@patch('ligo.raven.search.calc_signif_gracedb')
-def test_calculate_spacetime_coincidence_far_swift(
-        mock_calc_signif, mock_get_skymap_filename, group):
-    se = {'superevent_id': 'S1234'}
-    ext = {'graceid': 'E4321',
-           'pipeline': 'Swift',
-           'search': 'GRB',
-           'labels': ['EXT_SKYMAP_READY', 'SKYMAP_READY'],
-           'far': None}
-    if group == 'CBC':
-        tl, th = -5, 1
-    else:
-        tl, th = -600, 60
-    raven.calculate_coincidence_far(se, ext, tl, th)
-    mock_calc_signif.assert_called_once_with(
-        'S1234', 'E4321', tl, th,
-        incl_sky=True, grb_search='GRB',
+       side_effect=lambda graceid, is_versioned: graceid + '.fits,0')
+@patch('ligo.raven.search.coinc_far', side_effect=mock_raven_coinc_far)
+def test_calculate_spacetime_coincidence_far(
+        mock_coinc_far, mock_get_skymap_filename, mock_download,
+        mock_skymap_overlap, pipeline, gracedb_logs):
+    se = make_superevent('S1234', 0.0)
+    ext = make_exttrig(pipeline, ['EXT_SKYMAP_READY', 'SKYMAP_READY'])
+    result = raven.calculate_coincidence_far(se, ext, -1, 5)
+    mock_coinc_far.assert_called_once_with(
+        'S1234', 'E4321', -1, 5,
         se_dict=se, ext_dict=ext,
-        se_fitsfile='swift_skymap.fits.gz',
-        ext_fitsfile='swift_skymap.fits.gz',
-        se_moc=True, ext_moc=False,
-        use_radec=True,
+        incl_sky=False, grb_search='GRB',
         gracedb=gracedb.client, far_grb=None)
+    if pipeline == 'Swift':
+        mock_skymap_overlap.assert_called_once_with(
+            b'S1234', ra=120.0, dec=-30.0)
+    else:
+        mock_skymap_overlap.assert_called_once_with(b'S1234', b'E4321')
+    assert result['skymap_overlap'] == 4.0
+    assert result['spatiotemporal_coinc_far'] == pytest.approx(2.5e-8)
+    assert gracedb_logs == COINC_FAR_LOGS
+
+    # Running again for the same versions of the sky maps neither downloads
+    # them nor computes the overlap integral again.
+    mock_download.reset_mock()
+    mock_skymap_overlap.reset_mock()
+    result = raven.calculate_coincidence_far(se, ext, -1, 5)
+    assert result['skymap_overlap'] == 4.0
+    mock_download.assert_not_called()
+    mock_skymap_overlap.assert_not_called()
+
+
+@patch('gwcelery.tasks.external_skymaps.skymap_overlap', return_value=0.0)
+@patch('gwcelery.tasks.gracedb.download', return_value=b'')
+@patch('gwcelery.tasks.external_skymaps.get_skymap_filename',
+       return_value='skymap.fits.gz,0')
+@patch('ligo.raven.search.coinc_far', side_effect=mock_raven_coinc_far)
+def test_calculate_spacetime_coincidence_far_no_overlap(
+        mock_coinc_far, mock_get_skymap_filename, mock_download,
+        mock_skymap_overlap, gracedb_logs):
+    with pytest.raises(ZeroDivisionError):
+        raven.calculate_coincidence_far(
+            make_superevent('S1234', 0.0),
+            make_exttrig(labels=['EXT_SKYMAP_READY', 'SKYMAP_READY']),
+            -1, 5)
+    assert [graceid for graceid, _ in gracedb_logs] == ['S1234', 'E4321']
+    assert 'Sky maps minimally overlap' in gracedb_logs[0][1]
 
 
 def mock_get_labels(superevent_id):
@@ -285,7 +520,7 @@ def test_preferred_superevent(raven_search_results, testnum):
                                          'preferred_event': 'G5'}]
 
 
-@pytest.mark.parametrize(
+update_coinc_far_params = pytest.mark.parametrize(
     'new_time_far,new_space_far,old_time_far,old_space_far,pipeline,result',
     [[1e-4, None, None, None, 'Fermi', True],
      [1e-4, 1e-3, None, None, 'Swift', True],
@@ -295,6 +530,9 @@ def test_preferred_superevent(raven_search_results, testnum):
      [1e-8, None, 1e-5, 1e-6, 'Swift', False],
      [1e-4, 1e-8, 1e-4, 1e-6, 'AGILE', True],
      [None, None, None, None, 'SNEWS', True]])
+
+
+@update_coinc_far_params
 @patch('gwcelery.tasks.gracedb.update_superevent')
 def test_update_superevent(mock_update_superevent,
                            new_time_far, new_space_far,
@@ -318,6 +556,75 @@ def test_update_superevent(mock_update_superevent,
         mock_update_superevent.assert_not_called()
 
 
+@update_coinc_far_params
+def test_preferred_coincidences(new_time_far, new_space_far,
+                                old_time_far, old_space_far,
+                                pipeline, result):
+    """Test that the bulk selection agrees with update_coinc_far."""
+    preferred = raven.preferred_coincidences(
+        ['S100', 'S100'], [old_time_far, new_time_far],
+        [old_space_far, new_space_far], [False, pipeline == 'SNEWS'])
+    assert preferred == {'S100': 1 if result else 0}
+
+
+@pytest.mark.parametrize('em_rate', [None, 1e-5])
+@pytest.mark.parametrize('tl,th', [[-1, 5], [-60, 600], [-10, 10]])
+@pytest.mark.parametrize('search,ext_far', [['GRB', None], ['MDC', None],
+                                            ['SubGRB', 1e-4],
+                                            ['SubGRBTargeted', 1e-5],
+                                            ['SubGRBTargeted', 1e-4]])
+@pytest.mark.parametrize('pipeline', ['Fermi', 'Swift'])
+def test_coinc_fars(pipeline, search, ext_far, tl, th, em_rate):
+    """Test that the vectorized coincidence FARs agree with ligo-raven."""
+    gw_far = np.asarray([1e-9, 1e-7, 1e-6])
+    skymap_overlap = np.asarray([5.0, np.nan, 0.0])
+    result = raven.coinc_fars(gw_far, tl, th, search, pipeline, ext_far,
+                              em_rate=em_rate, skymap_overlap=skymap_overlap)
+    for i, far in enumerate(gw_far):
+        expected = ligo.raven.search.coinc_far(
+            'S1', 'E1', tl, th, grb_search=search,
+            se_dict={'far': far, 'preferred_event': 'G1', 't_0': 0},
+            ext_dict={'pipeline': pipeline, 'gpstime': 0},
+            far_grb=ext_far, em_rate=em_rate, gracedb=gracedb.client)
+        assert result['temporal_coinc_far'][i] == pytest.approx(
+            expected['temporal_coinc_far'])
+    np.testing.assert_allclose(
+        result['spatiotemporal_coinc_far'],
+        [result['temporal_coinc_far'][0] / 5.0, np.nan, np.nan])
+
+
+def test_coinc_fars_mixed():
+    """Test pairs with different searches and pipelines at once."""
+    search = ['GRB', 'SubGRB', 'SubGRBTargeted', 'SubGRBTargeted']
+    pipeline = ['Swift', 'Fermi', 'Fermi', 'Swift']
+    result = raven.coinc_fars(1e-7, -1, 5, search, pipeline, 1e-5)
+    for i in range(4):
+        expected = raven.coinc_fars(1e-7, -1, 5, search[i], pipeline[i],
+                                    1e-5)
+        assert result['temporal_coinc_far'][i] == pytest.approx(
+            expected['temporal_coinc_far'])
+
+
+@patch('ligo.raven.search.coinc_far')
+def test_coinc_fars_follow_ligo_raven(mock_coinc_far):
+    """Test that the rates of the searches come from ligo-raven."""
+    mock_coinc_far.side_effect = lambda *args, se_dict, **kwargs: {
+        'temporal_coinc_far': 0.5 * se_dict['far']}
+    raven._raven_unit_coinc_far.cache_clear()
+    try:
+        result = raven.coinc_fars(1e-7, -1, 5)
+    finally:
+        raven._raven_unit_coinc_far.cache_clear()
+    assert result['temporal_coinc_far'] == pytest.approx(6 * 0.5 * 1e-7)
+
+
+def test_coinc_fars_invalid():
+    with pytest.raises(ValueError):
+        raven.coinc_fars(1e-7, -1, 5, 'Supernova')
+    with pytest.raises(ValueError):
+        raven.coinc_fars(1e-7, -1, 5, 'SubGRBTargeted', 'AGILE', 1e-4)
+
+
 def _mock_get_event(graceid):
     if graceid == "S1234":
         return {"superevent_id": "S1234",
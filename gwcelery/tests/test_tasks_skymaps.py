@@ -5,6 +5,7 @@ import io
 import os
 from unittest.mock import patch
 
+from astropy.io import fits
 from astropy.table import Table
 import numpy as np
 import pytest
@@ -77,35 +78,80 @@ def test_fits_header(toy_fits_filecontents):
     assert html == resources.read_text(data, 'fits_header_result.html')
 
 
-@patch('ligo.skymap.tool.ligo_skymap_plot.main')
-def test_plot_allsky(mock_plot):
+def test_fits_header_memoized(celery_app, monkeypatch, toy_fits_filecontents):
+    monkeypatch.setitem(celery_app.conf, 'memoize_expires', 60)
+
+    with patch('astropy.io.fits.open', wraps=fits.open) as mock_open:
+        html1 = skymaps.fits_header(toy_fits_filecontents, 'test.fits')
+        html2 = skymaps.fits_header(toy_fits_filecontents, 'copy.fits')
+
+    mock_open.assert_called_once()
+    assert html1 == resources.read_text(data, 'fits_header_result.html')
+    assert html2 == html1.replace('test.fits', 'copy.fits')
+
+
+def test_plot_allsky(toy_3d_fits_filecontents):
     # Run function under test
-    skymaps.plot_allsky('')
+    pngbytes = skymaps.plot_allsky(toy_3d_fits_filecontents)
 
-    # Check that the script would have been run once
-    # with the correct arguments
-    mock_plot.assert_called_once()
-    cmdline, = mock_plot.call_args[0]
-    assert cmdline[2].endswith('.png')
+    # Check that the result is a PNG file
+    assert pngbytes.startswith(b'\x89PNG')
 
 
-@patch('ligo.skymap.tool.ligo_skymap_plot.main')
-def test_plot_allsky_swift(mock_plot):
+def test_plot_allsky_swift(toy_3d_fits_filecontents):
     # Run function under test
-    skymaps.plot_allsky('', ra=0, dec=0)
+    pngbytes = skymaps.plot_allsky(toy_3d_fits_filecontents, ra=0, dec=0)
 
-    # Check that the script would have been run once
-    # with the correct arguments
-    mock_plot.assert_called_once()
-    cmdline, = mock_plot.call_args[0]
-    assert cmdline[2].endswith('.png')
+    # Check that the result is a PNG file
+    assert pngbytes.startswith(b'\x89PNG')
+
+
+def test_plot_allsky_uses_summary(toy_3d_fits_filecontents):
+    summary = skymaps.summarize(toy_3d_fits_filecontents)
+    with patch('gwcelery.tasks.skymaps.summarize',
+               return_value=summary) as mock_summarize:
+        skymaps.plot_allsky(toy_3d_fits_filecontents)
+    mock_summarize.assert_called_once_with(toy_3d_fits_filecontents)
 
 
-def test_is_3d_fits_file(toy_fits_filecontents, toy_3d_fits_filecontents):
+def test_projection_grid_is_cached(toy_3d_fits_filecontents):
+    skymaps._projection_grid.cache_clear()
+    skymaps.plot_allsky(toy_3d_fits_filecontents)
+    skymaps.plot_allsky(toy_3d_fits_filecontents)
+    info = skymaps._projection_grid.cache_info()
+    assert info.misses == 1
+    assert info.hits == 1
+
+
+def test_is_3d_fits_file(toy_3d_fits_filecontents):
     # This is not a 3D FITS file.
-    assert not skymaps.is_3d_fits_file(toy_fits_filecontents)
+    bytesio = io.BytesIO()
+    table = Table([np.arange(12, dtype=np.float64)], names=['PROB'])
+    table.meta['ORDERING'] = 'NESTED'
+    table.write(bytesio, format='fits')
+    assert not skymaps.is_3d_fits_file(bytesio.getvalue())
     # This is a 3D FITS file.
-    assert skymaps.is_3d_fits_file(toy_3d_fits_filecontents)
+    with patch('gwcelery.tasks.skymaps.read_sky_map') as mock_read_sky_map:
+        assert skymaps.is_3d_fits_file(toy_3d_fits_filecontents)
+    # Only the header is read.
+    mock_read_sky_map.assert_not_called()
+
+
+def test_summarize(toy_3d_fits_filecontents):
+    summary = skymaps.summarize(toy_3d_fits_filecontents)
+    assert summary['objid'] == 'T12345'
+    assert summary['is_3d']
+    # The toy sky map has 12 pixels, and the most probable pixel
+    # contains more than 90% of the (unnormalized) probability.
+    assert summary['credible_areas'] == {
+        50: pytest.approx(4 * 180**2 / np.pi / 12),
+        90: pytest.approx(4 * 180**2 / np.pi / 12)}
+    assert isinstance(summary['distmean'], float)
+
+
+def test_credible_contours(toy_3d_fits_filecontents):
+    contours = skymaps.credible_contours(toy_3d_fits_filecontents)
+    assert set(contours) == {50, 90}
 
 
 @patch('ligo.skymap.tool.ligo_skymap_plot_volume.main')
@@ -120,6 +166,43 @@ def test_plot_volume(mock_plot_volume):
     assert cmdline[-2].endswith('.png')
 
 
+def test_flatten_memoized(celery_app, monkeypatch, toy_3d_fits_filecontents):
+    monkeypatch.setitem(celery_app.conf, 'memoize_expires', 60)
+
+    def mock_flatten(args):
+        infilename, outfilename = args
+        with open(outfilename, 'wb') as f:
+            f.write(b'flattened')
+
+    with patch('ligo.skymap.tool.ligo_skymap_flatten.main',
+               side_effect=mock_flatten) as mock_main:
+        # Flatten the same file twice under different names.
+        result1 = skymaps.flatten(toy_3d_fits_filecontents,
+                                  'subthreshold.bayestar.fits.gz')
+        result2 = skymaps.flatten(toy_3d_fits_filecontents, 'bayestar.fits.gz')
+
+    mock_main.assert_called_once()
+    assert result1 == result2 == b'flattened'
+
+
+def test_flatten_too_large_to_memoize(celery_app, monkeypatch,
+                                      toy_3d_fits_filecontents):
+    monkeypatch.setitem(celery_app.conf, 'memoize_expires', 60)
+    monkeypatch.setitem(celery_app.conf, 'memoize_max_size', 8)
+
+    def mock_flatten(args):
+        infilename, outfilename = args
+        with open(outfilename, 'wb') as f:
+            f.write(b'flattened')
+
+    with patch('ligo.skymap.tool.ligo_skymap_flatten.main',
+               side_effect=mock_flatten) as mock_main:
+        skymaps.flatten(toy_3d_fits_filecontents, 'bayestar.fits')
+        skymaps.flatten(toy_3d_fits_filecontents, 'bayestar.fits')
+
+    assert mock_main.call_count == 2
+
+
 def test_skymap_from_samples(toy_3d_fits_filecontents):
 
     def mock_skymap_from_samples(args):
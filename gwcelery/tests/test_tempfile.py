@@ -2,7 +2,7 @@ import os
 
 import pytest
 
-from ..util import NamedTemporaryFile
+from ..util import NamedMemoryFile, NamedTemporaryFile
 
 
 def test_named_temporary_file(tmpdir):
@@ -20,3 +20,19 @@ def test_named_temporary_file_unknown_type(tmpdir):
     with pytest.raises(TypeError):
         with NamedTemporaryFile(prefix=str(tmpdir), content=content):
             pass
+
+
+def test_named_memory_file():
+    """Test NamedMemoryFile wrapper."""
+    content = b'Hello world'
+    with NamedMemoryFile(content=content) as memfile:
+        assert memfile.read() == content
+        with open(memfile.name, 'rb') as f:
+            assert f.read() == content
+
+
+def test_named_memory_file_unknown_type():
+    """Test NamedMemoryFile wrapper with content of the wrong type."""
+    with pytest.raises(TypeError):
+        with NamedMemoryFile(content=12345):
+            pass
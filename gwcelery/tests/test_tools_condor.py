@@ -37,6 +37,7 @@ def test_condor_submit_not_yet_running(mock_execvp, mock_check_output):
     mock_execvp.assert_called_once_with(
         'condor_submit', ('condor_submit',
                           'accounting_group=ligo.dev.o3.cbc.pe.bayestar',
+                          'exttrig_partitions=4',
                           condor.SUBMIT_FILE))
 
 
@@ -99,4 +100,73 @@ def test_condor_resubmit_succeeds(mock_execvp, mock_check_call, _):
     mock_execvp.assert_called_once_with(
         'condor_submit', ('condor_submit',
                           'accounting_group=ligo.dev.o3.cbc.pe.bayestar',
+                          'exttrig_partitions=4',
                           condor.SUBMIT_FILE))
+
+
+AUTOSCALE_CONF = dict(autoscale_openmp_min_workers=1,
+                      autoscale_openmp_max_workers=4,
+                      autoscale_openmp_latency=10.0,
+                      autoscale_openmp_idle=600.0)
+
+
+@pytest.mark.parametrize('current,depth,backlog,idle,expected', [
+    [1, 0, 0.0, 0.0, 1],      # Nothing to do
+    [1, 2, 5.0, 0.0, 1],      # Tasks have not been waiting long enough
+    [1, 2, 10.0, 0.0, 3],     # One new worker per waiting task
+    [2, 10, 10.0, 0.0, 4],    # ...but no more than the maximum
+    [3, 0, 0.0, 600.0, 2],    # Idle for long enough: stop one worker
+    [1, 0, 0.0, 600.0, 1],    # ...but no fewer than the minimum
+    [0, 0, 0.0, 0.0, 1],      # Start workers up to the minimum
+])
+def test_condor_autoscale_target(current, depth, backlog, idle, expected):
+    assert condor.target_workers(
+        current, depth, backlog, idle, AUTOSCALE_CONF) == expected
+
+
+AUTOSCALE_JOBS = b'''<classads>
+<c><a n="ClusterId"><i>10</i></a><a n="ProcId"><i>0</i></a>
+<a n="JobStatus"><i>2</i></a></c>
+<c><a n="ClusterId"><i>11</i></a><a n="ProcId"><i>0</i></a>
+<a n="JobStatus"><i>2</i></a></c>
+<c><a n="ClusterId"><i>9</i></a><a n="ProcId"><i>0</i></a>
+<a n="JobStatus"><i>1</i></a></c>
+</classads>'''
+
+
+@mock.patch('subprocess.check_output', return_value=AUTOSCALE_JOBS)
+def test_condor_autoscaled_jobs(mock_check_output):
+    """Test that idle and then the newest jobs are listed first."""
+    assert condor.autoscaled_jobs() == ['9.0', '11.0', '10.0']
+    mock_check_output.assert_called_once_with(
+        ('condor_q', '-xml',
+         *condor.get_constraints('GWCeleryAutoscale =?= True')))
+
+
+def test_condor_autoscale_empty_queue(celery_app):
+    """Test measuring the depth of a queue that does not exist yet."""
+    assert condor.queue_depth(celery_app, 'openmp') == 0
+
+
+@pytest.mark.parametrize('depth,expected_call', [
+    [3, ('condor_submit', 'accounting_group=ligo.dev.o3.cbc.pe.bayestar',
+         condor.AUTOSCALE_SUBMIT_FILE, '-queue', '1')],
+    [0, ('condor_rm', '9.0')],
+])
+@mock.patch('subprocess.check_call')
+@mock.patch('subprocess.check_output', return_value=AUTOSCALE_JOBS)
+def test_condor_autoscale(mock_check_output, mock_check_call, monkeypatch,
+                          celery_app, depth, expected_call):
+    """Test one iteration of ``gwcelery condor autoscale``."""
+    for key, value in AUTOSCALE_CONF.items():
+        monkeypatch.setitem(celery_app.conf, key, value)
+    monkeypatch.setitem(celery_app.conf, 'autoscale_openmp_latency', 0.0)
+    monkeypatch.setitem(celery_app.conf, 'autoscale_openmp_idle', 0.0)
+    monkeypatch.setattr(condor, 'queue_depth', lambda *args: depth)
+
+    try:
+        main(['gwcelery', 'condor', 'autoscale', '--once'])
+    except SystemExit as e:
+        assert e.code == 0
+
+    mock_check_call.assert_called_once_with(expected_call)
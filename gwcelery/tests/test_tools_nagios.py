@@ -25,7 +25,8 @@ def test_nagios_unknown_error(monkeypatch, capsys):
 def celery_worker_parameters():
     return dict(
         perform_ping_check=False,
-        queues=['celery', 'exttrig', 'kafka', 'openmp', 'superevent',
+        queues=['celery', 'exttrig', 'exttrig-0', 'exttrig-1', 'exttrig-2',
+                'exttrig-3', 'kafka', 'openmp', 'plot', 'superevent',
                 'voevent']
     )
 
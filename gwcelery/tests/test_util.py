@@ -1,9 +1,15 @@
 import sys
+from unittest.mock import Mock
 
+from matplotlib.figure import Figure
 import pytest
+import requests
 
 from .. import util
 
+# The util package re-exports the fetch function under the module's name.
+fetch_module = sys.modules['gwcelery.util.fetch']
+
 
 def test_handling_exit_0():
     with util.handling_system_exit():
@@ -14,3 +20,47 @@ def test_handling_exit_1():
     with pytest.raises(RuntimeError):
         with util.handling_system_exit():
             sys.exit(1)
+
+
+def test_removing_new_artists():
+    fig = Figure()
+    ax = fig.add_subplot()
+    line, = ax.plot([0, 1], [0, 1])
+    with util.removing_new_artists(fig):
+        ax.plot([1, 0], [0, 1])
+        ax.text(0, 0, 'foo')
+        fig.add_subplot(212)
+    assert fig.axes == [ax]
+    assert list(ax.lines) == [line]
+    assert not ax.texts
+
+
+def test_fetch_cached(celery_app, monkeypatch):
+    """Test that fetched files are cached and revalidated with ETags."""
+    monkeypatch.setitem(celery_app.conf, 'fetch_cache_expires', 60)
+    ok = Mock(status_code=200, content=b'skymap', headers={'ETag': '"1"'})
+    not_modified = Mock(status_code=304, content=b'', headers={})
+    session = Mock()
+    session.return_value.get.side_effect = [ok, not_modified]
+    monkeypatch.setattr(fetch_module, '_session', session)
+
+    assert util.fetch('https://example.org/skymap.fit', key='foo') == \
+        b'skymap'
+    assert util.fetch('https://example.org/skymap.fit', key='foo') == \
+        b'skymap'
+
+    first, second = session.return_value.get.call_args_list
+    assert not first.kwargs['headers']
+    assert second.kwargs['headers'] == {'If-None-Match': '"1"'}
+
+
+def test_fetch_error(monkeypatch):
+    """Test that HTTP errors are raised."""
+    response = Mock(status_code=404)
+    response.raise_for_status.side_effect = requests.exceptions.HTTPError
+    session = Mock()
+    session.return_value.get.return_value = response
+    monkeypatch.setattr(fetch_module, '_session', session)
+
+    with pytest.raises(requests.exceptions.HTTPError):
+        util.fetch('https://example.org/skymap.fit')
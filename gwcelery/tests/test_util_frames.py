@@ -0,0 +1,52 @@
+import os
+
+import pytest
+
+from .. import util
+
+
+@pytest.fixture
+def frame_dir(tmp_path):
+    for start, duration in [(1000, 4), (1004, 4), (1008, 8), (1016, 4)]:
+        (tmp_path / f'H-H1_llhoft-{start}-{duration}.gwf').touch()
+    (tmp_path / 'README').touch()
+    return tmp_path
+
+
+@pytest.mark.parametrize('start,end,expected', [
+    [990, 1000, []],
+    [990, 1001, [1000]],
+    [1003, 1005, [1000, 1004]],
+    [1004, 1008, [1004]],
+    [1010, 1012, [1008]],
+    [1015, 1030, [1008, 1016]],
+    [1020, 1030, []]])
+def test_frame_index_find(frame_dir, start, end, expected):
+    index = util.FrameIndex(str(frame_dir / '*.gwf'))
+    assert index.start == 1000
+    assert index.find(start, end) == [
+        str(frame_dir / f'H-H1_llhoft-{s}-{8 if s == 1008 else 4}.gwf')
+        for s in expected]
+
+
+def test_frame_index_refresh(frame_dir):
+    index = util.FrameIndex(str(frame_dir / '*.gwf'))
+    assert len(index.find(1000, 1020)) == 4
+
+    # Expire the oldest file and add a new one. Set the modification time of
+    # the directory explicitly in case the file system has a coarse clock.
+    (frame_dir / 'H-H1_llhoft-1000-4.gwf').unlink()
+    (frame_dir / 'H-H1_llhoft-1020-4.gwf').touch()
+    os.utime(frame_dir, ns=(0, 0))
+    assert index.start == 1004
+    assert len(index.find(1000, 1030)) == 4
+
+
+def test_frame_index_empty(tmp_path):
+    index = util.FrameIndex(str(tmp_path / 'missing' / '*.gwf'))
+    assert index.start is None
+    assert index.find(1000, 1020) == []
+
+
+def test_frame_index_per_process():
+    assert util.frame_index('foo/*.gwf') is util.frame_index('foo/*.gwf')
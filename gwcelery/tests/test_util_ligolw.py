@@ -0,0 +1,74 @@
+from importlib import resources
+import io
+
+from lal.series import read_psd_xmldoc
+from ligo.lw import ligolw, lsctables
+from ligo.lw.utils import load_fileobj
+from ligo.skymap.io.events.ligolw import ContentHandler
+import numpy as np
+import pytest
+
+from . import data
+from .. import util
+
+
+def load_ligolw(filecontents):
+    return load_fileobj(io.BytesIO(filecontents),
+                        contenthandler=ContentHandler)
+
+
+@pytest.mark.parametrize('use_lxml', [True, False])
+def test_read_ligolw_psds(use_lxml):
+    """Test that PSDs match those read by :mod:`ligo.lw`."""
+    filecontents = resources.read_binary(data, 'psd.xml.gz')
+    expected = read_psd_xmldoc(load_ligolw(filecontents))
+
+    root = util.parse_ligolw(filecontents, use_lxml=use_lxml)
+    psds = util.read_ligolw_psds(root)
+
+    assert psds.keys() == expected.keys()
+    for ifo, psd in psds.items():
+        assert psd.name == expected[ifo].name
+        assert psd.epoch == str(expected[ifo].epoch)
+        assert psd.f0 == expected[ifo].f0
+        assert psd.deltaF == expected[ifo].deltaF
+        np.testing.assert_array_equal(psd.data, expected[ifo].data.data)
+
+
+@pytest.mark.parametrize('use_lxml', [True, False])
+def test_saxify_ligolw(use_lxml):
+    """Test that documents are loaded into :mod:`ligo.lw` unchanged."""
+    filecontents = resources.read_binary(data, 'coinc.xml')
+    expected = io.StringIO()
+    load_ligolw(filecontents).write(expected)
+
+    root = util.parse_ligolw(filecontents, use_lxml=use_lxml)
+    xmldoc = ligolw.Document()
+    util.saxify_ligolw(root, ContentHandler(xmldoc))
+    result = io.StringIO()
+    xmldoc.write(result)
+
+    assert result.getvalue() == expected.getvalue()
+
+
+@pytest.mark.parametrize('use_lxml', [True, False])
+def test_remove_ligolw_psds(use_lxml):
+    """Test moving PSDs out of a document that embeds them."""
+    psd = resources.read_binary(data, 'psd.xml.gz')
+    coinc = resources.read_binary(data, 'coinc.xml')
+
+    # Make a coinc.xml file with embedded PSDs.
+    root = util.parse_ligolw(coinc, use_lxml=use_lxml)
+    for elem in list(util.parse_ligolw(psd, use_lxml=use_lxml)):
+        root.append(elem)
+    psds = util.read_ligolw_psds(root)
+    assert psds.keys() == {'H1', 'L1', 'V1'}
+
+    removed = util.remove_ligolw_psds(root)
+    assert len(removed) == 3
+    assert not util.read_ligolw_psds(root)
+
+    xmldoc = ligolw.Document()
+    util.saxify_ligolw(root, ContentHandler(xmldoc))
+    assert len(lsctables.SnglInspiralTable.get_table(xmldoc)) == 3
+    assert not read_psd_xmldoc(xmldoc, root_name=None)
@@ -0,0 +1,47 @@
+from importlib import resources
+
+import lxml.etree
+import pytest
+
+from . import data
+from .. import util
+
+
+@pytest.mark.parametrize('parsed', [False, True])
+def test_read_gcn_notice(parsed):
+    """Test decoding a Fermi GBM notice."""
+    payload = resources.read_binary(data, 'fermi_noise_gcn_2.xml')
+    if parsed:
+        payload = lxml.etree.fromstring(payload)
+    notice = util.read_gcn_notice(payload)
+    assert notice.ivorn == ('ivo://nasa.gsfc.gcn/Fermi#GBM_Flt_Pos_'
+                            '2019-12-14T16:14:31.55_598032876_45-508')
+    assert notice.role == 'observation'
+    assert notice.notice_date == '2019-12-14T16:14:56'
+    assert notice.notice_type == 111
+    assert notice.trig_id == '598032876'
+    assert notice.reliability is None
+    assert notice.most_likely_index == 4
+    assert notice.most_likely_prob == 49
+    assert not notice.lost_lock
+    assert notice.healpix_url is None
+    assert notice.lightcurve_url == (
+        'http://heasarc.gsfc.nasa.gov/FTP/fermi/data/gbm/triggers/2019/'
+        'bn191214677/quicklook/glg_lc_medres34_bn191214677.gif')
+
+
+@pytest.mark.parametrize('filename,trig_id,reliability,healpix_url', [
+    ['fermi_subthresh_grb_gcn.xml', '578679123', 8,
+     'https://gcn.gsfc.nasa.gov/notices_gbm_sub/'
+     'gbm_subthresh_578679393.215999_healpix.fits'],
+    ['snews_gcn_test.xml', '1000194', None, None],
+    ['swift_grb_gcn.xml', '1123129', None, None]])
+def test_read_gcn_notice_optional_params(filename, trig_id, reliability,
+                                         healpix_url):
+    """Test decoding notices that lack some of the parameters."""
+    notice = util.read_gcn_notice(resources.read_binary(data, filename))
+    assert notice.trig_id == trig_id
+    assert notice.reliability == reliability
+    assert notice.healpix_url == healpix_url
+    assert notice.most_likely_index is None
+    assert notice.lost_lock is False
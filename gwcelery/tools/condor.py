@@ -13,6 +13,7 @@ import sys
 import time
 
 import click
+import kombu.exceptions
 import lxml.etree
 
 from .. import data
@@ -20,6 +21,9 @@ from .. import data
 with resources.path(data, 'gwcelery.sub') as p:
     SUBMIT_FILE = str(p)
 
+with resources.path(data, 'gwcelery-openmp.sub') as p:
+    AUTOSCALE_SUBMIT_FILE = str(p)
+
 
 @click.group(help=__doc__)
 def condor():
@@ -28,11 +32,14 @@ def condor():
     pass
 
 
-def get_constraints():
-    return '-constraint', 'JobBatchName=={} && Iwd=={}'.format(
+def get_constraints(extra=None):
+    constraint = 'JobBatchName=={} && Iwd=={}'.format(
         json.dumps('gwcelery'),  # JSON string literal escape sequences
         json.dumps(os.getcwd())  # are a close match to HTCondor ClassAds.
     )
+    if extra is not None:
+        constraint += ' && ' + extra
+    return '-constraint', constraint
 
 
 def run_exec(*args):
@@ -40,6 +47,13 @@ def run_exec(*args):
     os.execvp(args[0], args)
 
 
+def submit_macros(conf):
+    """Get the macros that configure the submit file from the GWCelery
+    configuration, as arguments for ``condor_submit``."""
+    return ('accounting_group={}'.format(conf['condor_accounting_group']),
+            'exttrig_partitions={}'.format(conf['exttrig_partitions']))
+
+
 def running():
     """Determine if GWCelery is already running under HTCondor."""
     status = subprocess.check_output(('condor_q', '-xml', *get_constraints()))
@@ -58,9 +72,7 @@ def submit(ctx):
               file=sys.stderr)
         sys.exit(1)
     else:
-        accounting_group = ctx.obj.app.conf['condor_accounting_group']
-        run_exec('condor_submit',
-                 'accounting_group={}'.format(accounting_group),
+        run_exec('condor_submit', *submit_macros(ctx.obj.app.conf),
                  SUBMIT_FILE)
 
 
@@ -79,9 +91,7 @@ def resubmit(ctx):
     else:
         print('error: Could not stop all GWCelery jobs', file=sys.stderr)
         sys.exit(1)
-    accounting_group = ctx.obj.app.conf['condor_accounting_group']
-    run_exec('condor_submit', 'accounting_group={}'.format(accounting_group),
-             SUBMIT_FILE)
+    run_exec('condor_submit', *submit_macros(ctx.obj.app.conf), SUBMIT_FILE)
 
 
 @condor.command()
@@ -106,3 +116,113 @@ def release():
 def q():
     """Show status of all GWCelery jobs."""
     run_exec('condor_q', '-nobatch', *get_constraints())
+
+
+def autoscaled_jobs():
+    """Get the job IDs of the running extra OpenMP workers.
+
+    Jobs that are still idle come first, followed by running jobs from newest
+    to oldest, so that the first jobs in the list are the cheapest to remove.
+    """
+    status = subprocess.check_output((
+        'condor_q', '-xml',
+        *get_constraints('GWCeleryAutoscale =?= True')))
+    classads = lxml.etree.fromstring(status)
+    jobs = []
+    for classad in classads.iter('c'):
+        attrs = {a.get('n'): a[0].text for a in classad.iter('a')}
+        jobs.append((int(attrs['JobStatus']) != 1,
+                     -int(attrs['ClusterId']), -int(attrs['ProcId'])))
+    return ['{}.{}'.format(-cluster, -proc)
+            for _, cluster, proc in sorted(jobs)]
+
+
+def queue_depth(app, queue):
+    """Get the number of messages waiting in a queue, at all priorities."""
+    with app.connection_for_read() as conn:
+        try:
+            _, depth, _ = conn.default_channel.queue_declare(
+                queue, passive=True)
+        except kombu.exceptions.ChannelError:
+            # The queue does not exist until the first message is sent.
+            depth = 0
+    return depth
+
+
+def target_workers(current, depth, backlog, idle, conf):
+    """Decide how many extra OpenMP workers should be running.
+
+    Parameters
+    ----------
+    current : int
+        The number of extra workers that are running now.
+    depth : int
+        The number of tasks waiting in the queue.
+    backlog : float
+        How long the queue has been continuously non-empty, in seconds.
+    idle : float
+        How long the queue has been continuously empty, in seconds.
+    conf : dict
+        The application configuration.
+
+    Returns
+    -------
+    int
+        The number of extra workers that should be running.
+
+    """
+    target = current
+    if depth and backlog >= conf['autoscale_openmp_latency']:
+        # Start one worker for each waiting task.
+        target += depth
+    elif not depth and idle >= conf['autoscale_openmp_idle']:
+        target -= 1
+    return max(conf['autoscale_openmp_min_workers'],
+               min(conf['autoscale_openmp_max_workers'], target))
+
+
+@condor.command()
+@click.option('--interval', type=float, default=5.0, show_default=True,
+              help='Seconds between checks of the queue')
+@click.option('--once', is_flag=True,
+              help='Check the queue once and exit, instead of forever')
+@click.pass_context
+def autoscale(ctx, interval, once):
+    """Start or stop extra OpenMP workers to keep up with the openmp queue.
+
+    Extra workers are started when tasks have been waiting in the queue for
+    longer than the configured latency, one per waiting task, and stopped one
+    at a time when the queue has been empty for long enough. The number of
+    extra workers is kept within the configured bounds.
+    """
+    app = ctx.obj.app
+    conf = app.conf
+    accounting_group = conf['condor_accounting_group']
+    now = time.monotonic()
+    busy_since = idle_since = now
+    while True:
+        depth = queue_depth(app, 'openmp')
+        now = time.monotonic()
+        if depth:
+            idle_since = now
+        else:
+            busy_since = now
+
+        jobs = autoscaled_jobs()
+        current = len(jobs)
+        target = target_workers(
+            current, depth, now - busy_since, now - idle_since, conf)
+        if target > current:
+            subprocess.check_call((
+                'condor_submit',
+                'accounting_group={}'.format(accounting_group),
+                AUTOSCALE_SUBMIT_FILE, '-queue', str(target - current)))
+            # Give the new workers time to start before adding more.
+            busy_since = now
+        elif target < current:
+            subprocess.check_call(('condor_rm', *jobs[:current - target]))
+            idle_since = now
+
+        if once:
+            break
+        time.sleep(interval)
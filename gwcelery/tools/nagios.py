@@ -43,6 +43,9 @@ def get_expected_queues(app):
     # We use 'celery' for all tasks that do not explicitly specify a queue.
     result -= {None}
     result |= {'celery'}
+    # GCN notices are routed to the exttrig partitions at dispatch time.
+    result |= {'exttrig-{}'.format(i)
+               for i in range(app.conf['exttrig_partitions'])}
     # Done.
     return result
 
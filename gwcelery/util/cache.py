@@ -0,0 +1,64 @@
+"""Memoization of task results in the Celery result backend."""
+import functools
+import hashlib
+import pickle
+
+from celery import current_app
+
+__all__ = ('memoize',)
+
+
+def memoize(key=None):
+    """Decorator to memoize a function in the Celery result backend.
+
+    Results are stored in the result backend (in production, the same Redis
+    database that serves as the broker) so that they are shared by all
+    workers. Each result is keyed by the function's name and the SHA-256 hash
+    of its pickled arguments, and expires after
+    :obj:`~gwcelery.conf.memoize_expires` seconds. Memoization is disabled if
+    that setting is zero. Results that are larger than
+    :obj:`~gwcelery.conf.memoize_max_size` bytes when pickled are not stored,
+    so that large files do not fill up the Redis database.
+
+    This is intended for functions of the byte contents of files, such as the
+    annotations of sky maps, so that uploading the same file more than once
+    does not repeat the same work.
+
+    Parameters
+    ----------
+    key : callable, optional
+        A function that takes the same arguments as the decorated function and
+        returns a tuple of only those arguments that determine its result.
+        By default, all of the arguments are used.
+
+    """
+    def wrap(func):
+        prefix = f'gwcelery-memoize-{func.__module__}.{func.__qualname__}-'
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            expires = current_app.conf['memoize_expires']
+            if not expires:
+                return func(*args, **kwargs)
+
+            if key is None:
+                key_args = (args, kwargs)
+            else:
+                key_args = key(*args, **kwargs)
+            digest = hashlib.sha256(pickle.dumps(key_args)).hexdigest()
+            cache_key = prefix + digest
+
+            client = current_app.backend.client
+            cached = client.get(cache_key)
+            if cached is not None:
+                return pickle.loads(cached)
+
+            result = func(*args, **kwargs)
+            value = pickle.dumps(result)
+            if len(value) <= current_app.conf['memoize_max_size']:
+                client.set(cache_key, value, ex=int(expires))
+            return result
+
+        return wrapper
+
+    return wrap
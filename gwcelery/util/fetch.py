@@ -0,0 +1,99 @@
+"""Fetching files over HTTP with persistent connections and caching."""
+import functools
+import pickle
+import ssl
+
+from celery import current_app
+import requests
+from requests.adapters import HTTPAdapter
+
+__all__ = ('fetch',)
+
+
+class _NoTLSv13Adapter(HTTPAdapter):
+    """Transport adapter that does not negotiate TLSv1.3.
+
+    FIXME: Under Anaconda on the LIGO Caltech computing cluster, Python (and
+    curl, for that matter) fail to negotiate TLSv1.3 with
+    heasarc.gsfc.nasa.gov.
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        context = ssl.create_default_context()
+        context.options |= ssl.OP_NO_TLSv1_3
+        kwargs['ssl_context'] = context
+        return super().init_poolmanager(*args, **kwargs)
+
+
+@functools.lru_cache(maxsize=None)
+def _session():
+    """Get the HTTP session for this process.
+
+    The session keeps a pool of persistent connections to each host, so that
+    repeated requests to the same server do not each pay for a new TCP
+    connection and TLS handshake.
+    """
+    session = requests.Session()
+    session.mount('https://', _NoTLSv13Adapter())
+    return session
+
+
+def fetch(url, key=None, timeout=60):
+    """Fetch the contents of a URL, with caching.
+
+    Responses are stored in the result backend (in production, Redis) along
+    with their ``ETag`` and ``Last-Modified`` headers, so that they are shared
+    by all workers and expire after :obj:`~gwcelery.conf.fetch_cache_expires`
+    seconds. If a response for the same key is in the cache, then the request
+    is conditional, and the cached contents are returned if the server
+    replies that they have not been modified. Caching is disabled if that
+    setting is zero.
+
+    Parameters
+    ----------
+    url : str
+        The URL to fetch.
+    key : str, optional
+        The key under which to cache the response. By default, the URL.
+    timeout : float, optional
+        Timeout in seconds for connecting to and reading from the server.
+
+    Returns
+    -------
+    bytes
+        The contents of the response.
+
+    Raises
+    ------
+    requests.exceptions.RequestException
+        If the server could not be reached or returned an error.
+
+    """
+    expires = current_app.conf['fetch_cache_expires']
+    if not expires:
+        response = _session().get(url, timeout=timeout)
+        response.raise_for_status()
+        return response.content
+
+    cache_key = 'gwcelery-fetch-' + (key or url)
+    client = current_app.backend.client
+    cached = client.get(cache_key)
+    headers = {}
+    if cached is not None:
+        cached = pickle.loads(cached)
+        if cached['etag'] is not None:
+            headers['If-None-Match'] = cached['etag']
+        if cached['last_modified'] is not None:
+            headers['If-Modified-Since'] = cached['last_modified']
+
+    response = _session().get(url, headers=headers, timeout=timeout)
+    if cached is not None and response.status_code == 304:
+        return cached['content']
+    response.raise_for_status()
+
+    client.set(cache_key, pickle.dumps({
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'content': response.content
+    }), ex=int(expires))
+    return response.content
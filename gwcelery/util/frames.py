@@ -0,0 +1,123 @@
+"""Index of the low-latency frame files in a directory."""
+import functools
+import glob
+import os
+
+import numpy as np
+
+__all__ = ('FrameIndex', 'frame_index')
+
+
+def _parse_frame_filename(path):
+    """Get the GPS start time and duration of a frame file from its name,
+    which must follow the ``OBSERVATORY-TAG-START-DURATION.gwf`` convention of
+    LIGO-T050017."""
+    name, _ = os.path.splitext(os.path.basename(path))
+    *_, start, duration = name.split('-')
+    return float(start), float(duration)
+
+
+class FrameIndex:
+    """Sorted index of the frame files that match a glob pattern.
+
+    The directories that match the pattern are rescanned only when their
+    modification times change, which happens whenever files are added to or
+    removed from them. Otherwise, looking up the files for a time interval is
+    a binary search in the sorted start times.
+
+    Parameters
+    ----------
+    pattern : str
+        The glob pattern, such as ``/dev/shm/kafka/H1/*.gwf``.
+
+    """
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self._mtimes = None
+        self._starts = np.empty(0)
+        self._ends = np.empty(0)
+        self._max_ends = np.empty(0)
+        self._paths = np.empty(0, dtype=object)
+
+    def _directory_mtimes(self):
+        mtimes = {}
+        for dirname in glob.glob(os.path.dirname(self.pattern) or '.'):
+            try:
+                mtimes[dirname] = os.stat(dirname).st_mtime_ns
+            except FileNotFoundError:
+                pass
+        return mtimes
+
+    def refresh(self):
+        """Rescan the directories if any of them have changed."""
+        # Read the modification times before listing the files, so that any
+        # files that are added while we are listing them trigger another scan.
+        mtimes = self._directory_mtimes()
+        if mtimes == self._mtimes:
+            return
+
+        entries = []
+        for path in glob.glob(self.pattern):
+            try:
+                start, duration = _parse_frame_filename(path)
+            except ValueError:
+                continue
+            entries.append((start, start + duration, path))
+        entries.sort()
+
+        if entries:
+            starts, ends, paths = zip(*entries)
+        else:
+            starts = ends = paths = ()
+        self._starts = np.asarray(starts, dtype=float)
+        self._ends = np.asarray(ends, dtype=float)
+        # Running maximum of the end times, which is sorted even if the files
+        # overlap, so that the first relevant file can be found by bisection.
+        self._max_ends = np.maximum.accumulate(self._ends)
+        self._paths = np.asarray(paths, dtype=object)
+        self._mtimes = mtimes
+
+    @property
+    def start(self):
+        """The GPS start time of the earliest frame file, or None if there are
+        no files."""
+        self.refresh()
+        return self._starts[0] if len(self._starts) else None
+
+    def find(self, start, end):
+        """Find the frame files that overlap a time interval.
+
+        Parameters
+        ----------
+        start, end : int or float
+            GPS start and end times of the half-open interval ``[start, end)``.
+
+        Returns
+        -------
+        list
+            Paths of the files, in order of their start times.
+
+        """
+        self.refresh()
+        lo = np.searchsorted(self._max_ends, start, side='right')
+        hi = np.searchsorted(self._starts, end, side='left')
+        keep = self._ends[lo:hi] > start
+        return self._paths[lo:hi][keep].tolist()
+
+
+@functools.lru_cache(maxsize=None)
+def frame_index(pattern):
+    """Get the :class:`FrameIndex` for a glob pattern in this process.
+
+    Parameters
+    ----------
+    pattern : str
+        The glob pattern.
+
+    Returns
+    -------
+    :class:`FrameIndex`
+
+    """
+    return FrameIndex(pattern)
@@ -0,0 +1,214 @@
+"""Fast reading of the parts of LIGO_LW XML documents that BAYESTAR needs.
+
+The SAX-based parser in :mod:`ligo.lw` builds a Python object for every row
+of every table and for every element of every array. For ``coinc.xml`` and
+``psd.xml.gz`` files, most of that time is spent on the PSDs, which are long
+arrays of numbers. The functions in this module instead parse the document in
+one pass with the compiled XML parser from :mod:`lxml` and convert array
+streams straight into :mod:`numpy` arrays.
+
+If :mod:`lxml` is not available, then they fall back to
+:mod:`xml.etree.ElementTree` from the Python standard library.
+"""
+from collections import namedtuple
+import gzip
+import io
+import xml.etree.ElementTree as _pure_etree
+import xml.sax
+
+import numpy as np
+
+try:
+    import lxml.etree as _etree
+    import lxml.sax as _sax
+except ImportError:  # pragma: no cover
+    _etree = _sax = None
+
+__all__ = ('LigoLWFrequencySeries', 'parse_ligolw', 'read_ligolw_psds',
+           'remove_ligolw_psds', 'saxify_ligolw', 'serialize_ligolw')
+
+LigoLWFrequencySeries = namedtuple(
+    'LigoLWFrequencySeries', 'name epoch f0 deltaF sampleUnits data')
+LigoLWFrequencySeries.__doc__ = """A frequency series read from LIGO_LW XML.
+
+The fields have the same names as the attributes of
+:class:`lal.REAL8FrequencySeries`. The ``epoch`` is the GPS time as a decimal
+string, so that it may be passed to :class:`lal.LIGOTimeGPS` without loss of
+precision, and ``data`` is a :class:`numpy.ndarray`.
+"""
+
+_NUMPY_TYPES = {
+    'real_4': np.float32,
+    'real_8': np.float64,
+    'float': np.float32,
+    'double': np.float64,
+    'int_2s': np.int16,
+    'int_4s': np.int32,
+    'int_8s': np.int64,
+    'int_2u': np.uint16,
+    'int_4u': np.uint32,
+    'int_8u': np.uint64
+}
+
+
+def _local_name(name):
+    """Strip the ``table:`` prefix and ``:table`` suffix from a name."""
+    for suffix in (':table', ':array', ':param'):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+            break
+    return name.rpartition(':')[2]
+
+
+def parse_ligolw(filecontents, use_lxml=None):
+    """Parse a LIGO_LW XML document.
+
+    Parameters
+    ----------
+    filecontents : bytes
+        The byte contents of the file, optionally gzip-compressed.
+    use_lxml : bool, optional
+        Whether to use :mod:`lxml`. By default, use it if it is available.
+
+    Returns
+    -------
+    root : Element
+        The root element, as an :mod:`lxml.etree` or
+        :mod:`xml.etree.ElementTree` element.
+
+    Raises
+    ------
+    SyntaxError
+        If the document is not well-formed XML.
+
+    """
+    if filecontents[:2] == b'\x1f\x8b':
+        filecontents = gzip.decompress(filecontents)
+    if use_lxml is None:
+        use_lxml = _etree is not None
+    if use_lxml:
+        # Never fetch the LIGO_LW DTD from the network.
+        parser = _etree.XMLParser(
+            huge_tree=True, no_network=True, resolve_entities=False)
+        return _etree.fromstring(filecontents, parser=parser)
+    else:
+        return _pure_etree.fromstring(filecontents)
+
+
+def serialize_ligolw(root):
+    """Convert a document from :func:`parse_ligolw` back to bytes."""
+    if _etree is not None and isinstance(root, _etree._Element):
+        return _etree.tostring(root)
+    else:
+        return _pure_etree.tostring(root)
+
+
+def saxify_ligolw(root, handler):
+    """Generate SAX events for a document from :func:`parse_ligolw`.
+
+    This loads the document into a :mod:`ligo.lw` document tree, given its
+    SAX content handler, without parsing the XML text again. Elements that
+    were parsed by :mod:`lxml` are walked directly; otherwise, the document is
+    serialized and parsed with :mod:`xml.sax`.
+
+    Parameters
+    ----------
+    root : Element
+        A document from :func:`parse_ligolw`.
+    handler : xml.sax.handler.ContentHandler
+        A namespace-aware content handler, such as
+        :class:`ligo.lw.ligolw.LIGOLWContentHandler`.
+
+    """
+    if _sax is not None and isinstance(root, _etree._Element):
+        _sax.saxify(root, handler)
+    else:
+        parser = xml.sax.make_parser()
+        parser.setFeature(xml.sax.handler.feature_namespaces, True)
+        parser.setContentHandler(handler)
+        parser.parse(io.BytesIO(serialize_ligolw(root)))
+
+
+def _read_stream(elem):
+    stream = elem.find('Stream')
+    if stream is None or not stream.text:
+        return '', ','
+    return stream.text, stream.get('Delimiter', ',')
+
+
+def _read_array(elem):
+    """Read the contents of an ``Array`` element.
+
+    The stream lists the elements with the first ``Dim`` varying slowest, and
+    the resulting array has the ``Dim`` elements in reverse order, matching
+    :class:`ligo.lw.array.Array`.
+    """
+    text, delimiter = _read_stream(elem)
+    dtype = _NUMPY_TYPES[elem.get('Type')]
+    dims = [int(dim.text) for dim in elem.iter('Dim')]
+    if delimiter.strip():
+        text = text.replace(delimiter, ' ')
+    return np.asarray(text.split(), dtype=dtype).reshape(dims).T
+
+
+def _is_psd(elem):
+    return elem.tag == 'LIGO_LW' and elem.get('Name') == 'REAL8FrequencySeries'
+
+
+def _params(elem):
+    return {_local_name(param.get('Name')): param.text
+            for param in elem.findall('Param')}
+
+
+def read_ligolw_psds(root):
+    """Read all PSDs from a document.
+
+    Parameters
+    ----------
+    root : Element
+        A document from :func:`parse_ligolw`.
+
+    Returns
+    -------
+    psds : dict
+        A dictionary of :class:`LigoLWFrequencySeries`, keyed by
+        instrument.
+
+    """
+    psds = {}
+    for elem in root.iter('LIGO_LW'):
+        if not _is_psd(elem):
+            continue
+        params = _params(elem)
+        array = elem.find('Array')
+        dim = array.find('Dim')
+        epoch = elem.find('Time')
+        psds[params['instrument']] = LigoLWFrequencySeries(
+            name=_local_name(array.get('Name')),
+            epoch=epoch.text.strip() if epoch is not None else '0',
+            f0=float(params.get('f0', dim.get('Start', 0))),
+            deltaF=float(dim.get('Scale')),
+            sampleUnits=array.get('Unit', ''),
+            data=_read_array(array)[1])
+    return psds
+
+
+def remove_ligolw_psds(root):
+    """Remove all PSDs from a document.
+
+    This leaves only tables and other small elements, so that the document
+    may be passed to the slower :mod:`ligo.lw` parser cheaply.
+
+    Returns
+    -------
+    list
+        The elements of the PSDs that were removed.
+
+    """
+    removed = []
+    for parent in list(root.iter()):
+        for elem in list(parent):
+            if _is_psd(elem):
+                parent.remove(elem)
+                removed.append(elem)
+    return removed
@@ -2,8 +2,9 @@
 from contextlib import contextmanager
 
 from matplotlib import pyplot as plt
+from matplotlib.text import Text
 
-__all__ = ('closing_figures',)
+__all__ = ('closing_figures', 'removing_new_artists')
 
 
 @contextmanager
@@ -16,3 +17,25 @@ def closing_figures():
         new_fignums = set(plt.get_fignums())
         for fignum in new_fignums - old_fignums:
             plt.close(fignum)
+
+
+@contextmanager
+def removing_new_artists(fig):
+    """Remove artists and axes that are added to a figure in a with:
+    statement, so that the figure can be reused as a template.
+    """
+    old_children = {ax: set(ax.get_children()) for ax in fig.axes}
+    try:
+        yield fig
+    finally:
+        for ax in list(fig.axes):
+            if ax not in old_children:
+                ax.remove()
+                continue
+            # Remove text last, because some artists (such as contour sets)
+            # remove their own labels.
+            new_children = sorted(set(ax.get_children()) - old_children[ax],
+                                  key=lambda artist: isinstance(artist, Text))
+            for artist in new_children:
+                if artist in ax.get_children():
+                    artist.remove()
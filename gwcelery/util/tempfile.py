@@ -1,7 +1,19 @@
 from contextlib import contextmanager
+import gzip
+import io
+import os
 import tempfile
 
-__all__ = ('NamedTemporaryFile',)
+__all__ = ('BytesFile', 'NamedMemoryFile', 'NamedTemporaryFile')
+
+
+def _mode_for_content(content):
+    if isinstance(content, bytes):
+        return 'w+b'
+    elif isinstance(content, str):
+        return 'w+'
+    elif content is not None:
+        raise TypeError('content is of unknown type')
 
 
 @contextmanager
@@ -18,15 +30,73 @@ def NamedTemporaryFile(content=None, **kwargs):  # noqa: N802
         :func:`tempfile.NamedTemporaryFile`.
 
     """
-    if isinstance(content, bytes):
-        kwargs = dict(kwargs, mode='w+b')
-    elif isinstance(content, str):
-        kwargs = dict(kwargs, mode='w+')
-    elif content is not None:
-        raise TypeError('content is of unknown type')
+    mode = _mode_for_content(content)
+    if mode is not None:
+        kwargs = dict(kwargs, mode=mode)
     with tempfile.NamedTemporaryFile(**kwargs) as f:
         if content is not None:
             f.write(content)
             f.flush()
             f.seek(0)
         yield f
+
+
+@contextmanager
+def NamedMemoryFile(content=None):  # noqa: N802
+    """Like :func:`NamedTemporaryFile`, but backed by anonymous memory instead
+    of the file system.
+
+    On Linux, the file is created with :func:`os.memfd_create`, and its
+    ``name`` is a path of the form :file:`/proc/self/fd/{N}` that may be
+    passed to any library or command-line tool main function that runs in the
+    current process and wants a file name. Its contents are never written to
+    disk. On other platforms, this falls back to :func:`NamedTemporaryFile`.
+
+    The name has no file extension, so this is only suitable for files whose
+    format is detected from their contents rather than their name.
+
+    Parameters
+    ----------
+    content : str, bytes, None
+        Initial contents of the file.
+
+    """
+    mode = _mode_for_content(content) or 'w+b'
+    if not hasattr(os, 'memfd_create'):
+        with NamedTemporaryFile(content, mode=mode) as f:
+            yield f
+        return
+
+    fd = os.memfd_create('gwcelery')
+    try:
+        with open(f'/proc/self/fd/{fd}', mode) as f:
+            if content is not None:
+                f.write(content)
+                f.flush()
+                f.seek(0)
+            yield f
+    finally:
+        os.close(fd)
+
+
+def BytesFile(content):  # noqa: N802
+    """Wrap the contents of a file in an in-memory binary file object,
+    decompressing them first if they are gzip-compressed.
+
+    Readers such as :func:`astropy.io.fits.open` only detect compression when
+    they are given a file name or a real file, so gzipped FITS files must be
+    decompressed before they are read from a :class:`io.BytesIO`.
+
+    Parameters
+    ----------
+    content : bytes
+        Contents of the file, optionally gzip-compressed.
+
+    Returns
+    -------
+    :class:`io.BytesIO`
+
+    """
+    if content[:2] == b'\x1f\x8b':
+        content = gzip.decompress(content)
+    return io.BytesIO(content)
@@ -0,0 +1,79 @@
+"""Fast decoding of GCN notices in the VOEvent format.
+
+The handlers for external triggers need about a dozen parameters from each
+notice. Looking each of them up with :meth:`lxml.etree._Element.find`
+compiles and evaluates a new path expression every time. The function in this
+module parses the notice once, collects all of the parameters of its ``What``
+section in one pass with precompiled XPath expressions, and converts the ones
+that are used into a typed record.
+"""
+from collections import namedtuple
+
+import lxml.etree
+
+__all__ = ('GCNNotice', 'read_gcn_notice')
+
+GCNNotice = namedtuple(
+    'GCNNotice',
+    'ivorn role notice_date notice_type trig_id reliability '
+    'most_likely_index most_likely_prob lost_lock healpix_url lightcurve_url')
+GCNNotice.__doc__ = """The parameters of a GCN notice that are used by
+:mod:`gwcelery.tasks.external_triggers`.
+
+Integer and floating point parameters are converted to :class:`int` and
+:class:`float`. Parameters that are not present in the notice are None, except
+for ``lost_lock``, which is False.
+"""
+
+_WHAT_PARAMS = lxml.etree.XPath('./What/Param')
+
+_LOST_LOCK = lxml.etree.XPath(
+    "./What/Group[@name='Solution_Status']"
+    "/Param[@name='StarTrack_Lost_Lock']/@value")
+
+_WHO_DATE = lxml.etree.XPath('./Who/Date/text()')
+
+
+def _optional(func, value):
+    return None if value is None else func(value)
+
+
+def read_gcn_notice(payload):
+    """Decode a GCN notice.
+
+    Parameters
+    ----------
+    payload : bytes, :class:`lxml.etree._Element`
+        The notice, either as the raw VOEvent XML or as its parsed root
+        element.
+
+    Returns
+    -------
+    notice : :class:`GCNNotice`
+        The decoded notice.
+
+    """
+    if isinstance(payload, bytes):
+        root = lxml.etree.fromstring(payload)
+    else:
+        root = payload
+    params = {param.get('name'): param.get('value')
+              for param in _WHAT_PARAMS(root)}
+    notice_date = _WHO_DATE(root)
+    lost_lock = _LOST_LOCK(root)
+    trig_id = params.get('TrigID')
+    if trig_id is None:
+        trig_id = params.get('Trans_Num')
+
+    return GCNNotice(
+        ivorn=root.get('ivorn'),
+        role=root.get('role'),
+        notice_date=str(notice_date[0]) if notice_date else None,
+        notice_type=_optional(int, params.get('Packet_Type')),
+        trig_id=trig_id,
+        reliability=_optional(int, params.get('Reliability')),
+        most_likely_index=_optional(int, params.get('Most_Likely_Index')),
+        most_likely_prob=_optional(float, params.get('Most_Likely_Prob')),
+        lost_lock=bool(lost_lock) and lost_lock[0] == 'true',
+        healpix_url=params.get('HealPix_URL'),
+        lightcurve_url=params.get('LightCurve_URL'))